@@ -6,7 +6,7 @@ from chat_page import render_chat_page
 from auth_flow import render_auth_flow
 import bcrypt
 from utils.auth import load_chat, get_user_info, get_users_by_organization
-from utils.rag_pipeline import get_or_create_vectorstore, get_rag_chain
+from utils.rag_pipeline import get_org_rag_chain
 import time
 from upload_process_page import render_processing_status_page
 
@@ -28,9 +28,6 @@ if "chroma_dir" not in st.session_state:
     st.session_state.chroma_dir = None
 if "current_chat_title" not in st.session_state:
     st.session_state.current_chat_title = None
-if st.session_state.page == 'processing_status':
-    render_processing_status_page()
-
 st.set_page_config(page_title="AskEice - Document QA", layout="wide")
 
 # --- Authentication Flow ---
@@ -74,8 +71,7 @@ with st.sidebar:
         # Admin ke liye, yeh button seedhe chat page par redirect karega with the shared RAG pipeline
         if user_info and user_info["role"] == "admin":
             org_name = user_info['organization']
-            vectorstore = get_or_create_vectorstore(org_name)
-            st.session_state.rag_chain = get_rag_chain(vectorstore)
+            st.session_state.rag_chain = get_org_rag_chain(org_name)
             create_new_chat()
             st.session_state.page = "chat"
             st.session_state.current_chat_title = f"Chat with Knowledge Base"
@@ -137,11 +133,15 @@ if st.session_state.page == "upload":
         )
 
 
+elif st.session_state.page == "processing_status":
+    render_processing_status_page()
+
 elif st.session_state.page == "chat":
     # User's RAG pipeline will be loaded here
     user_info = get_user_info(st.session_state['user'])
     if user_info:
         org_name = user_info['organization']
-        vectorstore = get_or_create_vectorstore(org_name)
-        st.session_state.rag_chain = get_rag_chain(vectorstore)
+        # Cached per org; only rebuilt when the knowledge base version changes
+        st.session_state.rag_chain = get_org_rag_chain(org_name)
+        st.session_state.org_name = org_name
     render_chat_page()
@@ -0,0 +1,166 @@
+# benchmarks/common.py
+#
+# Helpers shared by the offline benchmarks: synthetic PDF corpora, latency percentiles
+# and a peak-memory sampler. Nothing here needs a GPU or network access.
+
+import os
+import json
+import time
+import platform
+import threading
+
+import numpy as np
+
+from utils.model_registry import current_rss_mb
+
+TOPICS = {
+    "safety": ["hazard", "inspection", "protective", "equipment", "incident", "procedure", "evacuation", "training"],
+    "finance": ["budget", "invoice", "expense", "approval", "quarter", "forecast", "audit", "reimbursement"],
+    "hr": ["leave", "employee", "onboarding", "appraisal", "policy", "holiday", "attendance", "grievance"],
+    "maintenance": ["pump", "valve", "bearing", "lubrication", "schedule", "vibration", "spare", "overhaul"],
+    "it": ["password", "network", "backup", "laptop", "access", "firewall", "ticket", "software"],
+    "quality": ["defect", "tolerance", "calibration", "sampling", "nonconformance", "gauge", "batch", "release"],
+}
+SENTENCE_TEMPLATES = [
+    "The {a} {b} must be reviewed before any {c} is recorded.",
+    "Every {a} is checked against the {b} requirements during the {c} review.",
+    "Staff should report each {a} to the {b} coordinator within two working days.",
+    "A {a} log is kept for every {b} and archived after the annual {c}.",
+    "Changes to the {a} process require sign-off from the {b} owner and the {c} lead.",
+    "The {a} team publishes a {b} summary at the end of each {c} cycle.",
+]
+COMPONENT_NAMES = ["Valve", "Pump", "Relay", "Bracket", "Sensor", "Gasket", "Actuator", "Coupling", "Manifold", "Filter"]
+
+
+def filler_paragraph(rng, topic, sentences=8):
+    words = TOPICS[topic]
+    return " ".join(
+        rng.choice(SENTENCE_TEMPLATES).format(a=rng.choice(words), b=rng.choice(words), c=rng.choice(words))
+        for _ in range(sentences)
+    )
+
+
+def make_facts(rng, doc_index, count):
+    """Planted facts: (component name, part number). Part numbers are unique per corpus."""
+    facts = []
+    for fact_index in range(count):
+        name = f"{rng.choice(COMPONENT_NAMES)} Assembly {doc_index}-{fact_index}"
+        part_number = f"PN-{doc_index:04d}-{fact_index:02d}{rng.choice('ABCDEFGH')}"
+        facts.append((name, part_number))
+    return facts
+
+
+def fact_sentence(name, part_number):
+    return f"The component {name} uses part number {part_number}."
+
+
+def fact_question(name):
+    return f"Which part number does the component {name} use?"
+
+
+def build_pdf(path, page_texts, scanned_pages=(), scan_dpi=150, fontsize=9):
+    """
+    Writes a PDF with one text block per page. Pages whose 0-based index is in
+    `scanned_pages` are rendered to an image and stored without a text layer, like a scan.
+    """
+    import fitz  # PyMuPDF
+
+    text_doc = fitz.open()
+    for text in page_texts:
+        page = text_doc.new_page(width=595, height=842)  # A4 in points
+        page.insert_textbox(fitz.Rect(50, 50, 545, 792), text, fontsize=fontsize)
+
+    scanned_pages = set(scanned_pages)
+    if not scanned_pages:
+        text_doc.save(path)
+        text_doc.close()
+        return
+
+    out_doc = fitz.open()
+    for page_index, page in enumerate(text_doc):
+        if page_index in scanned_pages:
+            pixmap = page.get_pixmap(dpi=scan_dpi)
+            out_page = out_doc.new_page(width=page.rect.width, height=page.rect.height)
+            out_page.insert_image(out_page.rect, pixmap=pixmap)
+        else:
+            out_doc.insert_pdf(text_doc, from_page=page_index, to_page=page_index)
+    out_doc.save(path)
+    out_doc.close()
+    text_doc.close()
+
+
+def build_text_pdf(path, page_texts, fontsize=9):
+    """Writes a digital (text-layer) PDF with one text block per page."""
+    build_pdf(path, page_texts, fontsize=fontsize)
+
+
+def generate_document_pages(rng, doc_index, pages, facts_per_doc, run_tag=""):
+    """
+    Page texts of one synthetic document plus its planted facts as
+    [(question, part_number, page_number)]. The run tag makes the PDF bytes unique per
+    run, so the extraction cache doesn't turn the benchmark into a cache benchmark.
+    """
+    topic = rng.choice(list(TOPICS))
+    page_texts = [
+        f"{topic.title()} manual {doc_index} {run_tag}\n\n" + "\n\n".join(filler_paragraph(rng, topic) for _ in range(3))
+        for _ in range(pages)
+    ]
+    planted = []
+    for name, part_number in make_facts(rng, doc_index, facts_per_doc):
+        page_index = rng.randrange(pages)
+        page_texts[page_index] += "\n\n" + fact_sentence(name, part_number)
+        planted.append((fact_question(name), part_number, page_index + 1))
+    return page_texts, planted
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """{"p50": ms, ...} of a list of latencies (empty dict if there are none)."""
+    if not values:
+        return {}
+    result = {f"p{p}": float(np.percentile(values, p)) for p in points}
+    result["mean"] = float(np.mean(values))
+    result["count"] = len(values)
+    return result
+
+
+class PeakRSSSampler:
+    """Samples this process's RSS on a background thread and keeps the high-water mark (MB)."""
+    def __init__(self, interval_seconds=0.05):
+        self.interval_seconds = interval_seconds
+        self.peak_mb = current_rss_mb() or 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = current_rss_mb()
+            if rss is not None and rss > self.peak_mb:
+                self.peak_mb = rss
+            self._stop.wait(self.interval_seconds)
+
+    def reset(self):
+        self.peak_mb = current_rss_mb() or 0.0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to '{path}'.")
@@ -0,0 +1,206 @@
+# benchmarks/ingestion_benchmark.py
+#
+# End-to-end ingestion benchmark over generated fixture PDFs: digital text, rasterized
+# scans and mixed documents at several page counts. Each fixture is ingested through
+# update_rag_pipeline into a throwaway org, and the report breaks wall time down per
+# stage (pdfplumber, quality check, rasterization, DocTR, sentence split, chunk
+# embedding, Chroma write, ...) using the spans in utils/telemetry.py. Extraction runs
+# in-process (one extract worker) so every stage is attributed.
+#
+# Stage times nest: "extract" contains extraction_cache, pdfplumber, quality_check,
+# rasterize and ocr; "chunk" contains sentence_split and chunk_embed. "embed",
+# "chroma_write" and "lexical_index" run on the pipeline's own threads and overlap the rest.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.ingestion_benchmark --pages 1,10,50 --output benchmarks/results/ingestion.json
+#   python -m benchmarks.ingestion_benchmark --baseline benchmarks/results/ingestion_baseline.json --fail-on-regression
+
+import os
+
+# Must be set before torch / transformers are imported by the project modules.
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+
+# The throwaway org's vector store, extraction cache entries and checkpoints go to a
+# scratch directory instead of the shared drive, so even a killed run leaves nothing in
+# the real data. Must also be set before config is imported.
+SCRATCH_DATA_DIR = None
+if not os.getenv("ASKEICE_DATA_DIR"):
+    SCRATCH_DATA_DIR = tempfile.mkdtemp(prefix="askeice-benchmark-")
+    os.environ["ASKEICE_DATA_DIR"] = SCRATCH_DATA_DIR
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from config import CHROMA_DB_DIRECTORY, OCR_DPI, OCR_BATCH_SIZE, PAGE_MIN_CHARS
+from utils.rag_pipeline import update_rag_pipeline, get_org_vectorstore, use_chat_llm, invalidate_org_rag_chain
+from utils.telemetry import StageTotals
+from benchmarks.common import PeakRSSSampler, build_pdf, generate_document_pages, environment_info, write_report
+
+FIXTURE_KINDS = ("text", "scanned", "mixed")
+
+
+def _scanned_pages(kind, pages):
+    if kind == "text":
+        return ()
+    if kind == "scanned":
+        return range(pages)
+    return range(1, pages, 2)  # mixed: every second page is a scan
+
+
+def _run_case(org_name, pdf_path, kind, pages, rss):
+    chunks_before = get_org_vectorstore(org_name)._collection.count()
+    rss.reset()
+    with StageTotals() as totals:
+        start = time.perf_counter()
+        update_rag_pipeline([pdf_path], org_name, extract_workers=1)
+        seconds = time.perf_counter() - start
+    return {
+        "kind": kind,
+        "pages": pages,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "chunks": get_org_vectorstore(org_name)._collection.count() - chunks_before,
+        "peak_rss_mb": rss.peak_mb,
+        "stages": totals.snapshot(),
+    }
+
+
+def run_benchmark(kinds, page_counts, seed, keep):
+    rng = random.Random(seed)
+    org_name = f"benchmark-{uuid.uuid4().hex[:8]}"
+    # Unique per run, so fixtures never hit the extraction cache of an earlier run.
+    run_tag = uuid.uuid4().hex[:8]
+    use_chat_llm(FakeListChatModel(responses=["unused"]))
+
+    report = {
+        "benchmark": "ingestion",
+        "environment": environment_info(),
+        "settings": {
+            "kinds": list(kinds),
+            "page_counts": list(page_counts),
+            "seed": seed,
+            "ocr_dpi": OCR_DPI,
+            "ocr_batch_size": OCR_BATCH_SIZE,
+            "page_min_chars": PAGE_MIN_CHARS,
+        },
+        "cases": [],
+    }
+    try:
+        with tempfile.TemporaryDirectory() as pdf_dir, PeakRSSSampler() as rss:
+            doc_index = 0
+            for kind in kinds:
+                for pages in page_counts:
+                    page_texts, _ = generate_document_pages(rng, doc_index, pages, 0, run_tag)
+                    pdf_path = os.path.join(pdf_dir, f"{kind}_{pages:03d}p.pdf")
+                    build_pdf(pdf_path, page_texts, scanned_pages=_scanned_pages(kind, pages))
+                    doc_index += 1
+
+                    print(f"Ingesting {kind} fixture with {pages} pages...")
+                    case = _run_case(org_name, pdf_path, kind, pages, rss)
+                    report["cases"].append(case)
+                    _print_case(case)
+    finally:
+        use_chat_llm(None)
+        invalidate_org_rag_chain(org_name)
+        if keep:
+            print(f"Benchmark org '{org_name}' kept in '{CHROMA_DB_DIRECTORY}'.")
+        elif SCRATCH_DATA_DIR:
+            shutil.rmtree(SCRATCH_DATA_DIR, ignore_errors=True)
+        else:
+            shutil.rmtree(os.path.join(CHROMA_DB_DIRECTORY, org_name), ignore_errors=True)
+    return report
+
+
+def compare_with_baseline(report, baseline, tolerance, min_seconds):
+    """
+    Compares each case with the baseline case of the same kind and page count. A metric
+    regresses when it is more than `tolerance` (fraction) worse than the baseline; time
+    differences below `min_seconds` are ignored as noise.
+    """
+    baseline_cases = {(case["kind"], case["pages"]): case for case in baseline.get("cases", [])}
+    comparisons = []
+    regressions = []
+
+    def check(case, metric, current, previous, is_time):
+        if previous is None or previous <= 0:
+            return
+        ratio = current / previous
+        entry = {"kind": case["kind"], "pages": case["pages"], "metric": metric,
+                 "baseline": previous, "current": current, "ratio": ratio}
+        comparisons.append(entry)
+        if ratio > 1 + tolerance and (not is_time or current - previous >= min_seconds):
+            regressions.append(entry)
+
+    for case in report["cases"]:
+        previous_case = baseline_cases.get((case["kind"], case["pages"]))
+        if previous_case is None:
+            continue
+        check(case, "seconds", case["seconds"], previous_case.get("seconds"), True)
+        check(case, "peak_rss_mb", case["peak_rss_mb"], previous_case.get("peak_rss_mb"), False)
+        for stage, totals in case["stages"].items():
+            previous_stage = previous_case.get("stages", {}).get(stage)
+            if previous_stage:
+                check(case, f"stage:{stage}", totals["seconds"], previous_stage["seconds"], True)
+
+    return {"tolerance": tolerance, "min_seconds": min_seconds, "comparisons": comparisons, "regressions": regressions}
+
+
+def _print_case(case):
+    print(
+        f"  {case['kind']:<8} {case['pages']:>4} pages: {case['seconds']:7.2f}s "
+        f"({case['pages_per_second']:.2f} pages/s, {case['chunks']} chunks, peak RSS {case['peak_rss_mb']:.0f} MB)"
+    )
+    for stage, totals in sorted(case["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True):
+        print(f"      {stage:<17} {totals['seconds']:8.3f}s  x{totals['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingestion benchmark over generated PDFs.")
+    parser.add_argument("--kinds", default=",".join(FIXTURE_KINDS), help="Comma-separated subset of text,scanned,mixed.")
+    parser.add_argument("--pages", default="1,10,50", help="Comma-separated page counts per fixture.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "ingestion.json"))
+    parser.add_argument("--baseline", help="Earlier report to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown as a fraction (0.2 = 20%%).")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="Ignore time differences smaller than this.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if anything regressed.")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark org's vector store afterwards.")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(FIXTURE_KINDS)
+    if unknown:
+        parser.error(f"Unknown fixture kinds: {', '.join(sorted(unknown))}")
+    page_counts = sorted({int(count) for count in args.pages.split(",") if count.strip()})
+
+    report = run_benchmark(kinds, page_counts, args.seed, args.keep)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["comparison"] = compare_with_baseline(report, baseline, args.tolerance, args.min_seconds)
+        for entry in report["comparison"]["regressions"]:
+            print(
+                f"REGRESSION {entry['kind']}/{entry['pages']}p {entry['metric']}: "
+                f"{entry['baseline']:.3f} -> {entry['current']:.3f} ({entry['ratio']:.2f}x)"
+            )
+        if not report["comparison"]["regressions"]:
+            print("No regressions against the baseline.")
+
+    write_report(report, args.output)
+    if args.fail_on_regression and report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# benchmarks/retrieval_benchmark.py
+#
+# Offline benchmark of ingestion, retrieval, reranking and the full RAG chain as the
+# knowledge base grows. Generates a synthetic PDF corpus with planted facts, ingests it
+# through update_rag_pipeline into a throwaway org, then replays questions about the
+# planted facts. The LLM is replaced by a local fake model, models run on CPU and the
+# Hugging Face hub is put in offline mode, so the run needs no GPU and no network (the
+# embedding and reranker models must already be in the local Hugging Face cache).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.retrieval_benchmark --docs 10,50,100 --pages 5 --queries 100
+
+import os
+
+# Must be set before torch / transformers are imported by the project modules.
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+
+# The throwaway org's vector store, extraction cache entries and checkpoints go to a
+# scratch directory instead of the shared drive, so even a killed run leaves nothing in
+# the real data. Must also be set before config is imported.
+SCRATCH_DATA_DIR = None
+if not os.getenv("ASKEICE_DATA_DIR"):
+    SCRATCH_DATA_DIR = tempfile.mkdtemp(prefix="askeice-benchmark-")
+    os.environ["ASKEICE_DATA_DIR"] = SCRATCH_DATA_DIR
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from config import (
+    CHROMA_DB_DIRECTORY, RETRIEVAL_K, RERANK_FINAL_K, HYBRID_SEARCH_ENABLED, RERANK_FIRST_STAGE,
+    INGEST_EXTRACT_WORKERS,
+)
+from utils.rag_pipeline import (
+    update_rag_pipeline, get_org_vectorstore, get_org_rag_chain, get_embeddings_model,
+    stream_rag_chain, use_chat_llm, invalidate_org_rag_chain,
+)
+from utils.retrieval import retrieve_candidates
+from utils.reranking import rerank_documents_with_scores
+from utils.lexical_index import get_lexical_index
+from utils.answer_cache import answer_cache
+from benchmarks.common import (
+    PeakRSSSampler, build_text_pdf, generate_document_pages, percentiles, environment_info, write_report,
+)
+
+
+def _ingest(org_name, pdf_paths, page_count, extract_workers, rss):
+    vectorstore = get_org_vectorstore(org_name)
+    chunks_before = vectorstore._collection.count()
+    rss.reset()
+    start = time.perf_counter()
+    update_rag_pipeline(pdf_paths, org_name, extract_workers=extract_workers)
+    seconds = time.perf_counter() - start
+    chunks_added = get_org_vectorstore(org_name)._collection.count() - chunks_before
+    return {
+        "documents": len(pdf_paths),
+        "pages": page_count,
+        "chunks": chunks_added,
+        "seconds": seconds,
+        "pages_per_second": page_count / seconds if seconds else 0.0,
+        "chunks_per_second": chunks_added / seconds if seconds else 0.0,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def _replay(org_name, questions, warmup, rss):
+    """Times each stage for every question and checks whether the planted answer was found."""
+    embeddings_model = get_embeddings_model()
+    vectorstore = get_org_vectorstore(org_name)
+    lexical_index = get_lexical_index(org_name) if HYBRID_SEARCH_ENABLED else None
+    rag_chain = get_org_rag_chain(org_name)
+
+    timings = {"embed_ms": [], "embed_cached_ms": [], "retrieval_ms": [], "rerank_ms": [], "chain_ms": []}
+    hits = {"retrieval": 0, "rerank": 0}
+
+    # Warm-up questions load the models and fill per-process caches; they aren't timed.
+    for question, _, _ in questions[:warmup]:
+        rerank_documents_with_scores(question, retrieve_candidates(vectorstore, question, lexical_index=lexical_index))
+
+    rss.reset()
+    for question, part_number, _ in questions:
+        # Questions repeat across warm-up and KB sizes; clear the query-embedding LRU so
+        # "embed_ms" is a real forward pass. "embed_cached_ms" is the memoized lookup.
+        embeddings_model.clear_query_cache()
+        start = time.perf_counter()
+        query_embedding = embeddings_model.embed_query(question)
+        embedded = time.perf_counter()
+        embeddings_model.embed_query(question)
+        timings["embed_cached_ms"].append((time.perf_counter() - embedded) * 1000)
+        embedded = time.perf_counter()
+        docs = retrieve_candidates(vectorstore, question, query_embedding=query_embedding, lexical_index=lexical_index)
+        retrieved = time.perf_counter()
+        reranked = rerank_documents_with_scores(question, docs)
+        done = time.perf_counter()
+
+        timings["embed_ms"].append((embedded - start) * 1000)
+        timings["retrieval_ms"].append((retrieved - embedded) * 1000)
+        timings["rerank_ms"].append((done - retrieved) * 1000)
+        hits["retrieval"] += any(part_number in doc.page_content for doc in docs)
+        hits["rerank"] += any(part_number in doc.page_content for doc in reranked)
+
+        # Full chain with the fake LLM; the answer and query-embedding caches are cleared so
+        # every call does the work.
+        answer_cache.invalidate(org_name)
+        embeddings_model.clear_query_cache()
+        start = time.perf_counter()
+        for _ in stream_rag_chain(rag_chain, {"query": question}):
+            pass
+        timings["chain_ms"].append((time.perf_counter() - start) * 1000)
+
+    count = len(questions) or 1
+    return {
+        "queries": len(questions),
+        "latency": {stage: percentiles(values) for stage, values in timings.items()},
+        f"recall@{RETRIEVAL_K}_retrieval": hits["retrieval"] / count,
+        f"recall@{RERANK_FINAL_K}_rerank": hits["rerank"] / count,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+def run_benchmark(doc_counts, pages_per_doc, facts_per_doc, max_queries, warmup, seed, extract_workers, keep):
+    rng = random.Random(seed)
+    org_name = f"benchmark-{uuid.uuid4().hex[:8]}"
+    run_tag = uuid.uuid4().hex[:8]
+    use_chat_llm(FakeListChatModel(responses=["This is a benchmark answer from a local fake model."]))
+    # Keep benchmark questions out of the persisted query-embedding cache
+    get_embeddings_model().query_cache_path = None
+
+    report = {
+        "benchmark": "retrieval",
+        "environment": environment_info(),
+        "settings": {
+            "doc_counts": doc_counts,
+            "pages_per_doc": pages_per_doc,
+            "facts_per_doc": facts_per_doc,
+            "max_queries": max_queries,
+            "seed": seed,
+            "extract_workers": extract_workers,
+            "retrieval_k": RETRIEVAL_K,
+            "rerank_final_k": RERANK_FINAL_K,
+            "hybrid_search": HYBRID_SEARCH_ENABLED,
+            "rerank_first_stage": RERANK_FIRST_STAGE,
+        },
+        "steps": [],
+    }
+
+    planted = []
+    ingested_docs = 0
+    try:
+        with tempfile.TemporaryDirectory() as pdf_dir, PeakRSSSampler() as rss:
+            for doc_count in doc_counts:
+                pdf_paths = []
+                for doc_index in range(ingested_docs, doc_count):
+                    page_texts, facts = generate_document_pages(rng, doc_index, pages_per_doc, facts_per_doc, run_tag)
+                    pdf_path = os.path.join(pdf_dir, f"manual_{doc_index:04d}.pdf")
+                    build_text_pdf(pdf_path, page_texts)
+                    pdf_paths.append(pdf_path)
+                    planted.extend(facts)
+                ingested_docs = doc_count
+
+                print(f"Ingesting {len(pdf_paths)} documents (KB size {doc_count})...")
+                ingestion = _ingest(org_name, pdf_paths, len(pdf_paths) * pages_per_doc, extract_workers, rss)
+
+                questions = rng.sample(planted, min(max_queries, len(planted)))
+                print(f"Replaying {len(questions)} questions...")
+                replay = _replay(org_name, questions, warmup, rss)
+
+                report["steps"].append({"kb_documents": doc_count, "ingestion": ingestion, "queries": replay})
+                _print_step(report["steps"][-1])
+    finally:
+        use_chat_llm(None)
+        invalidate_org_rag_chain(org_name)
+        if keep:
+            print(f"Benchmark org '{org_name}' kept in '{CHROMA_DB_DIRECTORY}'.")
+        elif SCRATCH_DATA_DIR:
+            shutil.rmtree(SCRATCH_DATA_DIR, ignore_errors=True)
+        else:
+            shutil.rmtree(os.path.join(CHROMA_DB_DIRECTORY, org_name), ignore_errors=True)
+    return report
+
+
+def _print_step(step):
+    ingestion, queries = step["ingestion"], step["queries"]
+    print(
+        f"\nKB of {step['kb_documents']} documents: ingested {ingestion['pages']} pages in {ingestion['seconds']:.1f}s "
+        f"({ingestion['pages_per_second']:.2f} pages/s, {ingestion['chunks_per_second']:.2f} chunks/s, "
+        f"peak RSS {ingestion['peak_rss_mb']:.0f} MB)"
+    )
+    for stage, stats in queries["latency"].items():
+        if stats:
+            print(f"  {stage:<15} p50={stats['p50']:8.1f}  p95={stats['p95']:8.1f}  p99={stats['p99']:8.1f}")
+    for key, value in queries.items():
+        if key.startswith("recall@"):
+            print(f"  {key}: {value:.3f}")
+    print(f"  peak RSS while querying: {queries['peak_rss_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval and reranking benchmark.")
+    parser.add_argument("--docs", default="10,50", help="Comma-separated KB sizes (documents), ingested incrementally.")
+    parser.add_argument("--pages", type=int, default=5, help="Pages per synthetic document.")
+    parser.add_argument("--facts", type=int, default=3, help="Planted facts (queryable answers) per document.")
+    parser.add_argument("--queries", type=int, default=100, help="Questions replayed per KB size.")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed warm-up questions per KB size.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--extract-workers", type=int, default=INGEST_EXTRACT_WORKERS)
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "retrieval.json"))
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark org's vector store afterwards.")
+    args = parser.parse_args()
+
+    doc_counts = sorted({int(count) for count in args.docs.split(",") if count.strip()})
+    report = run_benchmark(
+        doc_counts, args.pages, args.facts, args.queries, args.warmup, args.seed, args.extract_workers, args.keep
+    )
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ from utils.auth import rename_chat
 import logging
 logging.basicConfig(level=logging.INFO)
 import re
-from utils.rag_pipeline import get_rag_chain, get_or_create_vectorstore
+from utils.rag_pipeline import stream_rag_chain, get_org_documents
 
 # --- Custom CSS for a clean and modern look ---
 st.markdown("""
@@ -96,6 +96,16 @@ def render_chat_page():
             st.session_state.rename_mode = False
             st.rerun()
     
+    # Optionally scope answers to specific documents of the knowledge base
+    if st.session_state.get("org_name"):
+        document_names = [doc["source"] for doc in get_org_documents(st.session_state.org_name)]
+        if document_names:
+            st.multiselect(
+                "Limit answers to these documents (leave empty to search all):",
+                options=document_names,
+                key="document_filter",
+            )
+
     # Display chat messages directly using st.chat_message
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -113,48 +123,40 @@ def render_chat_page():
         with st.chat_message("assistant"):
             if st.session_state.rag_chain:
                 try:
+                    # History goes in as structured messages; the chain trims it to a token budget.
+                    # The prompt just appended above is the query, not part of the history.
+                    chat_history = st.session_state.messages[:-1]
+                    logging.info(f"Chat history: {len(chat_history)} messages")
+
+                    selected_documents = st.session_state.get("document_filter") or []
+                    filters = {"sources": selected_documents} if selected_documents else None
+
+                    events = stream_rag_chain(
+                        st.session_state.rag_chain,
+                        {"query": user_prompt, "history": chat_history, "filters": filters},
+                    )
+
+                    # Retrieval and reranking happen before the first event; the answer then streams in.
                     with st.spinner("Thinking..."):
-                        chat_history = st.session_state.messages[-5:]
-                        
-                        formatted_history = "\n".join([
-                            f"Human: {msg['content']}" if msg['role'] == 'user' else f"AI: {msg['content']}"
-                            for msg in chat_history
-                        ])
-                        logging.info(f"Formatted Chat History: {formatted_history}")
-                        
-                        response = st.session_state.rag_chain.invoke(
-                            f"{user_prompt}, {formatted_history}",
-                        )
-                        # response = st.session_state.rag_chain.invoke(
-                        #     {
-                        #         "query": user_prompt,
-                        #         "chat_history": formatted_history
-                        #     }
-                        # )
-                        
+                        _, sources = next(events)
+
+                    # Display sources first
+                    if sources:
+                        unique_sources = sorted(list(set(sources)))
+                        st.markdown("---")
+                        st.markdown("#### References")
+                        for source in unique_sources:
+                            st.markdown(f"- **{source}**")
 
-                    # Display the assistant's response
-                    # st.markdown(response)
-                    # st.session_state.messages.append({"role": "assistant", "content": response})
-                    if isinstance(response, dict) and 'answer' in response:
-                        answer_text = response['answer']
-                        sources = response.get('sources', [])
-                        
-                        # Display sources first
-                        if sources:
-                            unique_sources = sorted(list(set(sources)))
-                            st.markdown("---")
-                            st.markdown("#### References")
-                            for source in unique_sources:
-                                st.markdown(f"- **{source}**")
-                        
-                        # Display the final answer
-                        st.markdown(answer_text)
-                        
-                        st.session_state.messages.append({"role": "assistant", "content": answer_text})
-                    else:
-                        st.error("Received an unexpected response format from the RAG chain.")
-                        st.session_state.messages.append({"role": "assistant", "content": "An error occurred."})
+                    # Render the answer progressively as tokens arrive
+                    answer_placeholder = st.empty()
+                    answer_text = ""
+                    for _, token in events:
+                        answer_text += token
+                        answer_placeholder.markdown(answer_text + "▌")
+                    answer_placeholder.markdown(answer_text)
+                    
+                    st.session_state.messages.append({"role": "assistant", "content": answer_text})
                 except Exception as e:
                     st.error(f"An error occurred during interaction: {e}")
                     st.session_state.messages.append({"role": "assistant", "content": f"An error occurred: {e}"})
@@ -8,17 +8,21 @@ load_dotenv()
 
 # --- Paths ---
 # SHARED_DRIVE_PATH = r"\\LAPTOP-H6BPDG3T\Shared_08"
-SHARED_DRIVE_PATH = os.path.dirname(os.path.abspath(__file__))
+# ASKEICE_DATA_DIR moves every data directory below (vector stores, caches, jobs, outputs)
+# elsewhere; the benchmarks point it at a scratch directory.
+SHARED_DRIVE_PATH = os.getenv("ASKEICE_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
 
 UPLOAD_FOLDER = os.path.join(SHARED_DRIVE_PATH, "Documents")
 CHROMA_DB_DIRECTORY = os.path.join(SHARED_DRIVE_PATH, "chroma_db_data")
 CHATS_DIR = os.path.join(SHARED_DRIVE_PATH, "outputs", "chats")
+EXTRACTION_CACHE_DIR = os.path.join(SHARED_DRIVE_PATH, "cache", "extraction")
 SHARED_PDFS_PATH = os.path.join(SHARED_DRIVE_PATH, "pdfs")
 
 os.makedirs(SHARED_PDFS_PATH, exist_ok=True) 
 # os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CHROMA_DB_DIRECTORY, exist_ok=True)
 os.makedirs(CHATS_DIR, exist_ok=True)
+os.makedirs(EXTRACTION_CACHE_DIR, exist_ok=True)
 
 poppler_bin_path = r"C:\Users\Gautam kumar\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin"
 
@@ -31,6 +35,132 @@ MAX_FILE_SIZE_MB = 10
 MAX_FILES = 10
 MAX_PAGES = 150
 
+# --- Model Constants ---
+# Every model below is loaded once per process by utils/model_registry.py.
+EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
+RERANKER_MODEL_NAME = "BAAI/bge-reranker-large"
+DOCTR_DET_ARCH = "db_resnet50"
+DOCTR_RECO_ARCH = "crnn_vgg16_bn"
+
+# --- OCR ---
+# Pages are rasterized and OCR'd in fixed-size batches, so peak memory is bounded by
+# OCR_BATCH_SIZE (times OCR_WORKERS) rather than by the page count of the document.
+OCR_DPI = 300
+OCR_BATCH_SIZE = 4   # pages rasterized and sent to DocTR at a time
+OCR_WORKERS = 1      # processes OCR'ing batches in parallel (1 = in-process)
+PAGE_MIN_CHARS = 20  # pages with less text than this are treated as blank and OCR'd
+# Text-layer quality gate: a page is OCR'd when more than QUALITY_MAX_UNKNOWN_RATIO of its
+# words are not in the dictionary. The ratio is estimated from a word sample, grown until
+# its Wilson confidence interval (QUALITY_CONFIDENCE_Z) falls on one side of the threshold.
+QUALITY_MAX_UNKNOWN_RATIO = 0.15
+QUALITY_SAMPLE_SIZE = 200
+QUALITY_CONFIDENCE_Z = 2.58   # ~99% confidence
+
+# --- Extraction Cache ---
+# Per-page extraction results keyed by SHA-256 of the PDF bytes, evicted least-recently-used first.
+EXTRACTION_CACHE_MAX_MB = 512
+
+# --- Chunking ---
+EMBED_BATCH_SIZE = 64                # texts per forward pass of the embedding model
+CHUNK_BUFFER_SIZE = 2                # neighbouring sentences embedded with each sentence
+CHUNK_BREAKPOINT_PERCENTILE = 95     # distance percentile above which a chunk boundary is placed
+# "mean": chunk embedding = mean of its sentence-window embeddings (no second embedding pass)
+# "reembed": embed each finished chunk again with the embedding model
+CHUNK_EMBEDDING_MODE = "mean"
+
+# --- Retrieval & Reranking ---
+RETRIEVAL_K = 20                 # candidate chunks passed to the reranker per query
+# Org stores also keep a BM25 index (utils/lexical_index.py); dense and lexical results
+# are fused with reciprocal rank fusion before reranking. The fused "retrieval_score" is
+# scaled to [0, 1]; each chunk's embedding similarity is kept separately in "dense_score".
+HYBRID_SEARCH_ENABLED = True
+HYBRID_SEARCH_K = 20             # chunks fetched from each of the dense and lexical retrievers
+RRF_K = 60                       # reciprocal rank fusion constant
+RERANK_FINAL_K = 7               # chunks passed on to the prompt
+# Cheap first stage of the reranking cascade: "embedding" (retrieval similarity, free),
+# "cross_encoder" (RERANK_FIRST_STAGE_MODEL) or None to score every candidate with the large model.
+RERANK_FIRST_STAGE = "embedding"
+RERANK_FIRST_STAGE_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_FIRST_STAGE_KEEP = 10     # candidates the large cross-encoder scores after the first stage
+# Skip the large cross-encoder when the first-stage score gap at the RERANK_FINAL_K cut is at
+# least this big (per first-stage type; None disables early exit for that stage). The
+# "embedding" margin is in cosine similarity, also in hybrid mode, where candidates found only
+# by the lexical index have no similarity and always go through the cross-encoder.
+RERANK_EARLY_EXIT_MARGIN = {"embedding": 0.15, "cross_encoder": 4.0}
+RERANK_AUDIT_RATE = 0.05         # fraction of queries also fully reranked to log cascade recall
+
+# --- Query Embedding Cache ---
+QUERY_EMBEDDING_CACHE_SIZE = 2048     # query strings memoized by LlamaIndexEmbeddingWrapper
+# Set to a file path (e.g. os.path.join(SHARED_DRIVE_PATH, "cache", "query_embeddings.json"))
+# to keep the memoized query embeddings across restarts; None keeps them in memory only.
+QUERY_EMBEDDING_CACHE_PATH = None
+
+# --- Answer Cache ---
+# Repeated questions are answered from an org-scoped cache when the query embedding is
+# similar enough and retrieval returned exactly the same chunks.
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY = 0.95
+ANSWER_CACHE_TTL_SECONDS = 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 256   # per organization
+
+# --- Chat Input ---
+CHAT_HISTORY_TOKEN_BUDGET = 800          # approx. tokens of recent history sent to the LLM
+# Rewrite follow-up questions into standalone ones before retrieval (one extra cheap LLM call)
+QUERY_CONDENSATION_ENABLED = False
+QUERY_CONDENSATION_MODEL = "gemini-2.0-flash-lite"
+
+# --- Context Packing ---
+CONTEXT_TOKEN_BUDGET = 3000        # approx. tokens of document context per prompt
+CONTEXT_CHUNK_TOKEN_CAP = 900      # no single chunk may take more than this
+CONTEXT_DEDUPE_OVERLAP = 0.8       # word overlap at which a same-page chunk counts as a duplicate
+CONTEXT_MIN_TAIL_TOKENS = 80       # don't add a trimmed tail chunk smaller than this
+
+# --- Chat Concurrency ---
+LLM_MAX_CONCURRENCY = 8       # Gemini calls in flight per process, across all sessions
+# Reranker micro-batching: pairs from concurrent queries are scored in one forward pass
+RERANK_MAX_BATCH_SIZE = 64    # max (query, passage) pairs per forward pass
+RERANK_MAX_WAIT_MS = 10       # how long the first request of a batch waits for others
+
+# --- Ingestion Jobs ---
+# Uploads are queued in SQLite and ingested by background worker processes
+# (ingestion_worker.py), so a long OCR + embedding run isn't tied to a browser session.
+JOBS_DIR = os.path.join(SHARED_DRIVE_PATH, "jobs")
+JOB_QUEUE_DB_PATH = os.path.join(JOBS_DIR, "ingestion_jobs.sqlite3")
+JOB_UPLOAD_DIR = os.path.join(JOBS_DIR, "uploads")   # one sub-directory of PDFs per job
+JOB_WORKERS = 1                  # worker processes started by ingestion_worker.py
+JOB_EXTRACT_WORKERS = 1          # extraction processes per job (1 = per-page progress reporting)
+JOB_MAX_ATTEMPTS = 3             # a failing job is retried until it has run this many times
+JOB_RETRY_BACKOFF_SECONDS = 30   # delay before retry n is n times this
+JOB_HEARTBEAT_SECONDS = 10
+JOB_STALE_SECONDS = 120          # running jobs without a heartbeat for this long are requeued
+JOB_POLL_SECONDS = 2             # how often idle workers and the status page poll the queue
+JOB_AUTOSTART_WORKER = True      # the app starts a worker process if none is alive
+
+os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+
+# --- Stage Metrics ---
+# Per-stage timing spans (utils/telemetry.py) exported as "jsonl" (one line per span),
+# "prometheus" (histograms per stage and org, rewritten every METRICS_FLUSH_SECONDS) or None.
+# "{pid}" in a path is replaced by the process ID, so worker processes don't overwrite each other.
+METRICS_SINK = None
+METRICS_JSONL_PATH = os.path.join(SHARED_DRIVE_PATH, "outputs", "metrics", "stages.jsonl")
+METRICS_PROMETHEUS_PATH = os.path.join(SHARED_DRIVE_PATH, "outputs", "metrics", "askeice_{pid}.prom")
+METRICS_FLUSH_SECONDS = 15
+METRICS_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# --- Ingestion Pipeline ---
+# Extraction (pdfplumber/OCR) runs in a process pool; chunking, embedding and
+# Chroma writes run as separate stages connected by bounded queues.
+INGEST_EXTRACT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # 1 = extract in-process
+INGEST_QUEUE_SIZE = 4           # max documents/batches waiting between two stages
+INGEST_EMBED_BATCH_SIZE = 64    # chunks per embedding call
+INGEST_WRITE_BATCH_SIZE = 256   # chunks per Chroma write
+# Per-document checkpoints (chunked + embedded, committed) so a failed or interrupted
+# run resumes where it stopped; OCR progress is checkpointed in the extraction cache.
+INGEST_CHECKPOINTS_ENABLED = True
+INGEST_CHECKPOINT_DIR = os.path.join(SHARED_DRIVE_PATH, "cache", "checkpoints")
+INGEST_CHECKPOINT_MAX_AGE_HOURS = 72   # checkpoints of abandoned runs are deleted after this
+
 AVAILABLE_ROLES = ["user", "admin"]
 AVAILABLE_ORGANIZATIONS = ["Eice Technology", "Google", "Public"]
 
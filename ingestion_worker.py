@@ -0,0 +1,179 @@
+# ingestion_worker.py
+#
+# Background worker for the ingestion job queue (utils/job_queue.py). Uploads from the
+# Streamlit app are queued as jobs; this process claims them one at a time, runs
+# update_rag_pipeline, and records per-file / per-page progress, retries and failures in
+# the queue database. The app starts one worker automatically when JOB_AUTOSTART_WORKER is
+# set; to run them yourself (e.g. several, on a machine with more memory):
+#
+#   python ingestion_worker.py --workers 2
+#
+# Every worker process loads its own embedding / OCR models, so size --workers to memory.
+# Workers are the only writers of the org vector stores (the app just reads them), and each
+# write batch holds the org's cross-process Chroma write lock (utils/chroma_lock.py).
+
+import os
+import time
+import uuid
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+
+from config import JOB_WORKERS, JOB_EXTRACT_WORKERS, JOB_HEARTBEAT_SECONDS, JOB_POLL_SECONDS
+from utils.job_queue import (
+    JobCancelled,
+    SUCCEEDED,
+    CANCELLED,
+    register_worker,
+    unregister_worker,
+    worker_heartbeat,
+    claim_next_job,
+    heartbeat_job,
+    update_progress,
+    finish_job,
+    fail_job,
+    new_progress,
+    apply_progress_event,
+)
+
+# Progress is written to the queue at most this often (document-level events always are)
+PROGRESS_WRITE_SECONDS = 1.0
+
+
+class _JobHeartbeat:
+    """Refreshes the job's heartbeat on a thread and notices cancellation requests."""
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.cancelled = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                worker_heartbeat(self.worker_id, self.job_id)
+                if heartbeat_job(self.job_id, self.worker_id):
+                    self.cancelled.set()
+            except Exception:
+                logging.exception(f"Heartbeat for job {self.job_id} failed.")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(job, worker_id):
+    # Imported here so that the parent process of a multi-worker run doesn't load the models
+    from utils.rag_pipeline import update_rag_pipeline
+
+    job_id = job["id"]
+    progress = new_progress(job["files"])
+    last_write = 0.0
+    logging.info(f"Worker {worker_id} running job {job_id} (attempt {job['attempts']}) for '{job['org_name']}'.")
+
+    with _JobHeartbeat(job_id, worker_id) as job_heartbeat:
+        def on_progress(event):
+            nonlocal last_write
+            apply_progress_event(progress, event)
+            now = time.monotonic()
+            if event["event"] != "pages_extracted" or now - last_write >= PROGRESS_WRITE_SECONDS:
+                last_write = now
+                update_progress(job_id, progress)
+            if job_heartbeat.cancelled.is_set():
+                raise JobCancelled()
+
+        try:
+            update_progress(job_id, progress)
+            update_rag_pipeline(
+                job["files"], job["org_name"], extract_workers=JOB_EXTRACT_WORKERS, progress_callback=on_progress
+            )
+        except (JobCancelled, Exception) as e:
+            update_progress(job_id, progress)
+            # A cancellation raised on a pipeline stage thread surfaces as that stage's abort error
+            if isinstance(e, JobCancelled) or job_heartbeat.cancelled.is_set():
+                finish_job(job_id, CANCELLED, error="Cancelled by user.")
+                logging.info(f"Job {job_id} cancelled.")
+            else:
+                status = fail_job(job_id, f"{type(e).__name__}: {e}")
+                logging.exception(f"Job {job_id} failed; now {status}.")
+            return
+
+    update_progress(job_id, progress)
+    finish_job(job_id, SUCCEEDED, result={
+        "files_done": progress["files_done"],
+        "pages_done": progress["pages_done"],
+        "chunks_written": progress["chunks_written"],
+    })
+    logging.info(f"Job {job_id} finished: {progress['chunks_written']} chunks written.")
+
+
+def work_loop(stop_event=None):
+    """Claims and runs jobs until `stop_event` is set."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    stop_event = stop_event or threading.Event()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    register_worker(worker_id)
+    logging.info(f"Ingestion worker {worker_id} started.")
+    try:
+        while not stop_event.is_set():
+            job = claim_next_job(worker_id)
+            if job is None:
+                worker_heartbeat(worker_id)
+                stop_event.wait(JOB_POLL_SECONDS)
+                continue
+            worker_heartbeat(worker_id, job["id"])
+            run_job(job, worker_id)
+            worker_heartbeat(worker_id)
+    finally:
+        unregister_worker(worker_id)
+        logging.info(f"Ingestion worker {worker_id} stopped.")
+
+
+def _worker_process(stop_event):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl+C and sets stop_event
+    work_loop(stop_event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background ingestion workers.")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        try:
+            work_loop(stop_event)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # Separate processes (not threads): each gets its own CUDA context and model copies
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+    processes = [
+        ctx.Process(target=_worker_process, args=(stop_event,), name=f"ingestion-worker-{i}")
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
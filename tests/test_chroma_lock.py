@@ -0,0 +1,34 @@
+import sys
+import subprocess
+
+import chromadb
+
+from utils.chroma_lock import reopen_chroma_client
+
+
+def _nearest_ids(client):
+    collection = client.get_collection("langchain")
+    return collection.query(query_embeddings=[[0.0, 1.0]], n_results=2)["ids"][0]
+
+
+def test_reopened_client_sees_writes_from_another_process(tmp_path):
+    chroma_dir = str(tmp_path / "org")
+    client = chromadb.PersistentClient(path=chroma_dir)
+    client.get_or_create_collection("langchain").upsert(ids=["a"], embeddings=[[1.0, 0.0]], documents=["a"])
+    assert _nearest_ids(client) == ["a"]  # loads the vector index into this process
+
+    # An ingestion worker adds a chunk
+    subprocess.run(
+        [sys.executable, "-c", (
+            "import chromadb, sys; "
+            "chromadb.PersistentClient(path=sys.argv[1]).get_collection('langchain')"
+            ".upsert(ids=['b'], embeddings=[[0.0, 1.0]], documents=['b'])"
+        ), chroma_dir],
+        check=True,
+    )
+    assert _nearest_ids(client) == ["a"]
+
+    assert _nearest_ids(reopen_chroma_client(chroma_dir)) == ["b", "a"]
+    # Clients opened afterwards share the reopened system; the old one keeps working
+    assert _nearest_ids(chromadb.PersistentClient(path=chroma_dir)) == ["b", "a"]
+    assert _nearest_ids(client) == ["a"]
@@ -0,0 +1,56 @@
+import utils.extraction as extraction
+
+
+def test_page_that_cannot_be_ocrd_is_reported_and_the_rest_is_kept(monkeypatch):
+    stored = []
+    monkeypatch.setattr(extraction, "extract_pages_with_pdfplumber", lambda pdf_path: ["", "", ""])
+    monkeypatch.setattr(extraction, "load_cached_pages", lambda file_hash, version: None)
+    monkeypatch.setattr(extraction, "store_cached_pages", lambda *args, **kwargs: stored.append(args))
+    monkeypatch.setattr(extraction, "load_partial_pages", lambda file_hash, version: {})
+    monkeypatch.setattr(extraction, "store_partial_pages", lambda file_hash, version, pages: None)
+
+    def ocr_page_batch(pdf_path, page_numbers):
+        if 2 in page_numbers:
+            raise ValueError("corrupt page image")
+        return {page_number: f"OCR text of page {page_number}" for page_number in page_numbers}
+
+    monkeypatch.setattr(extraction, "_ocr_page_batch", ocr_page_batch)
+    events = []
+
+    pages = extraction.extract_pdf_pages_cached(
+        "manual.pdf", ocr_workers=1, file_hash="abc", progress_callback=events.append
+    )
+
+    # The bad page only loses itself, not the batch it was in
+    assert [page["method"] for page in pages] == ["doctr", "pdfplumber_ocr_failed", "doctr"]
+    assert pages[2]["text"] == "OCR text of page 3"
+    assert {"event": "ocr_failed", "source": "manual.pdf", "pages": [2]} in events
+    # An incomplete extraction is never cached
+    assert stored == []
+
+
+def test_hyphenated_and_possessive_prose_passes_the_quality_gate():
+    text = "Employee's handbook: don't forget state-of-the-art e-mail procedures for full-time staff. " * 5
+
+    assert extraction.is_text_quality_good(text)
+
+
+def test_junk_ocr_text_fails_the_quality_gate():
+    text = "l1I|l ,.;' rn~ ¦¦ 0O0o wv/\\ iIl1 ;:;, ~~~ ))(( xqzv rnrn lIl| " * 10
+
+    assert not extraction.is_text_quality_good(text)
+
+
+def test_borderline_text_is_decided_on_every_word():
+    # Near the threshold the sampled interval never clears it, so every word is checked
+    def page(unknown):
+        return " ".join(["policy"] * (1000 - unknown) + ["xqzv"] * unknown)
+
+    assert extraction.is_text_quality_good(page(150), max_unknown_ratio=0.15)
+    assert not extraction.is_text_quality_good(page(170), max_unknown_ratio=0.15)
+
+
+def test_wilson_interval_contains_the_observed_ratio():
+    low, high = extraction._wilson_interval(30, 200, 2.58)
+
+    assert 0 < low < 30 / 200 < high < 1
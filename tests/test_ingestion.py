@@ -0,0 +1,165 @@
+import os
+
+import pytest
+from langchain.schema import Document
+
+import utils.ingestion as ingestion
+from utils.ingestion import run_ingestion_pipeline, make_chunk_id
+from utils.ingestion_checkpoint import IngestionCheckpoints
+from utils.lexical_index import LexicalIndex
+
+
+class _Collection:
+    """In-memory stand-in for the Chroma collection calls ingestion makes."""
+    def __init__(self, fail_on_upsert=None):
+        self.records = {}
+        self.upserts = []
+        self.fail_on_upsert = fail_on_upsert
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.upserts.append(list(ids))
+        if len(self.upserts) == self.fail_on_upsert:
+            raise RuntimeError("Chroma write failed")
+        for chunk_id, embedding, metadata, text in zip(ids, embeddings, metadatas, documents):
+            self.records[chunk_id] = (text, dict(metadata), list(embedding))
+
+    def get(self, ids=None, where=None, include=None):
+        matched = [
+            chunk_id for chunk_id, (_, metadata, _) in self.records.items()
+            if (ids is None or chunk_id in ids)
+            and all(metadata.get(key) == value for key, value in (where or {}).items())
+        ]
+        return {"ids": matched}
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.records.pop(chunk_id, None)
+
+
+class _VectorStore:
+    def __init__(self, collection):
+        self._collection = collection
+
+
+class _Embeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def _pdfs(tmp_path, texts_by_name):
+    paths = []
+    for name, text in texts_by_name.items():
+        path = tmp_path / name
+        path.write_bytes(text.encode("utf-8"))  # distinct bytes, so distinct file hashes
+        paths.append(str(path))
+    return paths
+
+
+def _chunker(calls):
+    def chunk_document(extracted_text, pdf_path):
+        calls.append(os.path.basename(pdf_path))
+        source = os.path.basename(pdf_path)
+        # Like the semantic chunker, chunks arrive with their embeddings
+        return [
+            (Document(page_content=part, metadata={"source": source}), [float(i), 0.5])
+            for i, part in enumerate(extracted_text.split("|"))
+        ]
+    return chunk_document
+
+
+def test_interrupted_run_resumes_from_checkpoints(tmp_path, monkeypatch):
+    texts = {"a.pdf": "alpha one|alpha two", "b.pdf": "beta one|beta two|beta three"}
+    pdf_paths = _pdfs(tmp_path, texts)
+    extracted = []
+
+    def get_extracted_text(pdf_files, org_name, ocr_workers=1, progress_callback=None):
+        extracted.append(os.path.basename(pdf_files[0]))
+        return texts[os.path.basename(pdf_files[0])]
+
+    monkeypatch.setattr(ingestion, "get_extracted_text", get_extracted_text)
+    checkpoints = IngestionCheckpoints("acme", root=str(tmp_path / "checkpoints"))
+    options = dict(extract_workers=1, embed_batch_size=2, write_batch_size=2, checkpoints=checkpoints)
+
+    # First run: a.pdf is written, then the store fails halfway through b.pdf
+    collection = _Collection(fail_on_upsert=3)
+    chunked, embeddings = [], _Embeddings()
+    with pytest.raises(RuntimeError):
+        run_ingestion_pipeline(pdf_paths, "acme", _VectorStore(collection), _chunker(chunked), embeddings, **options)
+    assert len(collection.records) == 4  # a.pdf's two chunks and the first two of b.pdf
+    hash_a, hash_b = (ingestion.file_sha256(path) for path in pdf_paths)
+    assert checkpoints.load_committed(hash_a) is not None
+    assert checkpoints.load_committed(hash_b) is None
+    assert len(checkpoints.load_chunks(hash_b)) == 3
+
+    # Second run: nothing is extracted, chunked or embedded again
+    collection.fail_on_upsert = None
+    collection.upserts.clear()
+    extracted.clear()
+    stats = run_ingestion_pipeline(pdf_paths, "acme", _VectorStore(collection), _chunker(chunked), embeddings, **options)
+
+    assert extracted == [] and chunked == ["a.pdf", "b.pdf"]  # only from the first run
+    assert embeddings.calls == 0
+    assert stats["resumed"] == 2 and stats["chunks"] == 3
+    # Only b.pdf is written again; upserts by chunk ID leave no duplicates
+    written_again = [chunk_id for batch in collection.upserts for chunk_id in batch]
+    assert sorted(written_again) == sorted(collection.get(where={"source": "b.pdf"})["ids"])
+    assert len(collection.records) == 5
+    assert sorted(text for text, _, _ in collection.records.values()) == sorted(
+        "|".join(texts.values()).split("|")
+    )
+    # The embeddings come from the chunk checkpoint
+    assert [embedding for text, _, embedding in collection.records.values() if text == "beta three"] == [[2.0, 0.5]]
+    # A finished run leaves nothing to resume
+    assert checkpoints.load_committed(hash_a) is None and checkpoints.load_chunks(hash_b) is None
+
+
+def test_chunk_id_depends_only_on_source_and_text():
+    assert make_chunk_id("a.pdf", "Valve schedule") == make_chunk_id("a.pdf", "Valve schedule")
+    assert make_chunk_id("a.pdf", "Valve schedule") != make_chunk_id("b.pdf", "Valve schedule")
+    assert make_chunk_id("a.pdf", "Valve schedule") != make_chunk_id("a.pdf", "Valve schedule v2")
+
+
+def test_reuploaded_document_keeps_unchanged_chunks_and_drops_only_stale_ones(tmp_path, monkeypatch):
+    texts = {}
+    monkeypatch.setattr(
+        ingestion, "get_extracted_text",
+        lambda pdf_files, org_name, ocr_workers=1, progress_callback=None: texts[pdf_files[0]],
+    )
+    collection = _Collection()
+    lexical_index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+
+    def ingest(name, text):
+        folder = tmp_path / f"upload{len(texts)}"  # a fresh upload folder per upload
+        folder.mkdir()
+        path = str(folder / name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        texts[path] = text
+        return run_ingestion_pipeline(
+            [path], "acme", _VectorStore(collection), _chunker([]), _Embeddings(),
+            extract_workers=1, lexical_index=lexical_index,
+        )
+
+    ingest("a.pdf", "intro|valve schedule|old appendix")
+    ingest("b.pdf", "old appendix|holiday policy")
+    ids_before = set(collection.records)
+
+    stats = ingest("a.pdf", "intro|valve schedule|new appendix")
+
+    # The unchanged chunks are upserted under the same IDs instead of being duplicated
+    assert set(collection.upserts[-1]) >= {make_chunk_id("a.pdf", "intro"), make_chunk_id("a.pdf", "valve schedule")}
+    assert set(collection.records) == ids_before - {make_chunk_id("a.pdf", "old appendix")} | {
+        make_chunk_id("a.pdf", "new appendix")
+    }
+    assert stats["replaced"] == 1
+    # Identical text in another document is not stale
+    assert make_chunk_id("b.pdf", "old appendix") in collection.records
+    # The lexical index drops the same chunks
+    assert lexical_index.count() == len(collection.records)
+    assert set(dict(lexical_index.search("appendix", 10))) == {
+        make_chunk_id("a.pdf", "new appendix"), make_chunk_id("b.pdf", "old appendix")
+    }
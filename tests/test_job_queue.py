@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import types
+
+import pytest
+
+import ingestion_worker
+import utils.job_queue as job_queue
+from utils.job_queue import QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED
+
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_DB_PATH", str(tmp_path / "jobs" / "ingestion_jobs.sqlite3"))
+    monkeypatch.setattr(job_queue, "JOB_UPLOAD_DIR", str(tmp_path / "jobs" / "uploads"))
+    return tmp_path / "jobs"
+
+
+def _submit(tmp_path, name="manual.pdf", **kwargs):
+    staging = tmp_path / "staging"
+    staging.mkdir(exist_ok=True)
+    pdf_path = staging / name
+    pdf_path.write_bytes(b"%PDF-1.4")
+    return job_queue.submit_job("acme", [str(pdf_path)], submitted_by="admin", **kwargs)
+
+
+def _make_stale(job_id):
+    with job_queue._connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - job_queue.JOB_STALE_SECONDS - 1, job_id)
+        )
+
+
+def test_submitted_job_owns_its_files(tmp_path):
+    job_id = _submit(tmp_path)
+
+    job = job_queue.get_job(job_id)
+    assert job["status"] == QUEUED and job["attempts"] == 0
+    assert job["files"] == [os.path.join(job_queue.job_upload_dir(job_id), "manual.pdf")]
+    assert os.path.exists(job["files"][0])
+    assert not (tmp_path / "staging" / "manual.pdf").exists()
+
+
+def test_each_job_is_claimed_by_one_worker(tmp_path):
+    job_ids = {_submit(tmp_path, "a.pdf"), _submit(tmp_path, "b.pdf")}
+
+    first = job_queue.claim_next_job("worker-1")
+    second = job_queue.claim_next_job("worker-2")
+
+    assert {first["id"], second["id"]} == job_ids
+    assert first["status"] == RUNNING and first["worker_id"] == "worker-1" and first["attempts"] == 1
+    assert job_queue.claim_next_job("worker-3") is None
+
+
+def test_job_of_a_dead_worker_is_requeued(tmp_path):
+    job_id = _submit(tmp_path)
+    job_queue.claim_next_job("worker-1")
+    _make_stale(job_id)
+
+    job = job_queue.claim_next_job("worker-2")
+
+    assert job["id"] == job_id
+    assert job["worker_id"] == "worker-2" and job["attempts"] == 2
+    assert "stopped responding" in job["error"]
+
+
+def test_job_of_a_dead_worker_fails_without_attempts_left(tmp_path):
+    job_id = _submit(tmp_path, max_attempts=1)
+    job_queue.claim_next_job("worker-1")
+    _make_stale(job_id)
+
+    assert job_queue.claim_next_job("worker-2") is None
+    assert job_queue.get_job(job_id)["status"] == FAILED
+
+
+def test_failed_attempt_is_retried_after_a_backoff(tmp_path):
+    job_id = _submit(tmp_path, max_attempts=2)
+    job_queue.claim_next_job("worker-1")
+
+    assert job_queue.fail_job(job_id, "RuntimeError: boom") == QUEUED
+    job = job_queue.get_job(job_id)
+    assert job["status"] == QUEUED and job["available_at"] > time.time()
+    assert job_queue.claim_next_job("worker-1") is None  # still backing off
+
+    with job_queue._connect() as conn:
+        conn.execute("UPDATE jobs SET available_at = 0 WHERE id = ?", (job_id,))
+    assert job_queue.claim_next_job("worker-1")["attempts"] == 2
+    assert job_queue.fail_job(job_id, "RuntimeError: boom") == FAILED
+
+
+def test_retry_job_requeues_a_failed_job_with_its_files(tmp_path):
+    job_id = _submit(tmp_path, max_attempts=1)
+    job_queue.claim_next_job("worker-1")
+    job_queue.fail_job(job_id, "RuntimeError: boom")
+
+    assert job_queue.retry_job(job_id)
+
+    job = job_queue.get_job(job_id)
+    assert job["status"] == QUEUED and job["attempts"] == 0 and job["error"] is None
+    assert os.path.exists(job["files"][0])
+    assert job_queue.claim_next_job("worker-1")["id"] == job_id
+
+
+def test_retry_job_refuses_jobs_that_did_not_fail(tmp_path):
+    job_id = _submit(tmp_path)
+    assert not job_queue.retry_job(job_id)
+
+    job_queue.claim_next_job("worker-1")
+    job_queue.finish_job(job_id, SUCCEEDED)
+    assert not job_queue.retry_job(job_id)
+
+
+def test_cancelling_a_queued_job_removes_its_files(tmp_path):
+    job_id = _submit(tmp_path)
+
+    assert job_queue.request_cancel(job_id)
+
+    assert job_queue.get_job(job_id)["status"] == CANCELLED
+    assert not os.path.exists(job_queue.job_upload_dir(job_id))
+    assert not job_queue.request_cancel(job_id)
+    assert job_queue.claim_next_job("worker-1") is None
+
+
+def test_running_job_stops_at_the_next_progress_event_after_cancel(tmp_path, monkeypatch):
+    job_id = _submit(tmp_path)
+    job = job_queue.claim_next_job("worker-1")
+    monkeypatch.setattr(ingestion_worker, "JOB_HEARTBEAT_SECONDS", 0.01)
+    events_after_cancel = []
+
+    def update_rag_pipeline(pdf_paths, org_name, extract_workers=1, progress_callback=None):
+        job_queue.request_cancel(job_id)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            events_after_cancel.append(1)
+            progress_callback({"event": "chunks_written", "count": 1, "total": len(events_after_cancel)})
+            time.sleep(0.01)
+        raise AssertionError("the job was not cancelled")
+
+    monkeypatch.setitem(sys.modules, "utils.rag_pipeline", types.SimpleNamespace(update_rag_pipeline=update_rag_pipeline))
+
+    ingestion_worker.run_job(job, "worker-1")
+
+    job = job_queue.get_job(job_id)
+    assert job["status"] == CANCELLED and job["error"] == "Cancelled by user."
+    assert job["progress"]["chunks_written"] == len(events_after_cancel)
+    assert not os.path.exists(job_queue.job_upload_dir(job_id))
@@ -0,0 +1,92 @@
+import pytest
+from langchain.schema import Document
+
+import utils.reranking as reranking
+
+
+@pytest.fixture(autouse=True)
+def _embedding_first_stage(monkeypatch):
+    monkeypatch.setattr(reranking, "RERANK_FIRST_STAGE", "embedding")
+    monkeypatch.setattr(reranking, "RERANK_FIRST_STAGE_KEEP", 3)
+    monkeypatch.setattr(reranking, "RERANK_EARLY_EXIT_MARGIN", {"embedding": 0.15})
+    monkeypatch.setattr(reranking, "RERANK_AUDIT_RATE", 0.0)
+
+
+def _doc(name, **scores):
+    return Document(page_content=name, metadata=scores)
+
+
+def _drive(plan, large_scores=None):
+    """Runs a cascade plan, answering scoring requests with `large_scores` (by passage text)."""
+    requests = []
+    try:
+        request = next(plan)
+        while True:
+            requests.append(request)
+            _, pairs, _ = request
+            request = plan.send([large_scores[passage] for _, passage in pairs])
+    except StopIteration as stop:
+        return stop.value, requests
+
+
+def test_clear_similarity_gap_skips_the_large_model():
+    docs = [
+        _doc("a", retrieval_score=1.0, dense_score=0.82),
+        _doc("b", retrieval_score=0.9, dense_score=0.80),
+        _doc("c", retrieval_score=0.8, dense_score=0.50),
+        _doc("d", retrieval_score=0.7, dense_score=0.45),
+    ]
+
+    kept, requests = _drive(reranking._rerank_cascade("q", docs, score_threshold=0.6, final_k=2))
+
+    assert requests == []
+    assert [doc.page_content for doc in kept] == ["a", "b"]
+    # Early-exit results carry the score they were ranked by, like the large stage's
+    assert [doc.metadata["rerank_score"] for doc in kept] == [0.82, 0.80]
+
+
+def test_early_exit_applies_the_score_threshold():
+    docs = [
+        _doc("a", retrieval_score=0.9),
+        _doc("b", retrieval_score=0.5),
+        _doc("c", retrieval_score=0.2),
+    ]
+
+    kept, requests = _drive(reranking._rerank_cascade("q", docs, score_threshold=0.6, final_k=2))
+
+    assert requests == []
+    assert [doc.page_content for doc in kept] == ["a"]
+
+
+def test_small_gap_sends_the_survivors_to_the_large_model():
+    docs = [
+        _doc("a", retrieval_score=1.0, dense_score=0.82),
+        _doc("b", retrieval_score=0.9, dense_score=0.80),
+        _doc("c", retrieval_score=0.8, dense_score=0.79),
+        _doc("d", retrieval_score=0.7, dense_score=0.78),
+    ]
+    large_scores = {"a": 0.1, "b": 2.0, "c": 3.0}
+
+    kept, requests = _drive(reranking._rerank_cascade("q", docs, score_threshold=0, final_k=2), large_scores)
+
+    assert len(requests) == 1
+    model_name, pairs, wait = requests[0]
+    assert model_name == reranking.RERANKER_MODEL_NAME and wait
+    # Only RERANK_FIRST_STAGE_KEEP survivors reach the large model
+    assert [passage for _, passage in pairs] == ["a", "b", "c"]
+    assert [doc.page_content for doc in kept] == ["c", "b"]
+    assert [doc.metadata["rerank_score"] for doc in kept] == [3.0, 2.0]
+
+
+def test_lexical_only_candidate_disables_the_early_exit():
+    docs = [
+        _doc("a", retrieval_score=1.0, dense_score=0.9),
+        _doc("b", retrieval_score=0.9, dense_score=0.88),
+        _doc("c", retrieval_score=0.8, lexical_score=7.5),
+    ]
+    large_scores = {"a": 1.0, "b": 0.5, "c": 2.0}
+
+    kept, requests = _drive(reranking._rerank_cascade("q", docs, score_threshold=0, final_k=2), large_scores)
+
+    assert len(requests) == 1
+    assert [doc.page_content for doc in kept] == ["c", "a"]
@@ -0,0 +1,76 @@
+import uuid
+
+from config import HYBRID_SEARCH_K
+from utils.lexical_index import LexicalIndex, backfill_lexical_index
+from utils.retrieval import retrieve_candidates, chunk_ids_of
+
+
+class _Collection:
+    """In-memory stand-in for the parts of a Chroma collection that retrieval uses."""
+    metadata = {}
+
+    def __init__(self, records):
+        # records: [(chroma_id, text, metadata, embedding)]
+        self.records = records
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0):
+        records = [r for r in self.records if ids is None or r[0] in ids][offset:]
+        if limit is not None:
+            records = records[:limit]
+        return {
+            "ids": [r[0] for r in records],
+            "documents": [r[1] for r in records],
+            "metadatas": [r[2] for r in records],
+        }
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        query = query_embeddings[0]
+        scored = sorted(
+            ((sum((a - b) ** 2 for a, b in zip(query, r[3])), r) for r in self.records), key=lambda item: item[0]
+        )[:n_results]
+        return {
+            "ids": [[r[0] for _, r in scored]],
+            "documents": [[r[1] for _, r in scored]],
+            "metadatas": [[r[2] for _, r in scored]],
+            "distances": [[distance for distance, _ in scored]],
+        }
+
+
+class _Embeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+class _VectorStore:
+    def __init__(self, records):
+        self._collection = _Collection(records)
+        self.embeddings = _Embeddings()
+
+
+def test_hybrid_retrieval_fuses_chunks_from_a_store_built_before_chunk_ids(tmp_path):
+    # Chunks written by the original add_documents: random Chroma IDs, no "chunk_id" metadata
+    records = [
+        (str(uuid.uuid4()), "Valve maintenance schedule for the pump room.", {"source": "a.pdf"}, [1.0, 0.0]),
+        (str(uuid.uuid4()), "Holiday policy and leave approval.", {"source": "b.pdf"}, [0.9, 0.1]),
+        (str(uuid.uuid4()), "Part number PN-0042 is used by the relay bracket.", {"source": "c.pdf"}, [0.0, 1.0]),
+    ]
+    # Enough near neighbours that the part-number chunk falls outside the dense candidates
+    records += [
+        (str(uuid.uuid4()), f"Filler paragraph {i} about onboarding.", {"source": "d.pdf"}, [0.95, 0.05 + i / 1000])
+        for i in range(HYBRID_SEARCH_K)
+    ]
+    vectorstore = _VectorStore(records)
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite3"))
+    assert backfill_lexical_index(index, vectorstore) == len(records)
+
+    docs = retrieve_candidates(vectorstore, "valve PN-0042", k=5, lexical_index=index)
+
+    by_id = dict(zip(chunk_ids_of(docs), docs))
+    assert len(docs) == 5
+    valve, part_number = by_id[records[0][0]], by_id[records[2][0]]
+    # Found by both sides: fused into the top candidate, carrying both scores
+    assert docs[0] is valve
+    assert "dense_score" in valve.metadata and "lexical_score" in valve.metadata
+    # Found lexically only: fetched from the store and kept
+    assert "lexical_score" in part_number.metadata
+    assert "dense_score" not in part_number.metadata
@@ -2,34 +2,145 @@ import streamlit as st
 import os
 import shutil
 import time
-from config import UPLOAD_FOLDER, SUPPORTED_FILE_TYPES, MAX_FILES, MAX_FILE_SIZE_MB, MAX_PAGES, SHARED_PDFS_PATH
+from datetime import datetime
+from config import (
+    UPLOAD_FOLDER, SUPPORTED_FILE_TYPES, MAX_FILES, MAX_FILE_SIZE_MB, MAX_PAGES, SHARED_PDFS_PATH,
+    JOB_POLL_SECONDS,
+)
 from utils.file_processing import get_file_extension, is_valid_file, convert_to_pdf
 from utils.extraction import get_extracted_text
 # New imports for incremental RAG pipeline update
-from utils.rag_pipeline import update_rag_pipeline, get_rag_chain
+from utils.rag_pipeline import get_rag_chain
+from utils.job_queue import (
+    submit_job, get_job, list_jobs, request_cancel, retry_job, ensure_worker_running, live_workers,
+    QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED,
+)
 from utils.auth import get_user_info
 
 
+def _show_success():
+    st.success("Knowledge Base successfully updated! You can now navigate to the chat page.")
+
+    st.write(
+        """
+        You can now start interacting with the knowledge base by clicking on *New Chat*.  
+
+        • Use the *Previous Chats* menu in the sidebar to manage and revisit your earlier conversations.  
+
+        • Explore AskEICE and make the most out of it 🚀
+        """
+    )
+
+
+def _render_job_progress(job):
+    progress = job["progress"] or {}
+    files_total = progress.get("files_total") or len(job["files"])
+    files_done = progress.get("files_done", 0)
+    st.progress(
+        files_done / files_total if files_total else 0.0,
+        text=f"{files_done} of {files_total} files processed · {progress.get('pages_done', 0)} pages extracted · "
+             f"{progress.get('chunks_written', 0)} chunks written",
+    )
+    file_rows = [
+        {
+            "File Name": name,
+            "Status": file_progress["status"],
+            "Pages": f"{file_progress['pages_done']}/{file_progress['pages_total']}"
+                     if file_progress["pages_total"] else "-",
+            "Chunks": file_progress["chunks"],
+            # Those pages were ingested from their text layer; uploading the file again retries them
+            "OCR Failed Pages": ", ".join(map(str, file_progress.get("ocr_failed_pages", []))) or "-",
+        }
+        for name, file_progress in progress.get("files", {}).items()
+    ]
+    if file_rows:
+        st.dataframe(file_rows, use_container_width=True)
+
+
+def _render_recent_jobs(org_name):
+    jobs = list_jobs(org_name, limit=10)
+    if not jobs:
+        return
+    with st.expander("Recent ingestion jobs"):
+        st.dataframe(
+            [
+                {
+                    "Submitted": datetime.fromtimestamp(job["created_at"]).strftime("%Y-%m-%d %H:%M"),
+                    "By": job["submitted_by"],
+                    "Files": len(job["files"]),
+                    "Status": job["status"],
+                    "Attempts": job["attempts"],
+                    "Error": job["error"] or "",
+                }
+                for job in jobs
+            ],
+            use_container_width=True,
+        )
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _render_active_job(job_id):
+    # Only this block re-runs while polling, so the sidebar and the rest of the page stay usable
+    job = get_job(job_id)
+    if job is None or job["status"] not in (QUEUED, RUNNING):
+        st.rerun()  # finished: re-run the whole page to show the final status
+
+    if job["status"] == QUEUED:
+        if job["error"]:
+            st.warning(f"Attempt {job['attempts']} failed ({job['error']}); the job will be retried.")
+        elif not live_workers():
+            st.warning("Waiting for an ingestion worker to start...")
+        else:
+            st.info("Waiting for an ingestion worker...")
+    else:
+        st.info("Processing documents in the background. You can leave this page; the job keeps running.")
+    _render_job_progress(job)
+    if st.button("Cancel", key="cancel_ingestion_job", disabled=job["cancel_requested"]):
+        request_cancel(job_id)
+        st.rerun(scope="fragment")
+
+
 def render_processing_status_page():
     # Is page pe sirf success message dikhao.
     # Upar se jo processing_complete flag set kiya tha, use yahan use karo.
     if st.session_state.get('processing_complete'):
-        st.success("Knowledge Base successfully updated! You can now navigate to the chat page.")
-        
-        st.write(
-            """
-            You can now start interacting with the knowledge base by clicking on *New Chat*.  
-
-            • Use the *Previous Chats* menu in the sidebar to manage and revisit your earlier conversations.  
+        _show_success()
+        return
 
-            • Explore AskEICE and make the most out of it 🚀
-            """
-        )
-    else:
+    job_id = st.session_state.get('ingestion_job_id')
+    job = get_job(job_id) if job_id else None
+    if job is None:
         st.error("Invalid page access. Please go back to the home page.")
         if st.button("Go to Home"):
             st.session_state.page = "upload"
             st.rerun()
+        return
+
+    if job["status"] == SUCCEEDED:
+        st.session_state.processing_complete = True
+        _show_success()
+        return
+
+    st.title("Updating Knowledge Base")
+    if job["status"] in (QUEUED, RUNNING):
+        _render_active_job(job_id)
+    elif job["status"] == CANCELLED:
+        st.warning("Processing was cancelled. Documents finished before the cancellation are in the knowledge base.")
+        _render_job_progress(job)
+    elif job["status"] == FAILED:
+        st.error(f"Processing failed after {job['attempts']} attempts: {job['error']}")
+        _render_job_progress(job)
+        # Finished documents are checkpointed, so a retry picks up where the job stopped
+        if st.button("Retry", key="retry_ingestion_job"):
+            if retry_job(job_id):
+                ensure_worker_running()
+                st.rerun()
+            st.warning("This job's files are no longer available; please upload them again.")
+
+    if st.button("Back to Upload"):
+        st.session_state.ingestion_job_id = None
+        st.session_state.page = "upload"
+        st.rerun()
 
 # def render_upload_page():
 #     st.title("Knowledge Base Management")
@@ -143,30 +254,30 @@ def render_upload_page():
                     st.success("All files approved!")
             
             if st.session_state.approved_files:
-                # --- NEW LOGIC: Directly process and update RAG here ---
+                # Queue the documents for the background ingestion worker
                 if st.button("Start Processing", key="start_processing"):
-                    st.info("Updating knowledge base... This might take a few moments.")
                     user_info = get_user_info(st.session_state['user'])
                     org_name = user_info['organization']
                     
                     pdf_paths_to_process = [f['PDF Path'] for f in st.session_state.approved_files]
 
-                    with st.spinner("Processing documents and updating knowledge base..."):
-                        try:
-                            st.session_state.rag_chain = update_rag_pipeline(pdf_paths_to_process, org_name)
-                            st.session_state.processing_complete = True
-                            st.success("Knowledge Base successfully updated with new documents!")
-                            
-                            # Clear old uploaded files and session state
-                            if os.path.exists(UPLOAD_FOLDER):
-                                shutil.rmtree(UPLOAD_FOLDER)
-                                os.makedirs(UPLOAD_FOLDER)
-                            st.session_state.approved_files = []
-                            
-                            # Navigate to the chat page
-                            st.session_state.page = "processing_status" 
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"An error occurred during processing: {e}")
-                            st.exception(e)
-                    
\ No newline at end of file
+                    try:
+                        # The job takes its own copy of the PDFs, so the staging folder can be cleared now
+                        job_id = submit_job(org_name, pdf_paths_to_process, submitted_by=st.session_state['user'])
+                        ensure_worker_running()
+                        st.session_state.ingestion_job_id = job_id
+                        st.session_state.processing_complete = False
+
+                        # Clear this user's uploaded files and session state
+                        shutil.rmtree(user_upload_dir, ignore_errors=True)
+                        st.session_state.approved_files = []
+
+                        st.session_state.page = "processing_status"
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"An error occurred while queueing the documents: {e}")
+                        st.exception(e)
+
+    user_info = get_user_info(st.session_state['user'])
+    if user_info:
+        _render_recent_jobs(user_info['organization'])
@@ -0,0 +1,119 @@
+# utils/answer_cache.py
+
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SIMILARITY,
+)
+
+
+def history_key_of(chat_history):
+    """Cache key part for the chat history that goes into the prompt ("" when there is none)."""
+    return hashlib.sha256(chat_history.encode("utf-8")).hexdigest() if chat_history else ""
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """
+    Org-scoped cache of {"answer", "sources"} results for repeated questions.
+
+    An entry matches a new query when both hold:
+      - the cosine similarity of the normalized query embeddings is >= `similarity_threshold`
+        (so "What is the leave policy?" and "what's the leave policy" share an answer), and
+      - retrieval returned exactly the same set of chunk IDs, so any KB change that affects
+        the question's context makes the old answer unreachable, and
+      - the chat history sent with the question is the same (`history_key`, a hash of it), so
+        a follow-up like "can you elaborate?" is never answered from another conversation.
+    Entries expire after `ttl_seconds` and each org keeps at most `max_entries` (LRU).
+    """
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._orgs = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0}
+
+    def _entries(self, org_name):
+        return self._orgs.setdefault(org_name, OrderedDict())
+
+    def lookup(self, org_name, query_embedding, chunk_ids, history_key=""):
+        """Returns the cached {"answer", "sources"} for a matching query, or None."""
+        chunk_ids = frozenset(chunk_ids)
+        query_vector = _unit(query_embedding)
+        now = time.time()
+        with self._lock:
+            entries = self._entries(org_name)
+            for key in [k for k, entry in entries.items() if now - entry["created_at"] > self.ttl_seconds]:
+                del entries[key]
+                self._stats["expired"] += 1
+
+            best_key, best_similarity = None, self.similarity_threshold
+            for key, entry in entries.items():
+                if entry["chunk_ids"] != chunk_ids or entry["history_key"] != history_key:
+                    continue
+                similarity = float(np.dot(entry["query_vector"], query_vector))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+
+            if best_key is None:
+                self._stats["misses"] += 1
+                return None
+
+            entries.move_to_end(best_key)
+            self._stats["hits"] += 1
+            entry = entries[best_key]
+            logging.info(f"Answer cache hit for '{org_name}' (similarity {best_similarity:.3f}).")
+            return {"answer": entry["answer"], "sources": list(entry["sources"])}
+
+    def store(self, org_name, query_embedding, chunk_ids, answer, sources, history_key=""):
+        with self._lock:
+            entries = self._entries(org_name)
+            key = (frozenset(chunk_ids), history_key, tuple(np.round(_unit(query_embedding), 4).tolist()))
+            entries[key] = {
+                "query_vector": _unit(query_embedding),
+                "chunk_ids": frozenset(chunk_ids),
+                "history_key": history_key,
+                "answer": answer,
+                "sources": list(sources),
+                "created_at": time.time(),
+            }
+            entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def invalidate(self, org_name=None):
+        """Drops all entries of one org (or every org)."""
+        with self._lock:
+            if org_name is None:
+                self._orgs.clear()
+            else:
+                self._orgs.pop(org_name, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": {org: len(entries) for org, entries in self._orgs.items()},
+            }
+
+
+answer_cache = AnswerCache()
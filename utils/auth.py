@@ -10,8 +10,7 @@ from config import DB_CONFIG, CHATS_DIR, UPLOAD_FOLDER
 import shutil
 import time
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from utils.rag_pipeline import get_rag_chain, get_or_create_vectorstore
+from utils.rag_pipeline import get_rag_chain, get_or_create_vectorstore, get_embeddings_model
 from config import ORGANIZATIONS, AVAILABLE_ROLES, AVAILABLE_ORGANIZATIONS
 # from auth_flow import is_valid_email, check_password_strength
 from utils.validation import is_valid_email, check_password_strength
@@ -328,7 +327,7 @@ def load_chat(chat_path):
         # Check if the ChromaDB directory still exists
         if os.path.exists(st.session_state.chroma_dir):
             # Rebuilding the vector store from the saved directory is the key!
-            embeddings_model = HuggingFaceEmbeddings(model_name="sentence-transformers/BAAI/bge-base-en-v1.5")
+            embeddings_model = get_embeddings_model()
             vectorstore = Chroma(persist_directory=st.session_state.chroma_dir, embedding_function=embeddings_model)
             
             # Rebuilding the RAG chain
@@ -0,0 +1,81 @@
+# utils/chroma_lock.py
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from chromadb.api.client import Client
+from chromadb.config import Settings, System
+
+from config import CHROMA_DB_DIRECTORY
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CHROMA_WRITE_LOCK_FILENAME = ".write.lock"
+
+# flock/msvcrt locks are taken per open file, so threads of one process also exclude each other;
+# the thread lock just keeps them from busy-waiting on the file lock on Windows.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after ~10 seconds; keep waiting for the current writer
+            time.sleep(0.1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def chroma_write_lock(org_name):
+    """
+    Holds the org's cross-process Chroma write lock.
+
+    Chroma's persistent client is not safe for concurrent writes from several processes,
+    so every write to an org store (ingestion batches, stale-chunk deletes and the one-shot
+    migrations run when a store is opened) takes this lock. Readers don't need it.
+    Hold it per write batch, not per job, so a long ingestion doesn't block the app.
+    """
+    org_dir = os.path.join(CHROMA_DB_DIRECTORY, org_name)
+    os.makedirs(org_dir, exist_ok=True)
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(org_name, threading.Lock())
+    with thread_lock, open(os.path.join(org_dir, CHROMA_WRITE_LOCK_FILENAME), "a+b") as f:
+        _lock_file(f)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+
+def reopen_chroma_client(chroma_dir):
+    """
+    Returns a client on a newly started Chroma system for `chroma_dir`. A process's Chroma
+    client keeps the vector index it loaded, so writes from other processes stay invisible
+    to it; the new system loads them. It also replaces the process's cached system for the
+    directory, so clients opened after it use it too, while existing clients keep the old
+    one for the queries still running on them.
+    """
+    system = System(Settings(is_persistent=True, persist_directory=chroma_dir))
+    system.start()
+    return Client.from_system(system)
@@ -0,0 +1,139 @@
+# utils/chunking.py
+
+import re
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import CHUNK_BUFFER_SIZE, CHUNK_BREAKPOINT_PERCENTILE, CHUNK_EMBEDDING_MODE, EMBED_BATCH_SIZE
+from utils.telemetry import span
+
+# A sentence ends at . ! or ? followed by whitespace, or at a line break right before a page marker.
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+(?=--- PDF: )")
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits text into sentences, keeping each sentence's trailing whitespace so that
+    "".join(sentences) == text and chunk boundaries never alter the original text.
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return [s for s in sentences if s.strip()]
+
+
+# Page markers written by utils/extraction.format_pages_with_markers.
+PAGE_MARKER_RE = re.compile(r"--- PDF: .*? \| Page: (\d+) ---")
+
+
+def page_ranges(chunk_texts: List[str]) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    (page_start, page_end) of each chunk of one document, in order. A chunk that starts
+    without a page marker continues the last page of the chunk before it.
+    """
+    ranges = []
+    current_page = None
+    for text in chunk_texts:
+        pages = [int(page) for page in PAGE_MARKER_RE.findall(text)]
+        starts_with_marker = bool(pages) and PAGE_MARKER_RE.match(text.lstrip()) is not None
+        page_start = pages[0] if starts_with_marker or current_page is None else current_page
+        if pages:
+            current_page = pages[-1]
+        ranges.append((page_start, current_page))
+    return ranges
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SemanticChunker:
+    """
+    Splits text where the meaning shifts, like LlamaIndex's SemanticSplitterNodeParser,
+    but embeds all sentence windows of a document in large batches and finds breakpoints
+    with one vectorized cosine-distance pass.
+
+    Each sentence is embedded together with `buffer_size` neighbours on each side; a chunk
+    boundary is placed after sentence i when the cosine distance between windows i and
+    i+1 is above the `breakpoint_percentile` of all distances in the document.
+
+    With chunk_embedding_mode="mean", each chunk's embedding is the normalized mean of its
+    sentence-window embeddings, so ingestion doesn't embed the same text a second time.
+    With "reembed", chunks are returned without embeddings and embedded downstream.
+
+    `embed_handle` is the model registry's ModelHandle for the LlamaIndex embedding model;
+    each batch runs under its lock, as the model is shared with chat queries.
+    """
+    def __init__(
+        self,
+        embed_handle,
+        buffer_size: int = CHUNK_BUFFER_SIZE,
+        breakpoint_percentile: float = CHUNK_BREAKPOINT_PERCENTILE,
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        chunk_embedding_mode: str = CHUNK_EMBEDDING_MODE,
+    ):
+        if chunk_embedding_mode not in ("mean", "reembed"):
+            raise ValueError(f"Unknown chunk_embedding_mode: {chunk_embedding_mode}")
+        self.embed_handle = embed_handle
+        self.buffer_size = buffer_size
+        self.breakpoint_percentile = breakpoint_percentile
+        self.embed_batch_size = embed_batch_size
+        self.chunk_embedding_mode = chunk_embedding_mode
+
+    def _sentence_windows(self, sentences: List[str]) -> List[str]:
+        windows = []
+        for i in range(len(sentences)):
+            start = max(0, i - self.buffer_size)
+            end = min(len(sentences), i + self.buffer_size + 1)
+            windows.append("".join(sentences[start:end]).strip())
+        return windows
+
+    def _embed_windows(self, windows: List[str]) -> np.ndarray:
+        vectors = []
+        for i in range(0, len(windows), self.embed_batch_size):
+            # Locked per batch, so queries can run between the batches of a long document
+            with self.embed_handle.lock:
+                vectors.extend(self.embed_handle.model.get_text_embedding_batch(windows[i:i + self.embed_batch_size]))
+        return _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+    def split_text(self, text: str) -> List[Tuple[str, Optional[List[float]]]]:
+        """Returns [(chunk_text, chunk_embedding_or_None), ...] in document order."""
+        with span("sentence_split"):
+            sentences = split_sentences(text)
+        if not sentences:
+            return []
+
+        with span("chunk_embed"):
+            window_vectors = self._embed_windows(self._sentence_windows(sentences))
+
+        if len(sentences) > 1:
+            # Cosine distance between each window and the next one (rows are unit-length).
+            distances = 1.0 - np.einsum("ij,ij->i", window_vectors[:-1], window_vectors[1:])
+            threshold = np.percentile(distances, self.breakpoint_percentile)
+            breakpoints = np.flatnonzero(distances > threshold) + 1
+        else:
+            breakpoints = np.array([], dtype=int)
+
+        boundaries = [0, *breakpoints.tolist(), len(sentences)]
+        chunks = []
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            chunk_text = "".join(sentences[start:end]).strip()
+            if not chunk_text:
+                continue
+            if self.chunk_embedding_mode == "mean":
+                chunk_vector = window_vectors[start:end].mean(axis=0)
+                chunk_vector /= np.linalg.norm(chunk_vector) or 1.0
+                chunks.append((chunk_text, chunk_vector.tolist()))
+            else:
+                chunks.append((chunk_text, None))
+
+        logging.info(f"Semantic chunker: {len(sentences)} sentences -> {len(chunks)} chunks.")
+        return chunks
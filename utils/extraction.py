@@ -1,15 +1,27 @@
 # utils/extraction.py
 
 import os
+import math
 import time
 import glob
+import random
+import string
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import pdfplumber
 from pdf2image import convert_from_path
 import numpy as np
-import torch
-from doctr.models import ocr_predictor
 from utils.file_processing import is_scanned_pdf
-from config import poppler_bin_path
+from config import (
+    poppler_bin_path, OCR_DPI, OCR_BATCH_SIZE, OCR_WORKERS, PAGE_MIN_CHARS,
+    QUALITY_MAX_UNKNOWN_RATIO, QUALITY_SAMPLE_SIZE, QUALITY_CONFIDENCE_Z,
+)
+from utils.model_registry import get_doctr_handle
+from utils.extraction_cache import (
+    file_sha256, load_cached_pages, store_cached_pages, load_partial_pages, store_partial_pages,
+)
+from utils.telemetry import span
 import logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,9 +31,12 @@ from spellchecker import SpellChecker
 from rapidfuzz import fuzz, process
 import re
 
-global_doctr_model = None
 import fitz 
 
+# Bump whenever extraction output changes (routing, OCR settings, text normalization)
+# so cached results from the old extractor are no longer used.
+EXTRACTOR_VERSION = f"3-dpi{OCR_DPI}"
+
 
 def clean_extracted_text(text):
     # Step 1: Quality check
@@ -33,7 +48,8 @@ def clean_extracted_text(text):
 
     # Step 2: Cleaning logic
     logging.info(f'time before cleaning: {time.strftime("%Y-%m-%d %H:%M:%S")}')
-    spell = SpellChecker()
+    spell = _get_spell_checker()
+    lexicon = get_lexicon()
     lines = text.splitlines()
     corrected_lines = []
 
@@ -51,7 +67,7 @@ def clean_extracted_text(text):
                 corrected_words.append(word)
                 continue
 
-            if word.lower() in spell:
+            if word.lower() in lexicon:
                 corrected_words.append(word)
             else:
                 similar_match = process.extractOne(word, unique_words, scorer=fuzz.ratio)
@@ -81,23 +97,97 @@ def clean_extracted_text(text):
     return "\n".join(corrected_lines)
 
 
-def is_text_quality_good(text):
+_spell_checker = None
+_lexicon = None
+_spell_checker_lock = threading.Lock()
+
+
+def _get_spell_checker():
+    # Loading the dictionary is slow; one checker (and its lexicon) is shared per process.
+    global _spell_checker, _lexicon
+    with _spell_checker_lock:
+        if _spell_checker is None:
+            spell = SpellChecker()
+            _lexicon = frozenset(spell.word_frequency.keys())
+            _spell_checker = spell
+    return _spell_checker
+
+
+def get_lexicon():
+    """The spell checker's dictionary as a frozenset of lower-case words, for fast membership tests."""
+    if _lexicon is None:
+        _get_spell_checker()
+    return _lexicon
+
+
+_TOKEN_PUNCTUATION = string.punctuation + "“”‘’«»–—…•·"
+_NUMBER_RE = re.compile(r"[+\-]?\d[\d.,:/%\-]*")
+# Compounds ("state-of-the-art", "e-mail") and possessives are checked part by part
+_WORD_JOINER_RE = re.compile(r"[-'–—]")
+
+
+def _is_known_word(word, lexicon):
+    if any(ch.isalpha() for ch in word):
+        return word in lexicon
+    return _NUMBER_RE.fullmatch(word) is not None
+
+
+def _is_known_token(token, lexicon):
+    """True/False for a dictionary word or number vs. anything else; None for bare punctuation."""
+    word = token.strip(_TOKEN_PUNCTUATION).lower().replace("’", "'").replace("‘", "'")
+    if not word:
+        return None
+    if _is_known_word(word, lexicon):
+        return True
+    parts = [part for part in _WORD_JOINER_RE.split(word) if part]
+    return len(parts) > 1 and all(_is_known_word(part, lexicon) for part in parts)
+
+
+def _wilson_interval(successes, trials, z):
+    """Wilson score interval for a binomial proportion."""
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return center - half_width, center + half_width
+
+
+def is_text_quality_good(text, min_chars=100, max_unknown_ratio=QUALITY_MAX_UNKNOWN_RATIO,
+                         sample_size=QUALITY_SAMPLE_SIZE, z=QUALITY_CONFIDENCE_Z):
     """
-    Checks if the extracted text has a good linguistic quality using a spell checker.
+    Checks if the extracted text has a good linguistic quality using the spell checker's dictionary.
     Returns True if the text is likely to be valid, False otherwise.
-    """
-    if not text or len(text.strip()) < 100: # Heuristic: if text is too short, it might be junk
-        return False
 
-    spell = SpellChecker()
-    words = text.split()
-    misspelled = spell.unknown(words)
-    
-    # Heuristic: if more than 15% of words are unknown, it's likely bad OCR
-    if len(misspelled) / len(words) > 0.15:
+    The share of unknown words is estimated from a random sample of the words. The sample
+    grows (and finally covers every word) until the Wilson interval of the estimate lies
+    entirely on one side of `max_unknown_ratio`, so long, clearly good or clearly bad text
+    is judged from a few hundred words.
+    """
+    if not text or len(text.strip()) < min_chars: # Heuristic: if text is too short, it might be junk
         return False
 
-    return True
+    lexicon = get_lexicon()
+    tokens = text.split()
+    # Seeded by the word count, so the same page always gets the same verdict (results are cached)
+    rng = random.Random(len(tokens))
+    sample_size = max(1, sample_size)
+
+    while True:
+        exhaustive = sample_size >= len(tokens)
+        sample = tokens if exhaustive else [tokens[i] for i in rng.sample(range(len(tokens)), sample_size)]
+        verdicts = [known for known in (_is_known_token(token, lexicon) for token in sample) if known is not None]
+        if verdicts:
+            unknown = verdicts.count(False)
+            if exhaustive:
+                return unknown / len(verdicts) <= max_unknown_ratio
+            low, high = _wilson_interval(unknown, len(verdicts), z)
+            if high <= max_unknown_ratio:
+                return True
+            if low > max_unknown_ratio:
+                return False
+        elif exhaustive:
+            return False  # nothing but punctuation
+        sample_size *= 4
 
 
 
@@ -109,32 +199,172 @@ def is_valid_pdf(filepath):
         return False
     
 
-def get_extracted_text(pdf_files, org_name):
+def get_extracted_text(pdf_files, org_name, ocr_workers=OCR_WORKERS, progress_callback=None):
     combined_text = ""
-    global global_doctr_model
-    global_doctr_model = None
 
     for i, pdf_file_path in enumerate(pdf_files):
-        pdfplumber_text = extract_text_with_pdfplumber(pdf_file_path)
+        logging.info(f"Processing PDF {i+1}/{len(pdf_files)}: '{os.path.basename(pdf_file_path)}'")
+        pages = extract_pdf_pages_cached(pdf_file_path, ocr_workers=ocr_workers, progress_callback=progress_callback)
+        combined_text += format_pages_with_markers(pdf_file_path, pages)
+        # combined_text_clean += clean_extracted_text(combined_text)
+
+    return combined_text
+
+
+def format_pages_with_markers(pdf_path, pages):
+    """Joins per-page results into the '--- PDF: ... | Page: N ---' layout the chunker expects."""
+    extracted_text = ""
+    for page in pages:
+        if page["text"].strip():
+            extracted_text += f"\n--- PDF: {os.path.basename(pdf_path)} | Page: {page['page']} ---\n"
+            extracted_text += page["text"].strip() + "\n"
+    return extracted_text
+
+
+def _report_pages(progress_callback, pdf_path, page_numbers, pages_total):
+    if progress_callback is not None and page_numbers:
+        progress_callback({
+            "event": "pages_extracted",
+            "source": os.path.basename(pdf_path),
+            "pages": list(page_numbers),
+            "pages_total": pages_total,
+        })
+
+
+def extract_pdf_pages_cached(pdf_path, ocr_workers=OCR_WORKERS, file_hash=None, progress_callback=None):
+    """
+    Like extract_pdf_pages, but served from the on-disk extraction cache when the same
+    PDF bytes were extracted before (under any file name, by any admin).
+
+    An extraction in which OCR failed for some pages is returned but not cached; those
+    pages are reported to `progress_callback` as an "ocr_failed" event.
+    """
+    with span("extraction_cache"):
+        file_hash = file_hash or file_sha256(pdf_path)
+        pages = load_cached_pages(file_hash, EXTRACTOR_VERSION)
+    if pages is not None:
+        logging.info(f"Extraction cache hit for '{os.path.basename(pdf_path)}' ({file_hash[:12]}); skipping extraction.")
+        _report_pages(progress_callback, pdf_path, [page["page"] for page in pages], len(pages))
+        return pages
+
+    pages = extract_pdf_pages(pdf_path, ocr_workers=ocr_workers, progress_callback=progress_callback, file_hash=file_hash)
+    failed_pages = [page["page"] for page in pages if page["method"] == "pdfplumber_ocr_failed"]
+    if failed_pages:
+        # Not cached: the OCR batches that did finish stay checkpointed, and the next
+        # extraction of this file OCRs only the missing pages.
+        logging.warning(
+            f"OCR failed for {len(failed_pages)} pages of '{os.path.basename(pdf_path)}' (first: {failed_pages[:10]}); "
+            f"their text layer is used instead."
+        )
+        if progress_callback is not None:
+            progress_callback({"event": "ocr_failed", "source": os.path.basename(pdf_path), "pages": failed_pages})
+        return pages
+    try:
+        store_cached_pages(file_hash, EXTRACTOR_VERSION, pages, source=os.path.basename(pdf_path))
+    except OSError as e:
+        logging.warning(f"Could not write extraction cache entry for '{os.path.basename(pdf_path)}': {e}")
+    return pages
+
 
-        if pdfplumber_text and is_text_quality_good(pdfplumber_text):
-            logging.info(f"Processing PDF {i+1}/{len(pdf_files)} with PDF Plumber (✓ Quality Check): '{os.path.basename(pdf_file_path)}'")
-            combined_text += pdfplumber_text
-            # combined_text_clean += clean_extracted_text(combined_text)
+def extract_pdf_pages(pdf_path, ocr_workers=OCR_WORKERS, progress_callback=None, file_hash=None):
+    """
+    Extracts a PDF page by page, keeping good text-layer pages and OCR'ing only the rest.
+
+    Each page's pdfplumber text goes through the quality gate on its own; pages that are
+    blank or fail it are rasterized and OCR'd with DocTR, so a mostly digital PDF with a few
+    scanned pages only pays OCR for those pages.
+
+    `progress_callback`, if given, receives a "pages_extracted" event for the text-layer
+    pages and then for each OCR batch as it completes.
+
+    With `file_hash`, every finished OCR batch is checkpointed in the extraction cache, and
+    pages an earlier, interrupted extraction of the same file already OCR'd are reused.
+
+    Returns:
+        A list of {"page": n, "text": str, "method": "pdfplumber" | "doctr" | "pdfplumber_ocr_failed"}
+        in page order. "pdfplumber_ocr_failed" pages needed OCR, but it failed for them; their
+        text layer stands in.
+    """
+    with span("pdfplumber"):
+        plumber_pages = extract_pages_with_pdfplumber(pdf_path)
+    if plumber_pages is None:
+        # pdfplumber couldn't open the file at all; fall back to OCR of every page.
+        with fitz.open(pdf_path) as doc:
+            plumber_pages = [""] * doc.page_count
+
+    pages = []
+    pages_to_ocr = []
+    for page_idx, page_text in enumerate(plumber_pages):
+        page_number = page_idx + 1
+        with span("quality_check"):
+            text_is_good = is_text_quality_good(page_text, min_chars=PAGE_MIN_CHARS)
+        if text_is_good:
+            pages.append({"page": page_number, "text": page_text, "method": "pdfplumber"})
         else:
-            logging.info(f"Processing PDF {i+1}/{len(pdf_files)} with OCR (✗ Quality Check): '{os.path.basename(pdf_file_path)}'")
-            
-            if not global_doctr_model:
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-                logging.info(f"Using {device} for DocTR.")
-                global_doctr_model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True).to(device)
-            
+            pages.append({"page": page_number, "text": page_text, "method": "doctr"})
+            pages_to_ocr.append(page_number)
+
+    _report_pages(progress_callback, pdf_path, [page["page"] for page in pages if page["method"] == "pdfplumber"], len(pages))
+    logging.info(
+        f"'{os.path.basename(pdf_path)}': {len(pages) - len(pages_to_ocr)}/{len(pages)} pages kept from the text layer (✓ Quality Check), "
+        f"{len(pages_to_ocr)} sent to OCR (✗ Quality Check)."
+    )
+
+    if pages_to_ocr:
+        ocr_texts = {}
+        if file_hash:
+            wanted = set(pages_to_ocr)
+            ocr_texts = {n: text for n, text in load_partial_pages(file_hash, EXTRACTOR_VERSION).items() if n in wanted}
+            if ocr_texts:
+                logging.info(f"Resuming OCR of '{os.path.basename(pdf_path)}': {len(ocr_texts)} pages were checkpointed.")
+                _report_pages(progress_callback, pdf_path, sorted(ocr_texts), len(pages))
+        remaining_pages = [page_number for page_number in pages_to_ocr if page_number not in ocr_texts]
+
+        def on_batch_done(batch_texts):
+            ocr_texts.update(batch_texts)
+            if file_hash:
+                try:
+                    with span("checkpoint"):
+                        store_partial_pages(file_hash, EXTRACTOR_VERSION, ocr_texts)
+                except OSError as e:
+                    logging.warning(f"Could not checkpoint OCR progress for '{os.path.basename(pdf_path)}': {e}")
+            _report_pages(progress_callback, pdf_path, sorted(batch_texts), len(pages))
+
+        try:
+            ocr_start_time = time.time()
+            if remaining_pages:
+                ocr_pdf_pages(pdf_path, remaining_pages, workers=ocr_workers, on_batch_done=on_batch_done)
+            print(f"  DocTR OCR of {len(remaining_pages)} pages for '{os.path.basename(pdf_path)}' completed in {time.time() - ocr_start_time:.2f} seconds.")
+        except Exception as e:
+            # Pages from the batches that did finish are kept
+            print(f"  An error occurred during DocTR processing for '{os.path.basename(pdf_path)}': {e}")
+            import traceback
+            traceback.print_exc()
+
+        for page in pages:
+            if page["method"] != "doctr":
+                continue
+            ocr_text = ocr_texts.get(page["page"])
+            if ocr_text is None:
+                # OCR failed for this page; the text layer stands in, marked so it isn't cached
+                page["method"] = "pdfplumber_ocr_failed"
+            elif ocr_text.strip():
+                page["text"] = ocr_text
+            else:
+                # OCR found nothing; keep whatever the text layer had rather than losing the page.
+                page["method"] = "pdfplumber"
 
-            combined_text = extract_text_from_pdf_with_doctr(pdf_file_path)
+    return pages
 
-    
-    
-    return combined_text
+
+def extract_pages_with_pdfplumber(pdf_path):
+    """Returns the text of every page ('' for blank pages), or None if the PDF can't be read."""
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            return [(page.extract_text() or "").strip() for page in pdf.pages]
+    except Exception as e:
+        print(f"❌ Error during extraction with pdfplumber for '{os.path.basename(pdf_path)}': {e}")
+        return None
 
 def extract_text_with_pdfplumber(pdf_path):
     extracted_text = ""
@@ -169,38 +399,136 @@ def extract_text_with_pdfplumber(pdf_path):
 
 
 
-def extract_text_from_pdf_with_doctr(pdf_path):
+def _rasterize_pages(pdf_path, first_page, last_page):
+    """Rasterizes a contiguous, 1-based, inclusive page range to PIL images."""
+    if os.name == 'nt' and poppler_bin_path:
+        return convert_from_path(pdf_path, dpi=OCR_DPI, first_page=first_page, last_page=last_page, poppler_path=poppler_bin_path)
+    return convert_from_path(pdf_path, dpi=OCR_DPI, first_page=first_page, last_page=last_page)
+
+
+def _contiguous_runs(page_numbers):
+    """Groups sorted page numbers into (first, last) runs, e.g. [1, 2, 3, 7] -> [(1, 3), (7, 7)]."""
+    runs = []
+    for page_number in page_numbers:
+        if runs and page_number == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], page_number)
+        else:
+            runs.append((page_number, page_number))
+    return runs
+
+
+def _doctr_page_to_text(page):
+    lines = []
+    for block in page.blocks:
+        for line in block.lines:
+            lines.append(" ".join([word.value for word in line.words]))
+    return "\n".join(lines)
+
+
+def _ocr_page_batch(pdf_path, page_numbers):
+    """
+    Rasterizes and OCRs one batch of pages. Only this batch's images are ever held in memory.
+    Returns {page_number: text}. Top-level so it can run in a worker process.
+    """
+    pages_np = []
+    for first_page, last_page in _contiguous_runs(page_numbers):
+        with span("rasterize"):
+            images_pil = _rasterize_pages(pdf_path, first_page, last_page)
+        pages_np.extend(np.array(img) for img in images_pil)
+        # Drop the PIL copies right away; DocTR only needs the arrays.
+        for img in images_pil:
+            img.close()
+        del images_pil
+
+    if len(pages_np) != len(page_numbers):
+        logging.warning(f"Expected {len(page_numbers)} pages from '{os.path.basename(pdf_path)}', rasterized {len(pages_np)}.")
+
+    # DocTR is loaded once per process by the model registry
+    doctr_model = get_doctr_handle()
+    with doctr_model.lock, span("ocr"):
+        result = doctr_model.model(pages_np)
+    del pages_np
+
+    return {
+        page_number: _doctr_page_to_text(page)
+        for page_number, page in zip(page_numbers, result.pages)
+    }
+
+
+def ocr_pdf_pages(pdf_path, page_numbers=None, batch_size=OCR_BATCH_SIZE, workers=OCR_WORKERS, on_batch_done=None):
+    """
+    OCRs the given 1-based pages of a PDF (all pages if None) in streaming batches.
+
+    Pages are rasterized `batch_size` at a time and each batch is freed before the next one
+    is loaded, so peak memory depends on the batch size instead of the page count. With
+    workers > 1, batches are fanned out to that many processes, each holding one batch.
+
+    `on_batch_done(batch_texts)` is called in this process with each batch's
+    {page_number: text} as soon as it finishes. A batch that fails is retried one page at
+    a time, so a single bad page (e.g. a corrupt image) only loses itself.
+
+    Returns:
+        A dict {page_number: text} covering every requested page that was OCR'd.
+    """
+    if page_numbers is None:
+        with fitz.open(pdf_path) as doc:
+            page_numbers = list(range(1, doc.page_count + 1))
+    page_numbers = sorted(page_numbers)
+    pending_batches = [page_numbers[i:i + batch_size] for i in range(0, len(page_numbers), batch_size)]
+
+    page_texts = {}
+
+    def batch_done(batch, get_texts):
+        try:
+            batch_texts = get_texts()
+        except Exception as e:
+            logging.warning(f"OCR of pages {batch} of '{os.path.basename(pdf_path)}' failed: {e}")
+            if len(batch) > 1:
+                pending_batches.extend([page_number] for page_number in batch)
+            return
+        page_texts.update(batch_texts)
+        if on_batch_done is not None:
+            on_batch_done(batch_texts)
+
+    if workers <= 1 or len(pending_batches) <= 1:
+        while pending_batches:
+            batch = pending_batches.pop(0)
+            batch_done(batch, lambda: _ocr_page_batch(pdf_path, batch))
+        return page_texts
+
+    # 'spawn' so workers don't inherit the parent's CUDA context; each worker loads its own DocTR.
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        in_flight = {}
+        # Keep at most one batch per worker in flight so rasterized pages can't pile up.
+        while pending_batches or in_flight:
+            while pending_batches and len(in_flight) < workers:
+                batch = pending_batches.pop(0)
+                in_flight[pool.submit(_ocr_page_batch, pdf_path, batch)] = batch
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_done(in_flight.pop(future), future.result)
+    return page_texts
+
+
+def extract_text_from_pdf_with_doctr(pdf_path, workers=OCR_WORKERS):
     extracted_pdf_text = ""
     try:
-        print(f"  Converting PDF '{os.path.basename(pdf_path)}' to images (DPI 300)...")
-        conversion_start_time = time.time()
-        if os.name == 'nt' and poppler_bin_path:
-            images_pil = convert_from_path(pdf_path, dpi=300, poppler_path=poppler_bin_path)
-        else:
-            images_pil = convert_from_path(pdf_path, dpi=300)
-        conversion_end_time = time.time()
-        print(f"  PDF conversion for '{os.path.basename(pdf_path)}' completed in {conversion_end_time - conversion_start_time:.2f} seconds.")
+        print(f"  OCR'ing '{os.path.basename(pdf_path)}' with DocTR (DPI {OCR_DPI}, {OCR_BATCH_SIZE} pages per batch, {workers} worker(s))...")
+        ocr_start_time = time.time()
+        page_texts = ocr_pdf_pages(pdf_path, workers=workers)
+        ocr_end_time = time.time()
 
-        if not images_pil:
+        if not page_texts:
             print(f"  No pages found in '{os.path.basename(pdf_path)}' or conversion failed. Skipping.")
             return ""
 
-        print(f"  Loaded {len(images_pil)} pages from '{os.path.basename(pdf_path)}'.")
-        all_pages_np = [np.array(img) for img in images_pil]
+        print(f"  DocTR OCR processing of {len(page_texts)} pages for '{os.path.basename(pdf_path)}' completed in {ocr_end_time - ocr_start_time:.2f} seconds.")
 
-        print(f"  Processing {len(all_pages_np)} pages with DocTR...")
-        ocr_start_time = time.time()
-        global_doctr_model
-        result = global_doctr_model(all_pages_np)
-        ocr_end_time = time.time()
-        print(f"  DocTR OCR processing for '{os.path.basename(pdf_path)}' completed in {ocr_end_time - ocr_start_time:.2f} seconds.")
-
-        for page_idx, page in enumerate(result.pages):
-            extracted_pdf_text += f"\n--- PDF: {os.path.basename(pdf_path)} | Page: {page_idx + 1} ---\n"
-            for block in page.blocks:
-                for line in block.lines:
-                    line_text = " ".join([word.value for word in line.words])
-                    extracted_pdf_text += line_text + "\n"
+        for page_number in sorted(page_texts):
+            extracted_pdf_text += f"\n--- PDF: {os.path.basename(pdf_path)} | Page: {page_number} ---\n"
+            if page_texts[page_number]:
+                extracted_pdf_text += page_texts[page_number] + "\n"
 
         return extracted_pdf_text
 
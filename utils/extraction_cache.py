@@ -0,0 +1,139 @@
+# utils/extraction_cache.py
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from config import EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_MB
+
+_eviction_lock = threading.Lock()
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Hashes a file's bytes without loading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _entry_path(file_hash, extractor_version):
+    # Two-character fan-out keeps any single directory small.
+    return os.path.join(EXTRACTION_CACHE_DIR, file_hash[:2], f"{file_hash}.v{extractor_version}.json")
+
+
+def _partial_entry_path(file_hash, extractor_version):
+    return os.path.join(EXTRACTION_CACHE_DIR, file_hash[:2], f"{file_hash}.v{extractor_version}.partial.json")
+
+
+def _write_json_atomic(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write-then-rename so concurrent readers (other sessions/processes) never see a partial file.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_cached_pages(file_hash, extractor_version):
+    """
+    Returns the cached per-page extraction for a file hash, or None on a miss.
+    A hit refreshes the entry's mtime, which is what the LRU eviction orders by.
+    """
+    entry_path = _entry_path(file_hash, extractor_version)
+    try:
+        with open(entry_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable extraction cache entry '{entry_path}': {e}")
+        return None
+
+    try:
+        os.utime(entry_path, None)
+    except OSError:
+        pass
+    return entry["pages"]
+
+
+def store_cached_pages(file_hash, extractor_version, pages, source=None):
+    """Stores per-page extraction results ({"page", "text", "method"} dicts) for a file hash."""
+    entry_path = _entry_path(file_hash, extractor_version)
+    entry = {
+        "sha256": file_hash,
+        "extractor_version": extractor_version,
+        "source": source,
+        "created_at": time.time(),
+        "pages": pages,
+    }
+    _write_json_atomic(entry_path, entry)
+    # The complete entry supersedes any OCR progress checkpointed along the way
+    try:
+        os.remove(_partial_entry_path(file_hash, extractor_version))
+    except FileNotFoundError:
+        pass
+    evict_extraction_cache()
+
+
+def load_partial_pages(file_hash, extractor_version):
+    """
+    Returns {page_number: text} of the OCR batches an interrupted extraction of this file
+    already finished ({} if there are none).
+    """
+    entry_path = _partial_entry_path(file_hash, extractor_version)
+    try:
+        with open(entry_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable OCR checkpoint '{entry_path}': {e}")
+        return {}
+    return {int(page_number): text for page_number, text in entry["pages"].items()}
+
+
+def store_partial_pages(file_hash, extractor_version, page_texts):
+    """Checkpoints the OCR'd pages ({page_number: text}) of an extraction still in progress."""
+    _write_json_atomic(
+        _partial_entry_path(file_hash, extractor_version),
+        {"sha256": file_hash, "extractor_version": extractor_version, "updated_at": time.time(), "pages": page_texts},
+    )
+
+
+def evict_extraction_cache(max_mb=EXTRACTION_CACHE_MAX_MB):
+    """Deletes least-recently-used entries until the cache fits in `max_mb`."""
+    with _eviction_lock:
+        entries = []
+        for dirpath, _, filenames in os.walk(EXTRACTION_CACHE_DIR):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        max_bytes = max_mb * 1024 * 1024
+        if total_bytes <= max_bytes:
+            return 0
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            evicted += 1
+        logging.info(f"Evicted {evicted} extraction cache entries.")
+        return evicted
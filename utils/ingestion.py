@@ -0,0 +1,394 @@
+# utils/ingestion.py
+
+import os
+import time
+import hashlib
+import queue
+import logging
+import threading
+import contextlib
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from config import (
+    INGEST_EXTRACT_WORKERS,
+    INGEST_QUEUE_SIZE,
+    INGEST_EMBED_BATCH_SIZE,
+    INGEST_WRITE_BATCH_SIZE,
+    OCR_WORKERS,
+)
+from utils.extraction import get_extracted_text
+from utils.extraction_cache import file_sha256
+from utils.telemetry import span
+
+# Marks the end of the stream on a stage queue.
+_END_OF_STREAM = object()
+
+
+def _extract_document(pdf_path, org_name, ocr_workers=OCR_WORKERS, progress_callback=None):
+    """
+    Top-level (picklable) extraction task run inside the process pool.
+    Returns (pdf_path, extracted_text, page numbers OCR failed for). The failed pages are
+    returned rather than reported, so they also reach the caller from a pool process.
+    """
+    ocr_failed_pages = []
+
+    def on_progress(event):
+        if event["event"] == "ocr_failed":
+            ocr_failed_pages.extend(event["pages"])
+        elif progress_callback is not None:
+            progress_callback(event)
+
+    with span("extract"):
+        extracted_text = get_extracted_text([pdf_path], org_name, ocr_workers=ocr_workers, progress_callback=on_progress)
+    return pdf_path, extracted_text, ocr_failed_pages
+
+
+def _iter_extracted(pdf_paths, org_name, extract_workers, max_in_flight, progress_callback=None):
+    """
+    Yields (pdf_path, extracted_text, ocr_failed_pages) as extraction finishes.
+    At most `max_in_flight` documents are submitted to the pool at a time, which keeps
+    extracted-but-not-yet-chunked text from piling up in memory.
+    Page-level progress is only reported for in-process extraction (extract_workers <= 1).
+    """
+    if extract_workers <= 1:
+        for pdf_path in pdf_paths:
+            yield _extract_document(pdf_path, org_name, progress_callback=progress_callback)
+        return
+
+    # 'spawn' so worker processes never inherit a CUDA context from the parent.
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=extract_workers, mp_context=mp_context) as pool:
+        pending_paths = list(pdf_paths)
+        in_flight = set()
+        while pending_paths or in_flight:
+            while pending_paths and len(in_flight) < max_in_flight:
+                # Documents are already extracted in parallel, so each one OCRs in its own worker only.
+                in_flight.add(pool.submit(_extract_document, pending_paths.pop(0), org_name, 1))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class _Stage(threading.Thread):
+    """A pipeline stage thread that consumes one queue and records the first error it hits."""
+    def __init__(self, name, target, errors):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._errors = errors
+        # Run in the creator's context so telemetry labels (e.g. org) carry over to the stage
+        self._context = contextvars.copy_context()
+
+    def run(self):
+        try:
+            self._context.run(self._target_fn)
+        except BaseException as e:
+            logging.exception(f"Ingestion stage '{self.name}' failed.")
+            self._errors.append(e)
+
+
+def _put(q, item, errors):
+    """Blocking put that gives up once another stage has failed, so the producer can't deadlock."""
+    while True:
+        if errors:
+            raise RuntimeError("Ingestion aborted because a downstream stage failed.") from errors[0]
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q, errors):
+    """Blocking get that ends the stream once another stage has failed."""
+    while not errors:
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _END_OF_STREAM
+
+
+def make_chunk_id(source, content):
+    """Deterministic chunk ID: the same text from the same source always maps to the same ID."""
+    return hashlib.sha256(f"{source}\x00{content}".encode("utf-8")).hexdigest()
+
+
+def assign_chunk_ids(chunks):
+    """
+    Stores a deterministic `chunk_id` in each chunk document's metadata and drops chunks
+    whose ID was already seen (identical text repeated within a source).
+    `chunks` is a list of (LangChain Document, embedding or None) pairs.
+    """
+    unique_chunks = []
+    seen_ids = set()
+    for doc, vector in chunks:
+        chunk_id = make_chunk_id(doc.metadata.get("source", ""), doc.page_content)
+        if chunk_id in seen_ids:
+            continue
+        seen_ids.add(chunk_id)
+        doc.metadata["chunk_id"] = chunk_id
+        unique_chunks.append((doc, vector))
+    return unique_chunks
+
+
+def write_chunks(vectorstore, docs, embeddings):
+    """
+    Upserts already-embedded LangChain documents into the vectorstore's collection.
+    IDs come from `chunk_id`, so re-ingesting the same content overwrites instead of duplicating.
+    """
+    vectorstore._collection.upsert(
+        ids=[doc.metadata["chunk_id"] for doc in docs],
+        embeddings=embeddings,
+        metadatas=[doc.metadata for doc in docs],
+        documents=[doc.page_content for doc in docs],
+    )
+
+
+def delete_stale_chunks(vectorstore, source, keep_ids, lexical_index=None):
+    """Deletes a source's chunks that are not in `keep_ids`. Returns how many were deleted."""
+    existing = vectorstore._collection.get(where={"source": source}, include=[])
+    stale_ids = [chunk_id for chunk_id in existing["ids"] if chunk_id not in keep_ids]
+    if stale_ids:
+        vectorstore._collection.delete(ids=stale_ids)
+        if lexical_index is not None:
+            lexical_index.delete(stale_ids)
+    return len(stale_ids)
+
+
+def _all_written(vectorstore, chunk_ids):
+    """True if every chunk ID is still in the vector store (a committed checkpoint can outlive its chunks)."""
+    if not chunk_ids:
+        return True
+    return len(vectorstore._collection.get(ids=list(chunk_ids), include=[])["ids"]) == len(set(chunk_ids))
+
+
+def run_ingestion_pipeline(
+    pdf_paths,
+    org_name,
+    vectorstore,
+    chunk_document,
+    embeddings_model,
+    extract_workers=INGEST_EXTRACT_WORKERS,
+    queue_size=INGEST_QUEUE_SIZE,
+    embed_batch_size=INGEST_EMBED_BATCH_SIZE,
+    write_batch_size=INGEST_WRITE_BATCH_SIZE,
+    replace_existing=True,
+    lexical_index=None,
+    progress_callback=None,
+    checkpoints=None,
+    write_lock=contextlib.nullcontext,
+):
+    """
+    Ingests PDFs through an extract -> chunk -> embed -> write pipeline.
+
+    Extraction runs in a process pool, chunking runs on the calling thread, and embedding
+    and writing each run on their own thread. Stages are connected by bounded queues, so
+    the next file is extracted while the previous one is embedded and memory stays bounded
+    by the queue sizes rather than by the number of files.
+
+    Args:
+        pdf_paths: PDF files to ingest.
+        org_name: Organization the documents belong to.
+        vectorstore: The org's LangChain Chroma vectorstore.
+        chunk_document: Callable (text, pdf_path) -> list of (LangChain Document, embedding or None).
+        embeddings_model: LangChain Embeddings used for chunks that arrive without an embedding.
+        replace_existing: If True, a re-ingested source's old chunks that no longer
+            appear in the new version are deleted once the new chunks are written.
+        lexical_index: Optional LexicalIndex kept in sync with the vector store writes.
+        progress_callback: Optional callable receiving progress events (dicts with an
+            "event" key): pages_extracted, ocr_failed, document_extracted, document_skipped,
+            document_chunked and chunks_written. It may raise to abort the ingestion.
+            A document whose OCR failed on some pages is still ingested, with the text
+            layer of those pages; ocr_failed lists them.
+        checkpoints: Optional IngestionCheckpoints. Documents already committed by an
+            earlier, interrupted run are skipped, and chunked ones are written from their
+            checkpoint instead of being extracted and chunked again.
+        write_lock: Callable returning a context manager held around every vector store
+            write (see utils/chroma_lock.py). It is taken per batch, not for the whole run.
+
+    Returns:
+        A dict of counters: documents, skipped, resumed, chunks, replaced and seconds.
+    """
+    start_time = time.perf_counter()
+    stats = {"documents": 0, "skipped": 0, "resumed": 0, "chunks": 0, "replaced": 0, "seconds": 0.0}
+    ids_by_source = {}
+    errors = []
+    # Checkpoint bookkeeping: the file hash of every document, the chunk IDs each document is
+    # still waiting on, and the owning file hashes of every chunk, so the write stage knows
+    # when a document is fully committed
+    file_hashes = {}
+    doc_chunk_ids = {}
+    pending_writes = {}
+    hash_of_chunk = {}
+    embed_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+
+    def report(event):
+        if progress_callback is not None:
+            progress_callback(event)
+
+    def embed_stage():
+        batch = []
+        while True:
+            item = _get(embed_queue, errors)
+            if item is not _END_OF_STREAM:
+                batch.extend(item)
+            while len(batch) >= embed_batch_size or (item is _END_OF_STREAM and batch):
+                chunks, batch = batch[:embed_batch_size], batch[embed_batch_size:]
+                # Chunks from the semantic chunker usually arrive already embedded.
+                missing = [i for i, (_, vector) in enumerate(chunks) if vector is None]
+                if missing:
+                    with span("embed"):
+                        new_vectors = embeddings_model.embed_documents([chunks[i][0].page_content for i in missing])
+                    for i, vector in zip(missing, new_vectors):
+                        chunks[i] = (chunks[i][0], vector)
+                _put(write_queue, ([doc for doc, _ in chunks], [vector for _, vector in chunks]), errors)
+            if item is _END_OF_STREAM:
+                _put(write_queue, _END_OF_STREAM, errors)
+                return
+
+    def write_stage():
+        docs, vectors = [], []
+        while True:
+            item = _get(write_queue, errors)
+            if item is not _END_OF_STREAM:
+                docs.extend(item[0])
+                vectors.extend(item[1])
+            if docs and (len(docs) >= write_batch_size or item is _END_OF_STREAM):
+                with span("chroma_write"), write_lock():
+                    write_chunks(vectorstore, docs, vectors)
+                if lexical_index is not None:
+                    with span("lexical_index"):
+                        lexical_index.add_documents(docs)
+                stats["chunks"] += len(docs)
+                if checkpoints is not None:
+                    mark_committed(docs)
+                report({"event": "chunks_written", "count": len(docs), "total": stats["chunks"]})
+                logging.info(f"Wrote {len(docs)} chunks to the '{org_name}' vector store.")
+                docs, vectors = [], []
+            if item is _END_OF_STREAM:
+                return
+
+    def mark_committed(docs):
+        for doc in docs:
+            chunk_id = doc.metadata["chunk_id"]
+            # Two versions of a file with the same name share the IDs of their unchanged chunks,
+            # so one write can count towards several documents
+            for file_hash in tuple(hash_of_chunk.get(chunk_id, ())):
+                pending = pending_writes.get(file_hash)
+                if pending is None:
+                    continue
+                pending.discard(chunk_id)
+                if not pending:
+                    del pending_writes[file_hash]
+                    checkpoints.mark_committed(file_hash, doc.metadata.get("source"), doc_chunk_ids[file_hash])
+
+    def queue_chunks(pdf_path, chunks):
+        source = chunks[0][0].metadata.get("source") if chunks else os.path.basename(pdf_path)
+        chunk_ids = [doc.metadata["chunk_id"] for doc, _ in chunks]
+        ids_by_source.setdefault(source, set()).update(chunk_ids)
+        stats["documents"] += 1
+        print(f"Prepared {len(chunks)} chunks from '{os.path.basename(pdf_path)}'.")
+        report({"event": "document_chunked", "source": os.path.basename(pdf_path), "chunks": len(chunks)})
+        if not chunks:
+            return
+        if checkpoints is not None:
+            file_hash = file_hashes[pdf_path]
+            doc_chunk_ids[file_hash] = chunk_ids
+            for chunk_id in chunk_ids:
+                hash_of_chunk.setdefault(chunk_id, set()).add(file_hash)
+            pending_writes[file_hash] = set(chunk_ids)
+        _put(embed_queue, chunks, errors)
+
+    # Resume documents an earlier run already got through; only the rest are extracted
+    pdf_paths_to_extract = list(pdf_paths)
+    resumed = []
+    if checkpoints is not None:
+        pdf_paths_to_extract = []
+        with span("checkpoint"):
+            for pdf_path in pdf_paths:
+                file_hash = file_hashes[pdf_path] = file_sha256(pdf_path)
+                committed = checkpoints.load_committed(file_hash)
+                if committed is not None and _all_written(vectorstore, committed["chunk_ids"]):
+                    resumed.append((pdf_path, committed, None))
+                    continue
+                chunks = checkpoints.load_chunks(file_hash)
+                if chunks is not None:
+                    resumed.append((pdf_path, None, chunks))
+                else:
+                    pdf_paths_to_extract.append(pdf_path)
+
+    embedder = _Stage("embed", embed_stage, errors)
+    writer = _Stage("write", write_stage, errors)
+    embedder.start()
+    writer.start()
+
+    try:
+        for pdf_path, committed, chunks in resumed:
+            stats["resumed"] += 1
+            report({"event": "document_extracted", "source": os.path.basename(pdf_path)})
+            if committed is not None:
+                logging.info(f"'{os.path.basename(pdf_path)}' was committed by an earlier run; skipping it.")
+                ids_by_source.setdefault(committed["source"], set()).update(committed["chunk_ids"])
+                stats["documents"] += 1
+                report({"event": "document_chunked", "source": os.path.basename(pdf_path),
+                        "chunks": len(committed["chunk_ids"])})
+            else:
+                logging.info(f"Resuming '{os.path.basename(pdf_path)}' from its chunk checkpoint.")
+                queue_chunks(pdf_path, chunks)
+
+        max_in_flight = max(1, extract_workers) + queue_size
+        extracted_docs = _iter_extracted(
+            pdf_paths_to_extract, org_name, extract_workers, max_in_flight, progress_callback
+        )
+        for pdf_path, extracted_text, ocr_failed_pages in extracted_docs:
+            if ocr_failed_pages:
+                report({"event": "ocr_failed", "source": os.path.basename(pdf_path), "pages": ocr_failed_pages})
+            if not extracted_text.strip():
+                print(f"Skipping empty document: {os.path.basename(pdf_path)}")
+                stats["skipped"] += 1
+                report({"event": "document_skipped", "source": os.path.basename(pdf_path)})
+                continue
+            report({"event": "document_extracted", "source": os.path.basename(pdf_path)})
+
+            with span("chunk"):
+                chunks = assign_chunk_ids(chunk_document(extracted_text, pdf_path))
+            if checkpoints is not None and chunks:
+                with span("checkpoint"):
+                    checkpoints.store_chunks(file_hashes[pdf_path], chunks)
+            queue_chunks(pdf_path, chunks)
+    finally:
+        # Always terminate the stage threads, even if extraction or chunking raised.
+        if not errors:
+            try:
+                _put(embed_queue, _END_OF_STREAM, errors)
+            except RuntimeError:
+                pass
+        embedder.join()
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+    # Old chunks are removed only after the new version is fully written, so a
+    # replaced document never disappears from retrieval in between.
+    if replace_existing:
+        for source, keep_ids in ids_by_source.items():
+            with write_lock():
+                stats["replaced"] += delete_stale_chunks(vectorstore, source, keep_ids, lexical_index)
+        if stats["replaced"]:
+            logging.info(f"Removed {stats['replaced']} stale chunks from re-ingested documents.")
+
+    # The run is complete, so nothing is left to resume
+    if checkpoints is not None:
+        checkpoints.clear(file_hashes.values())
+
+    stats["seconds"] = time.perf_counter() - start_time
+    logging.info(
+        f"Ingested {stats['documents']} documents ({stats['chunks']} chunks, {stats['skipped']} skipped, "
+        f"{stats['resumed']} resumed from checkpoints) "
+        f"for '{org_name}' in {stats['seconds']:.2f}s."
+    )
+    return stats
@@ -0,0 +1,111 @@
+# utils/ingestion_checkpoint.py
+
+import os
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+from langchain.schema import Document as LangChainDocument
+
+from config import INGEST_CHECKPOINT_DIR, INGEST_CHECKPOINT_MAX_AGE_HOURS
+
+
+class IngestionCheckpoints:
+    """
+    Per-document ingestion checkpoints for one org, keyed by the SHA-256 of the PDF bytes:
+
+        <hash>.chunks.npz      the document's chunks with their embeddings (chunked + embedded)
+        <hash>.committed.json  the chunk IDs, once every chunk is in the vector store
+
+    Extraction is checkpointed separately by the extraction cache. Checkpoints of a run
+    are cleared when the run succeeds; ones left behind by a failed or interrupted run
+    let the next run (a job retry, or the same file uploaded again) skip finished stages.
+    """
+    def __init__(self, org_name, root=INGEST_CHECKPOINT_DIR, max_age_hours=INGEST_CHECKPOINT_MAX_AGE_HOURS):
+        self.directory = os.path.join(root, org_name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune(max_age_hours * 3600)
+
+    def _path(self, file_hash, kind):
+        return os.path.join(self.directory, f"{file_hash}.{kind}")
+
+    def _replace(self, path, write):
+        # Write-then-rename, so a crash mid-write never leaves a truncated checkpoint.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def store_chunks(self, file_hash, chunks):
+        """Saves a document's (LangChain Document, embedding or None) pairs."""
+        records = [{"text": doc.page_content, "metadata": doc.metadata} for doc, _ in chunks]
+        vectors = [vector for _, vector in chunks]
+        # Embeddings are only kept if every chunk has one; otherwise they are recomputed on resume
+        if vectors and all(vector is not None for vector in vectors):
+            embeddings = np.asarray(vectors, dtype=np.float32)
+        else:
+            embeddings = np.zeros((0,), dtype=np.float32)
+        self._replace(
+            self._path(file_hash, "chunks.npz"),
+            lambda f: np.savez(f, documents=np.array(json.dumps(records, ensure_ascii=False)), embeddings=embeddings),
+        )
+
+    def load_chunks(self, file_hash):
+        """Returns the checkpointed (Document, embedding or None) pairs, or None if there are none."""
+        path = self._path(file_hash, "chunks.npz")
+        try:
+            with np.load(path) as data:
+                records = json.loads(str(data["documents"]))
+                embeddings = data["embeddings"]
+                vectors = embeddings.tolist() if len(embeddings) == len(records) else [None] * len(records)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable ingestion checkpoint '{path}': {e}")
+            return None
+        return [
+            (LangChainDocument(page_content=record["text"], metadata=record["metadata"]), vector)
+            for record, vector in zip(records, vectors)
+        ]
+
+    def mark_committed(self, file_hash, source, chunk_ids):
+        entry = {"source": source, "chunk_ids": list(chunk_ids), "committed_at": time.time()}
+        self._replace(
+            self._path(file_hash, "committed.json"),
+            lambda f: f.write(json.dumps(entry, ensure_ascii=False).encode("utf-8")),
+        )
+
+    def load_committed(self, file_hash):
+        """Returns {"source", "chunk_ids", "committed_at"} if the document was fully written, else None."""
+        path = self._path(file_hash, "committed.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable ingestion checkpoint '{path}': {e}")
+            return None
+
+    def clear(self, file_hashes):
+        for file_hash in file_hashes:
+            for kind in ("chunks.npz", "committed.json"):
+                try:
+                    os.remove(self._path(file_hash, kind))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"Could not remove ingestion checkpoint for {file_hash[:12]}: {e}")
+
+    def prune(self, max_age_seconds):
+        """Deletes checkpoints (and stray temp files) older than `max_age_seconds`."""
+        cutoff = time.time() - max_age_seconds
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
@@ -0,0 +1,391 @@
+# utils/job_queue.py
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import logging
+import subprocess
+
+from config import (
+    JOB_QUEUE_DB_PATH,
+    JOB_UPLOAD_DIR,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BACKOFF_SECONDS,
+    JOB_HEARTBEAT_SECONDS,
+    JOB_STALE_SECONDS,
+    JOB_AUTOSTART_WORKER,
+    INGEST_CHECKPOINT_MAX_AGE_HOURS,
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ingestion_worker.py")
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a running job once cancellation was requested. A BaseException, so the
+    extraction and OCR fallbacks that catch Exception don't swallow it.
+    """
+
+
+def _connect():
+    os.makedirs(os.path.dirname(JOB_QUEUE_DB_PATH), exist_ok=True)
+    # Autocommit mode; multi-statement updates use explicit BEGIN IMMEDIATE transactions
+    conn = sqlite3.connect(JOB_QUEUE_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            org_name TEXT NOT NULL,
+            submitted_by TEXT,
+            status TEXT NOT NULL,
+            files TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            worker_id TEXT,
+            error TEXT,
+            progress TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            available_at REAL NOT NULL,
+            started_at REAL,
+            heartbeat_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, available_at);
+        CREATE INDEX IF NOT EXISTS jobs_org ON jobs(org_name, created_at);
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            pid INTEGER,
+            hostname TEXT,
+            started_at REAL,
+            heartbeat_at REAL,
+            job_id TEXT
+        );
+        """
+    )
+    return conn
+
+
+def _job_from_row(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["files"] = json.loads(job["files"])
+    job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    return job
+
+
+def job_upload_dir(job_id):
+    """Directory holding a job's PDFs until the job reaches a final status."""
+    return os.path.join(JOB_UPLOAD_DIR, job_id)
+
+
+# --- Submitting and watching jobs (app side) ---
+
+def submit_job(org_name, pdf_paths, submitted_by=None, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Queues an ingestion job. The PDFs are moved into the job's own upload directory, so
+    later uploads (or clean-ups of the upload folder) can't touch them. Returns the job ID.
+    """
+    _purge_failed_uploads()
+    job_id = uuid.uuid4().hex
+    upload_dir = job_upload_dir(job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    files = []
+    for pdf_path in pdf_paths:
+        target = os.path.join(upload_dir, os.path.basename(pdf_path))
+        shutil.move(pdf_path, target)
+        files.append(target)
+
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, org_name, submitted_by, status, files, max_attempts, created_at, available_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, org_name, submitted_by, QUEUED, json.dumps(files), max_attempts, now, now),
+        )
+    logging.info(f"Queued ingestion job {job_id} with {len(files)} files for '{org_name}'.")
+    return job_id
+
+
+def get_job(job_id):
+    with _connect() as conn:
+        return _job_from_row(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def list_jobs(org_name=None, limit=20):
+    """Most recent jobs first, optionally for one organization."""
+    with _connect() as conn:
+        if org_name is None:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE org_name = ? ORDER BY created_at DESC LIMIT ?", (org_name, limit)
+            ).fetchall()
+    return [_job_from_row(row) for row in rows]
+
+
+def request_cancel(job_id):
+    """
+    Cancels a queued job right away, or asks the worker running it to stop at its next
+    progress update. Returns False if the job had already finished.
+    """
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] in FINAL_STATUSES:
+            conn.execute("COMMIT")
+            return False
+        if row["status"] == QUEUED:
+            conn.execute(
+                "UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ? WHERE id = ?",
+                (CANCELLED, time.time(), job_id),
+            )
+        else:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        conn.execute("COMMIT")
+    if row["status"] == QUEUED:
+        shutil.rmtree(job_upload_dir(job_id), ignore_errors=True)
+    return True
+
+
+def retry_job(job_id):
+    """
+    Queues a failed job again with a fresh set of attempts. Its files were kept, and the
+    ingestion checkpoints let it resume where the last attempt stopped. Returns False if
+    the job isn't a failed job with its files still present.
+    """
+    if not os.path.isdir(job_upload_dir(job_id)):
+        return False
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, attempts = 0, error = NULL, worker_id = NULL, available_at = ?, "
+            "finished_at = NULL WHERE id = ? AND status = ?",
+            (QUEUED, now, job_id, FAILED),
+        )
+    return cursor.rowcount == 1
+
+
+def _purge_failed_uploads():
+    """Removes the kept files of failed jobs once their checkpoints would have expired too."""
+    cutoff = time.time() - INGEST_CHECKPOINT_MAX_AGE_HOURS * 3600
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = ? AND finished_at < ?", (FAILED, cutoff)
+        ).fetchall()
+    for row in rows:
+        shutil.rmtree(job_upload_dir(row["id"]), ignore_errors=True)
+
+
+def live_workers(max_age_seconds=None):
+    """Workers that sent a heartbeat recently."""
+    max_age_seconds = max_age_seconds or JOB_HEARTBEAT_SECONDS * 3
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT * FROM workers WHERE heartbeat_at >= ?", (time.time() - max_age_seconds,)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+_last_worker_spawn = 0.0
+
+
+def ensure_worker_running():
+    """
+    Starts a background ingestion worker process if JOB_AUTOSTART_WORKER is set and no
+    worker is alive. Returns True if a worker is (or is being) started.
+    """
+    global _last_worker_spawn
+    if live_workers():
+        return True
+    if not JOB_AUTOSTART_WORKER:
+        return False
+    # A freshly spawned worker needs a moment to load and register; don't spawn another meanwhile
+    if time.time() - _last_worker_spawn < JOB_STALE_SECONDS:
+        return True
+    _last_worker_spawn = time.time()
+    kwargs = {"cwd": os.path.dirname(WORKER_SCRIPT)}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    subprocess.Popen([sys.executable, WORKER_SCRIPT], **kwargs)
+    logging.info("Started a background ingestion worker.")
+    return True
+
+
+# --- Running jobs (worker side) ---
+
+def register_worker(worker_id):
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO workers (worker_id, pid, hostname, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)",
+            (worker_id, os.getpid(), socket.gethostname(), now, now),
+        )
+
+
+def unregister_worker(worker_id):
+    with _connect() as conn:
+        conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+
+def worker_heartbeat(worker_id, job_id=None):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE workers SET heartbeat_at = ?, job_id = ? WHERE worker_id = ?", (time.time(), job_id, worker_id)
+        )
+
+
+def _requeue_stale_jobs(conn, now):
+    """Jobs whose worker stopped sending heartbeats go back to the queue (or fail/cancel)."""
+    stale = conn.execute(
+        "SELECT id, attempts, max_attempts, cancel_requested FROM jobs WHERE status = ? AND heartbeat_at < ?",
+        (RUNNING, now - JOB_STALE_SECONDS),
+    ).fetchall()
+    for job in stale:
+        if job["cancel_requested"]:
+            status = CANCELLED
+        elif job["attempts"] >= job["max_attempts"]:
+            status = FAILED
+        else:
+            status = QUEUED
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker_id = NULL, error = ?, available_at = ?, "
+            "finished_at = CASE WHEN ? = ? THEN NULL ELSE ? END WHERE id = ?",
+            (status, "The worker running this job stopped responding.", now, status, QUEUED, now, job["id"]),
+        )
+        logging.warning(f"Ingestion job {job['id']} lost its worker; now {status}.")
+
+
+def claim_next_job(worker_id):
+    """Atomically takes the oldest runnable job for this worker. Returns the job or None."""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _requeue_stale_jobs(conn, now)
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status = ? AND available_at <= ? ORDER BY created_at LIMIT 1", (QUEUED, now)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? "
+            "WHERE id = ?",
+            (RUNNING, worker_id, now, now, row["id"]),
+        )
+        job = _job_from_row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+        conn.execute("COMMIT")
+    return job
+
+
+def heartbeat_job(job_id, worker_id):
+    """Refreshes a running job's heartbeat. Returns True if cancellation was requested."""
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker_id = ?", (time.time(), job_id, worker_id)
+        )
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return bool(row and row["cancel_requested"])
+
+
+def update_progress(job_id, progress):
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?", (json.dumps(progress), time.time(), job_id)
+        )
+
+
+def finish_job(job_id, status, error=None, result=None):
+    """Marks a job succeeded or cancelled and removes its upload directory."""
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, result = ?, finished_at = ? WHERE id = ?",
+            (status, error, json.dumps(result) if result is not None else None, time.time(), job_id),
+        )
+    shutil.rmtree(job_upload_dir(job_id), ignore_errors=True)
+
+
+def fail_job(job_id, error):
+    """
+    Records a failed attempt. The job is queued again after a backoff while it has
+    attempts left; otherwise it is marked failed. Its files are kept either way, so a
+    failed job can still be retried (see retry_job). Returns the job's new status.
+    """
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        retry = row is not None and row["attempts"] < row["max_attempts"]
+        if retry:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker_id = NULL, available_at = ? WHERE id = ?",
+                (QUEUED, error, now + JOB_RETRY_BACKOFF_SECONDS * row["attempts"], job_id),
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?", (FAILED, error, now, job_id)
+            )
+        conn.execute("COMMIT")
+    return QUEUED if retry else FAILED
+
+
+# --- Progress bookkeeping ---
+
+def new_progress(files):
+    return {
+        "files_total": len(files),
+        "files_done": 0,
+        "pages_done": 0,
+        "chunks_written": 0,
+        "files": {
+            os.path.basename(path): {
+                "status": "pending", "pages_done": 0, "pages_total": None, "chunks": 0, "ocr_failed_pages": [],
+            }
+            for path in files
+        },
+    }
+
+
+def apply_progress_event(progress, event):
+    """Folds one ingestion progress event (see run_ingestion_pipeline) into a job's progress dict."""
+    kind = event["event"]
+    file_progress = progress["files"].get(event.get("source"))
+    if kind == "pages_extracted" and file_progress is not None:
+        file_progress["status"] = "extracting"
+        file_progress["pages_total"] = event["pages_total"]
+        file_progress["pages_done"] = min(event["pages_total"], file_progress["pages_done"] + len(event["pages"]))
+        progress["pages_done"] += len(event["pages"])
+    elif kind == "ocr_failed" and file_progress is not None:
+        file_progress["ocr_failed_pages"] = sorted(event["pages"])
+    elif kind == "document_extracted" and file_progress is not None:
+        file_progress["status"] = "chunking"
+    elif kind == "document_chunked" and file_progress is not None:
+        file_progress["status"] = "done"
+        file_progress["chunks"] = event["chunks"]
+        progress["files_done"] += 1
+    elif kind == "document_skipped" and file_progress is not None:
+        file_progress["status"] = "skipped (no text)"
+        progress["files_done"] += 1
+    elif kind == "chunks_written":
+        progress["chunks_written"] = event["total"]
+    return progress
@@ -0,0 +1,177 @@
+# utils/lexical_index.py
+
+import os
+import re
+import sqlite3
+import logging
+import threading
+
+from config import CHROMA_DB_DIRECTORY
+
+LEXICAL_INDEX_FILENAME = "lexical_index.sqlite3"
+
+# Identifiers such as "AB-1234", "4.2.1" or "v2_final" are kept as one token (their parts
+# are indexed too), so an exact part number or clause ID matches as a whole.
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lower-cased word tokens of a text, with compound identifiers also split into their parts."""
+    tokens = []
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(_PART_RE.findall(token))
+    return tokens
+
+
+class LexicalIndex:
+    """
+    On-disk BM25 index of an organization's chunks (SQLite FTS5), keyed by chunk ID.
+
+    Chunks are pre-tokenized with `tokenize` and stored space-separated, so FTS5 only has
+    to split on whitespace. A side table maps chunk IDs to FTS rows for upserts and deletes.
+    Each call opens its own short-lived connection, so the index can be shared between
+    threads and with ingestion running in other processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._schema_ready:
+            with self._schema_lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(
+                    """
+                    CREATE VIRTUAL TABLE IF NOT EXISTS chunk_terms USING fts5(
+                        terms, tokenize = "unicode61 tokenchars '-_./'"
+                    );
+                    CREATE TABLE IF NOT EXISTS chunks (
+                        chunk_id TEXT PRIMARY KEY,
+                        fts_rowid INTEGER NOT NULL,
+                        source TEXT,
+                        document_id TEXT
+                    );
+                    CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+                    """
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+                if "document_id" not in columns:
+                    conn.execute("ALTER TABLE chunks ADD COLUMN document_id TEXT")
+                conn.execute("CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks(document_id)")
+                self._schema_ready = True
+        return conn
+
+    def add(self, chunk_ids, texts, sources, document_ids=None):
+        """Indexes (or re-indexes) chunks."""
+        document_ids = document_ids or [None] * len(chunk_ids)
+        with self._connect() as conn:
+            self._delete_ids(conn, chunk_ids)
+            for chunk_id, text, source, document_id in zip(chunk_ids, texts, sources, document_ids):
+                cursor = conn.execute("INSERT INTO chunk_terms(terms) VALUES (?)", (" ".join(tokenize(text)),))
+                conn.execute(
+                    "INSERT INTO chunks(chunk_id, fts_rowid, source, document_id) VALUES (?, ?, ?, ?)",
+                    (chunk_id, cursor.lastrowid, source, document_id),
+                )
+
+    def add_documents(self, docs):
+        """Indexes LangChain documents that carry a `chunk_id` in their metadata."""
+        self.add(
+            [doc.metadata["chunk_id"] for doc in docs],
+            [doc.page_content for doc in docs],
+            [doc.metadata.get("source") for doc in docs],
+            [doc.metadata.get("document_id") for doc in docs],
+        )
+
+    @staticmethod
+    def _delete_ids(conn, chunk_ids):
+        for chunk_id in chunk_ids:
+            row = conn.execute("SELECT fts_rowid FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM chunk_terms WHERE rowid = ?", (row[0],))
+                conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+
+    def delete(self, chunk_ids):
+        with self._connect() as conn:
+            self._delete_ids(conn, chunk_ids)
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query, k, sources=None, document_ids=None):
+        """
+        Returns up to k (chunk_id, bm25_score) pairs, best first (higher score is better).
+        `sources` / `document_ids` optionally restrict the search to those documents.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        # Quote each term so FTS5 treats it literally, and OR them for BM25-style matching
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        sql = (
+            "SELECT chunks.chunk_id, bm25(chunk_terms) AS rank FROM chunk_terms "
+            "JOIN chunks ON chunks.fts_rowid = chunk_terms.rowid WHERE chunk_terms MATCH ?"
+        )
+        params = [match]
+        if sources:
+            sql += f" AND chunks.source IN ({','.join('?' * len(sources))})"
+            params.extend(sources)
+        if document_ids:
+            sql += f" AND chunks.document_id IN ({','.join('?' * len(document_ids))})"
+            params.extend(document_ids)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(k)
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logging.warning(f"Lexical search failed on '{self.path}': {e}")
+            return []
+        # FTS5's bm25() is negated so that ORDER BY ascending puts the best match first
+        return [(chunk_id, -rank) for chunk_id, rank in rows]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(org_name):
+    """Returns the process-wide lexical index of an organization (stored next to its Chroma data)."""
+    with _indexes_lock:
+        index = _indexes.get(org_name)
+        if index is None:
+            org_dir = os.path.join(CHROMA_DB_DIRECTORY, org_name)
+            os.makedirs(org_dir, exist_ok=True)
+            index = _indexes[org_name] = LexicalIndex(os.path.join(org_dir, LEXICAL_INDEX_FILENAME))
+        return index
+
+
+def backfill_lexical_index(index, vectorstore, page_size=1000):
+    """
+    Indexes every chunk already in the vector store. Used once for stores that were
+    ingested before the lexical index existed. Returns the number of chunks indexed.
+    """
+    collection = vectorstore._collection
+    indexed = 0
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        rows = [
+            (chunk_id, text, (metadata or {}).get("source"), (metadata or {}).get("document_id"))
+            for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"])
+            if (text or "").strip()
+        ]
+        if rows:
+            index.add(*zip(*rows))
+            indexed += len(rows)
+        offset += len(page["ids"])
+    if indexed:
+        logging.info(f"Backfilled the lexical index '{index.path}' with {indexed} chunks.")
+    return indexed
@@ -0,0 +1,134 @@
+# utils/model_registry.py
+
+import os
+import time
+import logging
+import threading
+
+import torch
+
+from config import EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME, DOCTR_DET_ARCH, DOCTR_RECO_ARCH, EMBED_BATCH_SIZE
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def current_rss_mb():
+    """Returns the resident memory of this process in MB, or None if it can't be read."""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        # /proc is the cheapest source on Linux and needs no extra dependency.
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ModelHandle:
+    """
+    A loaded model plus the lock callers hold while running it.
+    The handle is shared by every thread in the process, so inference should go
+    through `with handle.lock:` unless the model is known to be re-entrant.
+    """
+    def __init__(self, name, model, load_seconds, rss_delta_mb):
+        self.name = name
+        self.model = model
+        self.load_seconds = load_seconds
+        self.rss_delta_mb = rss_delta_mb
+        self.lock = threading.RLock()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "load_seconds": round(self.load_seconds, 3),
+            "rss_delta_mb": None if self.rss_delta_mb is None else round(self.rss_delta_mb, 1),
+        }
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of heavy models (embeddings, reranker, OCR).
+    Each model is built at most once per process; later calls return the same handle.
+    """
+    def __init__(self):
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+
+    def get(self, key, loader):
+        """Returns the handle for `key`, calling `loader()` the first time it is requested."""
+        handle = self._handles.get(key)
+        if handle is not None:
+            return handle
+
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        # One lock per key so a slow OCR load doesn't block an embedding lookup.
+        with loading_lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                return handle
+
+            logging.info(f"Loading model '{key}' on {device}...")
+            rss_before = current_rss_mb()
+            start_time = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start_time
+            rss_after = current_rss_mb()
+            rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+
+            handle = ModelHandle(key, model, load_seconds, rss_delta)
+            self._handles[key] = handle
+            logging.info(f"Loaded model '{key}' in {load_seconds:.2f}s (RSS delta: {rss_delta if rss_delta is None else f'{rss_delta:.1f} MB'}).")
+            return handle
+
+    def is_loaded(self, key):
+        return key in self._handles
+
+    def stats(self):
+        """Returns load time and memory cost of every model loaded so far."""
+        return {
+            "process_rss_mb": current_rss_mb(),
+            "models": [handle.stats() for handle in self._handles.values()],
+        }
+
+
+registry = ModelRegistry()
+
+
+# --- Loaders ---
+def _load_embedding_model(model_name):
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    return HuggingFaceEmbedding(model_name=model_name, device=device, embed_batch_size=EMBED_BATCH_SIZE)
+
+
+def _load_cross_encoder(model_name):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, device=device)
+
+
+def _load_doctr_model():
+    from doctr.models import ocr_predictor
+    return ocr_predictor(det_arch=DOCTR_DET_ARCH, reco_arch=DOCTR_RECO_ARCH, pretrained=True).to(device)
+
+
+# --- Public accessors ---
+def get_embedding_handle(model_name=EMBEDDING_MODEL_NAME):
+    return registry.get(f"embedding:{model_name}", lambda: _load_embedding_model(model_name))
+
+
+def get_reranker_handle(model_name=RERANKER_MODEL_NAME):
+    return registry.get(f"reranker:{model_name}", lambda: _load_cross_encoder(model_name))
+
+
+def get_doctr_handle():
+    return registry.get(f"ocr:{DOCTR_DET_ARCH}+{DOCTR_RECO_ARCH}", _load_doctr_model)
+
+
+def get_model_stats():
+    return registry.stats()
@@ -0,0 +1,124 @@
+# utils/prompt_budget.py
+
+import re
+import math
+
+from utils.chunking import PAGE_MARKER_RE
+
+# Gemini's tokenizer isn't available offline; ~4 characters per token is its documented
+# rule of thumb for English text and is close enough for budgeting.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Approximate token count of a string."""
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text to roughly `max_tokens`, preferring to end at a sentence or line boundary."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary > max_chars // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + " ..."
+
+
+def format_chat_history(messages, token_budget):
+    """
+    Formats the most recent chat messages as "Human: ..." / "AI: ..." lines, keeping as
+    many messages (newest first) as fit in `token_budget`. A single message that is too
+    long on its own is truncated instead of dropped, so the last turn is always present.
+    """
+    lines = []
+    used_tokens = 0
+    for message in reversed(messages or []):
+        speaker = "Human" if message.get("role") == "user" else "AI"
+        line = f"{speaker}: {message.get('content', '')}"
+        line_tokens = estimate_tokens(line)
+        if used_tokens + line_tokens > token_budget:
+            if not lines:
+                lines.append(truncate_to_tokens(line, token_budget))
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+    return "\n".join(reversed(lines))
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _pages_of(doc):
+    """Page numbers a chunk covers, from its metadata or the extraction page markers."""
+    start, end = doc.metadata.get("page_start"), doc.metadata.get("page_end")
+    if start is not None:
+        return set(range(int(start), int(end if end is not None else start) + 1))
+    return {int(page) for page in PAGE_MARKER_RE.findall(doc.page_content)}
+
+
+def _overlaps(words, pages, kept, overlap_threshold):
+    """True if most of a chunk's words already appear in a kept chunk of the same source/page."""
+    if not words:
+        return True
+    for kept_words, kept_pages in kept:
+        if pages and kept_pages and not (pages & kept_pages):
+            continue
+        if len(words & kept_words) / len(words) >= overlap_threshold:
+            return True
+    return False
+
+
+def pack_context(docs, token_budget, chunk_token_cap, overlap_threshold, min_tail_tokens):
+    """
+    Builds the prompt context from reranked chunks within `token_budget` (approx. tokens).
+
+    Chunks are taken in rerank-score order. A chunk is skipped when at least
+    `overlap_threshold` of its words are already covered by a chunk kept from the same
+    source and page. Each chunk is capped at `chunk_token_cap`, and the chunk that crosses
+    the budget is trimmed to fit (or dropped if less than `min_tail_tokens` would remain).
+
+    Returns (context, stats) where stats holds the budget, packed token count and how many
+    chunks were kept, deduplicated, trimmed or dropped.
+    """
+    ranked = sorted(
+        docs,
+        key=lambda doc: doc.metadata.get("rerank_score", doc.metadata.get("retrieval_score", 0.0)),
+        reverse=True,
+    )
+    stats = {"budget": token_budget, "tokens": 0, "kept": 0, "deduplicated": 0, "trimmed": 0, "dropped": 0}
+    kept_by_source = {}
+    blocks = []
+
+    for doc in ranked:
+        source = doc.metadata.get("source", "Unknown")
+        words = set(_WORD_RE.findall(doc.page_content.lower()))
+        pages = _pages_of(doc)
+        kept = kept_by_source.setdefault(source, [])
+        if _overlaps(words, pages, kept, overlap_threshold):
+            stats["deduplicated"] += 1
+            continue
+
+        header = f"[{len(blocks) + 1}] Source: {source}"
+        if pages:
+            header += f" (p. {min(pages)})" if len(pages) == 1 else f" (pp. {min(pages)}-{max(pages)})"
+        remaining = token_budget - stats["tokens"] - estimate_tokens(header) - 1
+        if remaining < min_tail_tokens:
+            stats["dropped"] += 1
+            continue
+
+        text = doc.page_content.strip()
+        limit = min(chunk_token_cap, remaining)
+        if estimate_tokens(text) > limit:
+            text = truncate_to_tokens(text, limit - 1)  # room for the " ..." marker
+            stats["trimmed"] += 1
+
+        block = f"{header}\n{text}"
+        blocks.append(block)
+        kept.append((words, pages))
+        stats["tokens"] += estimate_tokens(block) + 1
+        stats["kept"] += 1
+
+    return "\n\n".join(blocks), stats
@@ -4,12 +4,17 @@ import logging
 import torch
 import shutil
 import time
+import threading
+import json
+import atexit
+from collections import OrderedDict
+import asyncio
+import weakref
 import google.generativeai as genai
+import chromadb
 from typing import List
 
 # LlamaIndex imports
-from llama_index.core.node_parser import SemanticSplitterNodeParser
-from llama_index.core.schema import Document as LlamaIndexDocument
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
 # LangChain imports
@@ -19,19 +24,36 @@ from langchain_core.embeddings import Embeddings # Import the base class for emb
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableParallel
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableParallel, RunnableGenerator
 from langchain_core.output_parsers import StrOutputParser
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.docstore.document import Document
-from sentence_transformers import CrossEncoder
 
-from config import CHATS_DIR, CHROMA_DB_DIRECTORY, GEMINI_API_KEY
+from config import (
+    CHATS_DIR, CHROMA_DB_DIRECTORY, GEMINI_API_KEY, INGEST_EXTRACT_WORKERS, EMBEDDING_MODEL_NAME,
+    LLM_MAX_CONCURRENCY, ANSWER_CACHE_ENABLED, QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_PATH,
+    CHAT_HISTORY_TOKEN_BUDGET, QUERY_CONDENSATION_ENABLED, QUERY_CONDENSATION_MODEL,
+    CONTEXT_TOKEN_BUDGET, CONTEXT_CHUNK_TOKEN_CAP, CONTEXT_DEDUPE_OVERLAP, CONTEXT_MIN_TAIL_TOKENS,
+    HYBRID_SEARCH_ENABLED, INGEST_CHECKPOINTS_ENABLED,
+)
 from utils.extraction import get_extracted_text
+from utils.model_registry import get_embedding_handle
+from utils.reranking import rerank_documents_with_scores, arerank_documents_with_scores
+from utils.retrieval import retrieve_candidates, aretrieve_candidates, chunk_ids_of
+from utils.answer_cache import answer_cache, history_key_of
+from utils.lexical_index import get_lexical_index, backfill_lexical_index
+from utils.ingestion import run_ingestion_pipeline, assign_chunk_ids, write_chunks
+from utils.ingestion_checkpoint import IngestionCheckpoints
+from utils.chroma_lock import chroma_write_lock, reopen_chroma_client
+from utils.chunking import SemanticChunker, page_ranges
+from utils.extraction_cache import file_sha256
+from utils.prompt_budget import format_chat_history, pack_context, estimate_tokens
+from utils.telemetry import span, record, bind_labels, configure_metrics
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-reranker = CrossEncoder('BAAI/bge-reranker-large', device=device)
-print("Reranker device:", reranker.model.device)
+# Export per-stage timings through the sink selected in config (no-op if METRICS_SINK is None)
+configure_metrics()
 
 # --- Wrapper Class for Compatibility ---
 class LlamaIndexEmbeddingWrapper(Embeddings):
@@ -39,8 +61,21 @@ class LlamaIndexEmbeddingWrapper(Embeddings):
     A wrapper to make a LlamaIndex embedding model compatible with LangChain's Chroma.
     This class implements the 'embed_documents' and 'embed_query' methods that Chroma expects.
     """
-    def __init__(self, llama_index_embed_model: HuggingFaceEmbedding):
+    def __init__(self, llama_index_embed_model: HuggingFaceEmbedding, lock=None,
+                 query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE, query_cache_path: str = None):
         self.llama_index_embed_model = llama_index_embed_model
+        # The model is shared process-wide, so concurrent sessions serialize on its lock.
+        self.lock = lock or threading.RLock()
+
+        # LRU memo of query string -> embedding; retries and reruns repeat the same queries.
+        self.query_cache_size = query_cache_size
+        self.query_cache_path = query_cache_path
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+        if query_cache_path:
+            self._load_query_cache()
+            atexit.register(self.save_query_cache)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
@@ -48,41 +83,147 @@ class LlamaIndexEmbeddingWrapper(Embeddings):
         """
         # Note: We use get_text_embedding_batch here.
         # It's a more efficient method for batch embedding.
-        return self.llama_index_embed_model.get_text_embedding_batch(texts, show_progress=False)
+        with self.lock:
+            return self.llama_index_embed_model.get_text_embedding_batch(texts, show_progress=False)
 
     def embed_query(self, text: str) -> List[float]:
         """
         Embeds a single query using the underlying LlamaIndex model.
+        Identical query strings are served from the LRU cache without a forward pass.
         """
-        return self.llama_index_embed_model.get_text_embedding(text)
+        with self._query_cache_lock:
+            cached = self._query_cache.get(text)
+            if cached is not None:
+                self._query_cache.move_to_end(text)
+                self.query_cache_stats["hits"] += 1
+                return list(cached)
+            self.query_cache_stats["misses"] += 1
+
+        with self.lock:
+            embedding = self.llama_index_embed_model.get_text_embedding(text)
+
+        with self._query_cache_lock:
+            self._query_cache[text] = tuple(embedding)
+            self._query_cache.move_to_end(text)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+                self.query_cache_stats["evictions"] += 1
+        return list(embedding)
+
+    def clear_query_cache(self):
+        """Drops every memoized query embedding (e.g. so benchmarks time real forward passes)."""
+        with self._query_cache_lock:
+            self._query_cache.clear()
+
+    def query_cache_info(self):
+        with self._query_cache_lock:
+            return {**self.query_cache_stats, "size": len(self._query_cache), "max_size": self.query_cache_size}
+
+    def _load_query_cache(self):
+        try:
+            with open(self.query_cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable query embedding cache '{self.query_cache_path}': {e}")
+            return
+        if data.get("model") != getattr(self.llama_index_embed_model, "model_name", None):
+            # Embeddings from another model are useless (and wrong-sized) for this one
+            return
+        for text, embedding in data.get("entries", [])[-self.query_cache_size:]:
+            self._query_cache[text] = tuple(embedding)
+        logging.info(f"Loaded {len(self._query_cache)} cached query embeddings.")
+
+    def save_query_cache(self):
+        """Writes the query cache to `query_cache_path` (no-op when persistence is off)."""
+        if not self.query_cache_path:
+            return
+        with self._query_cache_lock:
+            entries = [[text, list(embedding)] for text, embedding in self._query_cache.items()]
+        os.makedirs(os.path.dirname(self.query_cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.query_cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": getattr(self.llama_index_embed_model, "model_name", None), "entries": entries}, f)
+        os.replace(tmp_path, self.query_cache_path)
+
+_embeddings_wrapper = None
+_embeddings_wrapper_lock = threading.Lock()
+
+def get_embeddings_model():
+    """Returns the process-wide LangChain-compatible wrapper around the shared BGE model."""
+    global _embeddings_wrapper
+    if _embeddings_wrapper is None:
+        with _embeddings_wrapper_lock:
+            if _embeddings_wrapper is None:
+                handle = get_embedding_handle()
+                _embeddings_wrapper = LlamaIndexEmbeddingWrapper(
+                    handle.model, lock=handle.lock, query_cache_path=QUERY_EMBEDDING_CACHE_PATH
+                )
+    return _embeddings_wrapper
 
 # --- Helper Functions ---
-def format_docs_with_metadata(docs):
-    """Formats documents with their source metadata clearly marked."""
-    return "\n\n".join([
-        f"--- DOCUMENT START ---\nSource: {doc.metadata.get('source', 'Unknown')}\nText: {doc.page_content}\n--- DOCUMENT END ---"
-        for doc in docs
-    ])
-
-def rerank_documents_with_scores(query, docs, score_threshold=0):
-    pairs = [(query, doc.page_content) for doc in docs]
-    scores = reranker.predict(pairs)
-    ranked_results = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
-
-    logging.info("--- RETRIEVED CHUNKS FOR DEBUGGING (Reranked) ---")
-    for i, (doc, score) in enumerate(ranked_results):
-        logging.info(f"Chunk {i+1}: Score={score:.4f} Content='{doc.page_content[:150]}...'")
-    logging.info("-------------------------------------")
-
-    # Filter low-confidence docs
-    filtered = [(doc, score) for doc, score in ranked_results if score >= score_threshold]
+def pack_prompt_context(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Packs reranked documents into a source-labelled context within the token budget.
+    Returns (context, stats)."""
+    return pack_context(
+        docs,
+        token_budget=token_budget,
+        chunk_token_cap=CONTEXT_CHUNK_TOKEN_CAP,
+        overlap_threshold=CONTEXT_DEDUPE_OVERLAP,
+        min_tail_tokens=CONTEXT_MIN_TAIL_TOKENS,
+    )
 
-    final_chunks = [doc for doc, score in filtered[:7]]
-    return final_chunks
+def format_docs_with_metadata(docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Formats documents with their source metadata clearly marked, within the token budget."""
+    context, _ = pack_prompt_context(docs, token_budget=token_budget)
+    return context
+
+# --- Concurrency Limits ---
+# Shared by every chain in the process: a cap on concurrent Gemini calls for the sync
+# (Streamlit thread) path and one asyncio semaphore per event loop for the async path.
+# The CPU-bound reranker runs on the rerank service's own thread (utils/reranker_service.py).
+_llm_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_llm_semaphores = weakref.WeakKeyDictionary()
+
+def _get_async_llm_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _async_llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        _async_llm_semaphores[loop] = semaphore
+    return semaphore
 
 # --- RAG Chain Setup ---
-def get_rag_chain(vectorstore):
-    llm = ChatGoogleGenerativeAI(
+# Chat model used in place of Gemini by chains built afterwards (e.g. a local fake model
+# for offline benchmarks); None means Gemini.
+_chat_llm_override = None
+
+def use_chat_llm(llm):
+    """Sets the chat model for chains built from now on and drops cached org chains."""
+    global _chat_llm_override
+    _chat_llm_override = llm
+    invalidate_org_rag_chain()
+
+def collect_sources(x):
+    """Unique source names behind an answer (from the answer cache on a hit)."""
+    if x.get("cached"):
+        return x["cached"]["sources"]
+    return list(set(doc.metadata.get("source", "Unknown") for doc in x["reranked_docs"]))
+
+def get_rag_chain(vectorstore, org_name=None):
+    """
+    Builds the RAG chain over a vectorstore. `org_name` scopes the answer cache and the
+    lexical index; chains without one (e.g. per-user stores) use dense retrieval only.
+    """
+    use_answer_cache = ANSWER_CACHE_ENABLED and org_name is not None
+    # Org stores keep a BM25 index next to their Chroma data for hybrid retrieval
+    lexical_index = get_lexical_index(org_name) if HYBRID_SEARCH_ENABLED and org_name else None
+    # Stage metrics are labelled per org; per-user stores share one label
+    metrics_org = org_name or "user"
+    embeddings_model = vectorstore.embeddings
+
+    llm = _chat_llm_override or ChatGoogleGenerativeAI(
         model="gemini-2.0-flash",
         temperature=0.1,
         google_api_key=GEMINI_API_KEY
@@ -112,144 +253,529 @@ def get_rag_chain(vectorstore):
     """
     custom_rag_prompt = PromptTemplate.from_template(template)
 
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 20})
+    condense_prompt = PromptTemplate.from_template(
+        "Rewrite the follow-up question as a standalone question, using the chat history only "
+        "to resolve references. Return only the question.\n\n"
+        "Chat History:\n{chat_history}\n\nFollow-up question: {question}\nStandalone question:"
+    )
+    condense_llm = None
+    if QUERY_CONDENSATION_ENABLED:
+        condense_llm = ChatGoogleGenerativeAI(model=QUERY_CONDENSATION_MODEL, temperature=0, google_api_key=GEMINI_API_KEY)
 
-    # Step 1: String ko dict me todna
-    def parse_input(x: str):
-        try:
-            # assume format: "question, history"
-            q, h = x.split(",", 1)
-            return {"query": q.strip(), "chat_history": h.strip()}
-        except:
-            return {"query": x, "chat_history": ""}
-    
-    preprocessor = RunnableLambda(parse_input)
+    # Step 1: Structured input -> query + token-budgeted history
+    def parse_input(x):
+        """
+        Accepts {"query": str, "history": [{"role", "content"}, ...] or str, "filters": dict}.
+        A plain string is treated as the whole query (no history, no filters).
+        `filters` scopes retrieval, e.g. {"sources": ["handbook.pdf"]} (see utils/retrieval.build_where).
+        """
+        with span("parse_input", org=metrics_org):
+            if isinstance(x, str):
+                x = {"query": x}
+            history = x.get("history") or []
+            if isinstance(history, str):
+                chat_history = history
+            else:
+                chat_history = format_chat_history(history, CHAT_HISTORY_TOKEN_BUDGET)
+            query = x["query"].strip()
+        return {"query": query, "retrieval_query": query, "chat_history": chat_history, "filters": x.get("filters")}
+
+    def condense_query(x):
+        if condense_llm is None or not x["chat_history"]:
+            return x
+        prompt = condense_prompt.invoke({"chat_history": x["chat_history"], "question": x["query"]})
+        with _llm_semaphore, span("condense_query", org=metrics_org):
+            standalone = condense_llm.invoke(prompt).content.strip()
+        return {**x, "retrieval_query": standalone or x["query"]}
+
+    async def acondense_query(x):
+        if condense_llm is None or not x["chat_history"]:
+            return x
+        prompt = await condense_prompt.ainvoke({"chat_history": x["chat_history"], "question": x["query"]})
+        async with _get_async_llm_semaphore():
+            with span("condense_query", org=metrics_org):
+                standalone = (await condense_llm.ainvoke(prompt)).content.strip()
+        return {**x, "retrieval_query": standalone or x["query"]}
+
+    preprocessor = RunnableLambda(parse_input) | RunnableLambda(condense_query, afunc=acondense_query)
+
+    # Step 2: Retrieval, answer-cache lookup and reranking (on the standalone query only)
+    def check_answer_cache(docs, query_embedding, chat_history):
+        if not use_answer_cache:
+            return None, None
+        chunk_ids = chunk_ids_of(docs)
+        # The (trimmed) history is part of the prompt, so it is part of the key too
+        history_key = history_key_of(chat_history)
+        cached = answer_cache.lookup(org_name, query_embedding, chunk_ids, history_key)
+        return cached, {"query_embedding": query_embedding, "chunk_ids": chunk_ids, "history_key": history_key}
 
-    # Step 2: Answer chain with reranked docs cached
     def process_docs(x):
-        docs = retriever.invoke(x["query"])
-        reranked = rerank_documents_with_scores(x["query"], docs)
+        with bind_labels(org=metrics_org):
+            with span("query_embed"):
+                query_embedding = embeddings_model.embed_query(x["retrieval_query"])
+            with span("vector_search"):
+                docs = retrieve_candidates(vectorstore, x["retrieval_query"], query_embedding=query_embedding,
+                                           lexical_index=lexical_index, filters=x.get("filters"))
+            with span("answer_cache_lookup"):
+                cached, cache_key = check_answer_cache(docs, query_embedding, x["chat_history"])
+            # A cache hit skips reranking and the LLM call entirely
+            with span("rerank"):
+                reranked = [] if cached else rerank_documents_with_scores(x["retrieval_query"], docs)
         return {
             "reranked_docs": reranked,
             "query": x["query"],
             "chat_history": x["chat_history"],
+            "cached": cached,
+            "cache_key": cache_key,
         }
 
-    doc_processor = RunnableLambda(process_docs)
+    async def aprocess_docs(x):
+        with bind_labels(org=metrics_org):
+            with span("query_embed"):
+                query_embedding = await asyncio.to_thread(embeddings_model.embed_query, x["retrieval_query"])
+            with span("vector_search"):
+                docs = await aretrieve_candidates(vectorstore, x["retrieval_query"], query_embedding=query_embedding,
+                                                  lexical_index=lexical_index, filters=x.get("filters"))
+            with span("answer_cache_lookup"):
+                cached, cache_key = check_answer_cache(docs, query_embedding, x["chat_history"])
+            with span("rerank"):
+                reranked = [] if cached else await arerank_documents_with_scores(x["retrieval_query"], docs)
+        return {
+            "reranked_docs": reranked,
+            "query": x["query"],
+            "chat_history": x["chat_history"],
+            "cached": cached,
+            "cache_key": cache_key,
+        }
 
-    answer_chain = (
-        {
-            "context": RunnableLambda(lambda x: format_docs_with_metadata(x["reranked_docs"])),
-            "question": RunnableLambda(lambda x: x["query"]),
-            "chat_history": RunnableLambda(lambda x: x["chat_history"]),
+    doc_processor = RunnableLambda(process_docs, afunc=aprocess_docs)
+
+    # Step 3: Gemini call, gated by the process-wide concurrency limits
+    def prompt_variables(x):
+        context, stats = pack_prompt_context(x["reranked_docs"])
+        history_tokens = estimate_tokens(x["chat_history"])
+        logging.info(
+            f"Prompt context: {stats['tokens']}/{stats['budget']} tokens from {stats['kept']} chunks "
+            f"(deduplicated={stats['deduplicated']} trimmed={stats['trimmed']} dropped={stats['dropped']}), "
+            f"history {history_tokens} tokens"
+        )
+        return {
+            "context": context,
+            "question": x["query"],
+            "chat_history": x["chat_history"],
         }
-        | custom_rag_prompt
-        | llm
-        | StrOutputParser()
-    )
+
+    def store_answer(x, answer_text):
+        if x.get("cache_key") and answer_text.strip():
+            answer_cache.store(org_name, x["cache_key"]["query_embedding"], x["cache_key"]["chunk_ids"],
+                               answer_text, collect_sources(x), x["cache_key"]["history_key"])
+
+    def generate_answer(inputs):
+        for x in inputs:
+            if x.get("cached"):
+                yield x["cached"]["answer"]
+                continue
+            with span("prompt_build", org=metrics_org):
+                prompt = custom_rag_prompt.invoke(prompt_variables(x))
+            answer_parts = []
+            with _llm_semaphore:
+                start = time.perf_counter()
+                for chunk in llm.stream(prompt):
+                    if not answer_parts:
+                        record("llm_first_token", time.perf_counter() - start, org=metrics_org)
+                    answer_parts.append(chunk.content if isinstance(chunk.content, str) else "")
+                    yield chunk
+                record("llm_completion", time.perf_counter() - start, org=metrics_org)
+            store_answer(x, "".join(answer_parts))
+
+    async def agenerate_answer(inputs):
+        async for x in inputs:
+            if x.get("cached"):
+                yield x["cached"]["answer"]
+                continue
+            with span("prompt_build", org=metrics_org):
+                prompt = await custom_rag_prompt.ainvoke(prompt_variables(x))
+            answer_parts = []
+            async with _get_async_llm_semaphore():
+                start = time.perf_counter()
+                async for chunk in llm.astream(prompt):
+                    if not answer_parts:
+                        record("llm_first_token", time.perf_counter() - start, org=metrics_org)
+                    answer_parts.append(chunk.content if isinstance(chunk.content, str) else "")
+                    yield chunk
+                record("llm_completion", time.perf_counter() - start, org=metrics_org)
+            store_answer(x, "".join(answer_parts))
+
+    answer_chain = RunnableGenerator(generate_answer, agenerate_answer) | StrOutputParser()
 
     rag_chain = (
         preprocessor
         | doc_processor
         | {
             "answer": answer_chain,
-            "sources": RunnableLambda(lambda x: list(set(doc.metadata.get("source", "Unknown") for doc in x["reranked_docs"])))
+            "sources": RunnableLambda(collect_sources)
         }
     )
     return rag_chain
 
+class _ChainEventSplitter:
+    """
+    Turns a RAG chain's streamed chunks into events: ("sources", [names]) exactly once, then
+    ("answer", token) for each answer token. Shared by the sync and async streamers.
+    """
+    def __init__(self):
+        self.sources = None
+        self.pending_tokens = []
+
+    def events(self, chunk):
+        """Events for one streamed chunk; answer tokens that arrive before the sources are held back."""
+        events = []
+        if self.sources is None and "sources" in chunk:
+            self.sources = chunk["sources"]
+            events.append(("sources", self.sources))
+            events.extend(("answer", token) for token in self.pending_tokens)
+            self.pending_tokens = []
+        if "answer" in chunk:
+            if self.sources is None:
+                self.pending_tokens.append(chunk["answer"])
+            else:
+                events.append(("answer", chunk["answer"]))
+        return events
+
+    def finish(self):
+        """Events left once the stream ended (a chain that produced no sources still reports [])."""
+        if self.sources is not None:
+            return []
+        self.sources = []
+        return [("sources", [])] + [("answer", token) for token in self.pending_tokens]
+
+def stream_rag_chain(rag_chain, chain_input):
+    """
+    Streams a RAG chain's response as events: ("sources", [names]) exactly once, then
+    ("answer", token) for each answer token as Gemini produces it.
+
+    The chain's final RunnableParallel already streams each branch as it completes; this
+    only guarantees the order, holding back any answer tokens that arrive before the sources.
+    """
+    splitter = _ChainEventSplitter()
+    for chunk in rag_chain.stream(chain_input):
+        yield from splitter.events(chunk)
+    yield from splitter.finish()
+
+async def astream_rag_chain(rag_chain, chain_input):
+    """Async counterpart of stream_rag_chain, built on the chain's astream()."""
+    splitter = _ChainEventSplitter()
+    async for chunk in rag_chain.astream(chain_input):
+        for event in splitter.events(chunk):
+            yield event
+    for event in splitter.finish():
+        yield event
+
 # --- Incremental Update for Admins ---
-def update_rag_pipeline(pdf_paths_to_add: List[str], org_name: str):
+def build_chunk_documents(chunker, extracted_text, pdf_path):
+    """
+    Semantic-splits one document's text into (LangChain Document, embedding) pairs.
+    Each chunk's metadata records its source file name, a document ID (SHA-256 of the
+    PDF bytes), the upload time and, when the text has page markers, its page range.
+    """
+    base_metadata = {
+        "source": os.path.basename(pdf_path),
+        "document_id": file_sha256(pdf_path),
+        "ingested_at": int(time.time()),
+    }
+    split = chunker.split_text(extracted_text)
+    chunks = []
+    for (chunk_text, chunk_vector), (page_start, page_end) in zip(split, page_ranges([text for text, _ in split])):
+        metadata = dict(base_metadata)
+        # Chroma metadata can't hold None, so chunks without page markers just omit the range
+        if page_start is not None:
+            metadata["page_start"] = page_start
+            metadata["page_end"] = page_end
+        chunks.append((LangChainDocument(page_content=chunk_text, metadata=metadata), chunk_vector))
+    return chunks
+
+def update_rag_pipeline(pdf_paths_to_add: List[str], org_name: str, extract_workers: int = INGEST_EXTRACT_WORKERS,
+                        replace_existing: bool = True, progress_callback=None):
     """
     Updates an existing RAG pipeline with new documents.
-    The documents are chunked using the semantic splitter.
+    The documents are chunked using the semantic chunker and written to the vector store
+    in batches by the staged ingestion pipeline (see utils/ingestion.py). Progress is
+    checkpointed per document, so calling this again with the same files after a failure
+    resumes instead of starting over.
 
     Args:
         pdf_paths_to_add: A list of file paths to the new PDF documents.
         org_name: The organization name to get the existing vector store.
+        extract_workers: Number of processes used for text extraction (1 = in-process).
+        replace_existing: Replace the chunks of documents that are already in the store
+            (matched by file name) instead of only upserting the new chunks.
+        progress_callback: Optional callable receiving the ingestion progress events
+            (see run_ingestion_pipeline). It may raise to abort the update.
 
     Returns:
         The updated RAG chain.
     """
     print("Updating RAG pipeline with new documents...")
     
-    # Get the existing vector store
-    vectorstore = get_or_create_vectorstore(org_name)
-    
-    # Use the LlamaIndex version of the embedding model
-    llama_embeddings_model = HuggingFaceEmbedding(model_name="BAAI/bge-base-en-v1.5")
+    # Get the existing vector store (shared with the org's cached chain)
+    vectorstore = get_org_vectorstore(org_name)
     
-    # Initialize the SemanticSplitterNodeParser
-    splitter = SemanticSplitterNodeParser(
-        buffer_size=2,
-        breakpoint_percentile_threshold=95,
-        embed_model=llama_embeddings_model,  # The splitter expects the original LlamaIndex model
-    )
-
-    new_docs = []
-    for pdf_path in pdf_paths_to_add:
-        extracted_text = get_extracted_text([pdf_path], org_name)
-        
-        if not extracted_text.strip():
-            print(f"Skipping empty document: {os.path.basename(pdf_path)}")
-            continue
-
-        # Create a LlamaIndex Document object
-        llama_index_doc = LlamaIndexDocument(text=extracted_text, metadata={"source": os.path.basename(pdf_path)})
-        
-        # Use the semantic splitter to get nodes (chunks).
-        nodes = splitter.get_nodes_from_documents([llama_index_doc])
-        
-        # Convert LlamaIndex Nodes to LangChain Documents
-        for node in nodes:
-            lc_doc = LangChainDocument(
-                page_content=node.get_content(),
-                metadata=node.metadata
+    # Semantic chunker on the shared LlamaIndex embedding model; it also returns
+    # chunk embeddings, so chunks are not embedded a second time before the write
+    chunker = SemanticChunker(get_embedding_handle())
+
+    def chunk_document(extracted_text, pdf_path):
+        return build_chunk_documents(chunker, extracted_text, pdf_path)
+
+    chunks_written = []
+
+    def on_progress(event):
+        if event["event"] == "chunks_written":
+            chunks_written.append(event["count"])
+        if progress_callback is not None:
+            progress_callback(event)
+
+    try:
+        with bind_labels(org=org_name):
+            stats = run_ingestion_pipeline(
+                pdf_paths_to_add,
+                org_name,
+                vectorstore,
+                chunk_document,
+                embeddings_model=get_embeddings_model(),
+                extract_workers=extract_workers,
+                replace_existing=replace_existing,
+                lexical_index=get_lexical_index(org_name) if HYBRID_SEARCH_ENABLED else None,
+                progress_callback=on_progress,
+                checkpoints=IngestionCheckpoints(org_name) if INGEST_CHECKPOINTS_ENABLED else None,
+                write_lock=lambda: chroma_write_lock(org_name),
             )
-            new_docs.append(lc_doc)
-            
-        print(f"Prepared chunks from '{os.path.basename(pdf_path)}'.")
-
-    # Add new documents to the existing vector store.
-    # The embedding model is not needed here as it was passed during initialization.
-    if new_docs:
-        vectorstore.add_documents(new_docs)
-        print(f"Added {len(new_docs)} new chunks to the vector store.")
+    except BaseException:
+        # Batches written before the failure (or cancellation) are live; let chains see them
+        if chunks_written:
+            bump_kb_version(org_name)
+        raise
+
+    if stats["chunks"] or stats["replaced"]:
+        print(f"Added {stats['chunks']} new chunks to the vector store.")
+        # Invalidate cached chains for this org so they pick up the new documents
+        bump_kb_version(org_name)
     else:
         print("No new documents to add.")
     
     print("Vector store updated with new documents.")
     
-    # Rebuild and return the RAG chain
-    return get_rag_chain(vectorstore)
+    return get_org_rag_chain(org_name)
+
+# LangChain's default collection name; existing org stores were created under it.
+ORG_COLLECTION_NAME = "langchain"
+DUMMY_PURGE_MARKER_FILENAME = ".dummy_vectors_purged"
+
+def _get_existing_collection(client, collection_name):
+    """Returns the named collection, or None if it doesn't exist (error type varies by Chroma version)."""
+    try:
+        return client.get_collection(collection_name)
+    except Exception:
+        return None
+
+def purge_dummy_vectors(vectorstore, chroma_dir, page_size=1000):
+    """
+    One-shot migration: deletes the empty-text placeholder vectors that older versions
+    inserted when creating a store. A marker file records that the org store is clean.
+    """
+    marker_path = os.path.join(chroma_dir, DUMMY_PURGE_MARKER_FILENAME)
+    if os.path.exists(marker_path):
+        return 0
+
+    collection = vectorstore._collection
+    dummy_ids = []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        dummy_ids.extend(
+            chunk_id for chunk_id, text in zip(page["ids"], page["documents"])
+            if not (text or "").strip()
+        )
+        offset += len(page["ids"])
+
+    if dummy_ids:
+        collection.delete(ids=dummy_ids)
+        logging.info(f"Purged {len(dummy_ids)} placeholder vectors from '{chroma_dir}'.")
+
+    with open(marker_path, "w", encoding="utf-8") as f:
+        f.write(f"{len(dummy_ids)}\n")
+    return len(dummy_ids)
 
 def get_or_create_vectorstore(org_name):
     """
     Retrieves or creates a shared ChromaDB vector store for an organization.
+    New collections are created empty; nothing is embedded until documents are added.
+    Apart from creating the collection and its one-shot migrations (both under the org's
+    Chroma write lock), the app only reads the store; ingestion workers do the writing.
     """
     chroma_dir = os.path.join(CHROMA_DB_DIRECTORY, org_name)
     os.makedirs(chroma_dir, exist_ok=True)
     
-    # Use the LlamaIndex version of the embedding model for compatibility
-    llama_embeddings_model = HuggingFaceEmbedding(model_name="BAAI/bge-base-en-v1.5")
-    
-    # Use the new wrapper class to make it compatible with LangChain's Chroma API
-    embeddings_model = LlamaIndexEmbeddingWrapper(llama_embeddings_model)
+    # Shared wrapper around the registry's embedding model, loaded once per process
+    embeddings_model = get_embeddings_model()
     
-    # Check if a vector store already exists
-    if len(os.listdir(chroma_dir)) > 0 and 'index' in os.listdir(chroma_dir):
+    with chroma_write_lock(org_name):
+        return _open_org_collection(chroma_dir, org_name, embeddings_model)
+
+def _open_org_collection(chroma_dir, org_name, embeddings_model):
+    """Opens (or creates) the org's collection; the caller holds the org's Chroma write lock."""
+    # Ask Chroma itself whether the collection exists instead of guessing from the on-disk layout
+    client = chromadb.PersistentClient(path=chroma_dir)
+    collection = _get_existing_collection(client, ORG_COLLECTION_NAME)
+
+    if collection is not None:
         print("Loading existing ChromaDB vector store.")
-        # Pass the wrapped embeddings model to the Chroma constructor
-        vectorstore = Chroma(persist_directory=chroma_dir, embedding_function=embeddings_model)
+        metadata = collection.metadata or {}
+        stored_model = metadata.get("embedding_model")
+        if stored_model and stored_model != EMBEDDING_MODEL_NAME:
+            logging.warning(
+                f"Vector store for '{org_name}' was built with '{stored_model}' but queries use "
+                f"'{EMBEDDING_MODEL_NAME}'; retrieval quality will suffer until it is re-ingested."
+            )
+        elif not stored_model:
+            # Stores created before the metadata existed: record the model they were built with.
+            collection.modify(metadata={**metadata, "embedding_model": EMBEDDING_MODEL_NAME})
+        vectorstore = Chroma(client=client, collection_name=ORG_COLLECTION_NAME, embedding_function=embeddings_model)
+        purge_dummy_vectors(vectorstore, chroma_dir)
     else:
         print("Creating a new ChromaDB vector store.")
-        # A dummy document is used for initialization
-        dummy_doc = [""]
-        # Pass the wrapped embeddings model to from_texts
-        vectorstore = Chroma.from_texts(texts=dummy_doc, embedding=embeddings_model, persist_directory=chroma_dir)
+        vectorstore = Chroma(
+            client=client,
+            collection_name=ORG_COLLECTION_NAME,
+            embedding_function=embeddings_model,
+            collection_metadata={"embedding_model": EMBEDDING_MODEL_NAME},
+        )
+        # Nothing to migrate in a fresh store
+        with open(os.path.join(chroma_dir, DUMMY_PURGE_MARKER_FILENAME), "w", encoding="utf-8") as f:
+            f.write("0\n")
         
     return vectorstore
 
+# --- Per-Organization Chain Cache ---
+# Chains are stateless (chat history arrives with each input), so every session of an
+# org can share one warm vectorstore + chain. The KB version lives on disk next to the
+# org's Chroma data so that any process writing to the KB can invalidate the cache.
+KB_VERSION_FILENAME = ".kb_version"
+
+_org_chain_cache = {}
+_org_chain_cache_lock = threading.Lock()
+_org_build_locks = {}
+# KB versions this process wrote itself; any other version change came from another
+# process (e.g. an ingestion worker), whose writes this process's Chroma client can't see.
+_local_kb_versions = {}
+
+def _kb_version_path(org_name):
+    return os.path.join(CHROMA_DB_DIRECTORY, org_name, KB_VERSION_FILENAME)
+
+def get_kb_version(org_name):
+    """Returns the current knowledge-base version of an organization (0 if never updated)."""
+    try:
+        with open(_kb_version_path(org_name), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def bump_kb_version(org_name):
+    """Marks the org's knowledge base as changed so cached chains are rebuilt on next use."""
+    version_path = _kb_version_path(org_name)
+    os.makedirs(os.path.dirname(version_path), exist_ok=True)
+    with _org_chain_cache_lock:
+        new_version = get_kb_version(org_name) + 1
+        tmp_path = f"{version_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(new_version))
+        os.replace(tmp_path, version_path)
+        _local_kb_versions[org_name] = new_version
+    # Cached answers would also miss via their chunk IDs; dropping them frees the memory now
+    answer_cache.invalidate(org_name)
+    logging.info(f"Knowledge base for '{org_name}' is now at version {new_version}.")
+    return new_version
+
+def _get_org_cache_entry(org_name):
+    version = get_kb_version(org_name)
+    entry = _org_chain_cache.get(org_name)
+    if entry and entry["kb_version"] == version:
+        return entry
+
+    with _org_chain_cache_lock:
+        build_lock = _org_build_locks.setdefault(org_name, threading.Lock())
+
+    # Concurrent sessions of the same org wait for a single build instead of each building one.
+    with build_lock:
+        entry = _org_chain_cache.get(org_name)
+        if entry and entry["kb_version"] == version:
+            return entry
+
+        start_time = time.perf_counter()
+        # Reuse the vectorstore across versions this process wrote; only the chain depends on KB contents.
+        if entry and _local_kb_versions.get(org_name) == version:
+            vectorstore = entry["vectorstore"]
+        else:
+            if entry:
+                # Another process changed the KB; reopen the store to see its writes
+                reopen_chroma_client(os.path.join(CHROMA_DB_DIRECTORY, org_name))
+            vectorstore = get_or_create_vectorstore(org_name)
+            if HYBRID_SEARCH_ENABLED:
+                lexical_index = get_lexical_index(org_name)
+                # Stores ingested before the lexical index existed are indexed once here
+                if lexical_index.count() == 0 and vectorstore._collection.count() > 0:
+                    backfill_lexical_index(lexical_index, vectorstore)
+        entry = {
+            "kb_version": version,
+            "vectorstore": vectorstore,
+            "rag_chain": get_rag_chain(vectorstore, org_name=org_name),
+        }
+        _org_chain_cache[org_name] = entry
+        logging.info(f"Built RAG chain for '{org_name}' (KB version {version}) in {time.perf_counter() - start_time:.2f}s.")
+        return entry
+
+def get_org_vectorstore(org_name):
+    """Returns the cached vectorstore of an organization, creating it on first use."""
+    return _get_org_cache_entry(org_name)["vectorstore"]
+
+def get_org_rag_chain(org_name):
+    """Returns the cached RAG chain of an organization, rebuilding it if the KB version changed."""
+    return _get_org_cache_entry(org_name)["rag_chain"]
+
+def get_org_documents(org_name, page_size=1000):
+    """
+    Lists the documents in an org's knowledge base as [{"source", "document_id"}], sorted
+    by file name. Computed once per KB version and cached with the org's chain.
+    """
+    entry = _get_org_cache_entry(org_name)
+    if "documents" not in entry:
+        collection = entry["vectorstore"]._collection
+        documents = {}
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            for metadata in page["metadatas"]:
+                metadata = metadata or {}
+                if metadata.get("source"):
+                    documents.setdefault(metadata["source"], metadata.get("document_id"))
+            offset += len(page["ids"])
+        entry["documents"] = [
+            {"source": source, "document_id": document_id} for source, document_id in sorted(documents.items())
+        ]
+    return entry["documents"]
+
+def invalidate_org_rag_chain(org_name=None):
+    """Drops cached chains for one org (or all orgs) from this process."""
+    with _org_chain_cache_lock:
+        if org_name is None:
+            _org_chain_cache.clear()
+        else:
+            _org_chain_cache.pop(org_name, None)
+
 def setup_rag_pipeline(pdf_files: List[str], username: str):
     """
     Sets up a RAG pipeline using a semantic splitter for chunking.
@@ -261,45 +787,36 @@ def setup_rag_pipeline(pdf_files: List[str], username: str):
     Returns:
         A tuple containing the RAG chain and the ChromaDB directory path.
     """
-    logging.info("Building RAG pipeline with Semantic Splitter...")
+    logging.info("Building RAG pipeline with Semantic Chunker...")
 
-    # Use the LlamaIndex version of the embedding model
-    llama_embeddings_model = HuggingFaceEmbedding(model_name="BAAI/bge-base-en-v1.5")
-    
-    # Use the new wrapper class to make it compatible with LangChain's Chroma API
-    embeddings_model = LlamaIndexEmbeddingWrapper(llama_embeddings_model)
-
-    # Initialize the SemanticSplitterNodeParser
-    # The splitter expects the original LlamaIndex model
-    splitter = SemanticSplitterNodeParser(
-        buffer_size=2,
-        breakpoint_percentile_threshold=95,
-        embed_model=llama_embeddings_model,
-    )
+    # Use the shared LlamaIndex embedding model and its LangChain wrapper
+    embeddings_model = get_embeddings_model()
+    chunker = SemanticChunker(get_embedding_handle())
     
     user_chroma_dir = os.path.join(CHROMA_DB_DIRECTORY, username, str(uuid.uuid4()))
     
-    docs = []
+    chunks = []
     
     for pdf_file_path in pdf_files:
         extracted_text = get_extracted_text([pdf_file_path], username)
         
         if extracted_text.strip():
-            llama_index_doc = LlamaIndexDocument(text=extracted_text, metadata={"source": os.path.basename(pdf_file_path)})
-            nodes = splitter.get_nodes_from_documents([llama_index_doc])
-            
-            for node in nodes:
-                lc_doc = LangChainDocument(
-                    page_content=node.get_content(),
-                    metadata=node.metadata
-                )
-                docs.append(lc_doc)
+            chunks.extend(build_chunk_documents(chunker, extracted_text, pdf_file_path))
     
-    if not docs:
+    chunks = assign_chunk_ids(chunks)
+    if not chunks:
         raise ValueError("No text was extracted or chunks were created from the PDFs.")
 
+    docs = [doc for doc, _ in chunks]
+    vectors = [vector for _, vector in chunks]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        for i, vector in zip(missing, embeddings_model.embed_documents([docs[i].page_content for i in missing])):
+            vectors[i] = vector
+
     # Pass the wrapped embeddings model to the Chroma constructor
-    vectorstore = Chroma.from_documents(docs, embeddings_model, persist_directory=user_chroma_dir)
+    vectorstore = Chroma(persist_directory=user_chroma_dir, embedding_function=embeddings_model)
+    write_chunks(vectorstore, docs, vectors)
     logging.info(f"ChromaDB created and persisted to '{user_chroma_dir}'.")
     
     rag_chain = get_rag_chain(vectorstore)
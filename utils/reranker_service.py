@@ -0,0 +1,118 @@
+# utils/reranker_service.py
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+from config import RERANKER_MODEL_NAME, RERANK_MAX_BATCH_SIZE, RERANK_MAX_WAIT_MS
+from utils.model_registry import get_reranker_handle
+
+
+class _RerankRequest:
+    def __init__(self, pairs):
+        self.pairs = pairs
+        self.future = Future()
+
+
+class RerankService:
+    """
+    Micro-batches cross-encoder scoring across concurrent queries.
+
+    Callers submit their (query, passage) pairs and get a Future back. A single worker
+    thread collects requests for up to `max_wait_ms` (or until `max_batch_size` pairs are
+    waiting), scores them in one forward pass and routes each caller's scores back.
+    Under load this turns many small forward passes into a few large ones; with a single
+    user it only adds up to `max_wait_ms` of latency.
+    """
+    def __init__(self, model_name=RERANKER_MODEL_NAME, max_batch_size=RERANK_MAX_BATCH_SIZE, max_wait_ms=RERANK_MAX_WAIT_MS):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "pairs": 0}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rerank-service", daemon=True)
+                    self._thread.start()
+
+    def submit(self, pairs):
+        """Queues pairs for scoring and returns a Future resolving to their scores (same order)."""
+        request = _RerankRequest(list(pairs))
+        if not request.pairs:
+            request.future.set_result([])
+            return request.future
+        self._ensure_started()
+        self._queue.put(request)
+        return request.future
+
+    def score(self, pairs, timeout=None):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(pairs).result(timeout=timeout)
+
+    def _collect_batch(self):
+        requests = [self._queue.get()]
+        pair_count = len(requests[0].pairs)
+        deadline = time.monotonic() + self.max_wait_seconds
+        while pair_count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            pair_count += len(request.pairs)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect_batch()
+            all_pairs = [pair for request in requests for pair in request.pairs]
+            try:
+                # Score in length order so each padded sub-batch holds similar-length passages,
+                # then scatter the scores back to their original positions.
+                order = sorted(range(len(all_pairs)), key=lambda i: len(all_pairs[i][1]))
+                reranker = get_reranker_handle(self.model_name)
+                with reranker.lock:
+                    sorted_scores = reranker.model.predict(
+                        [all_pairs[i] for i in order],
+                        batch_size=self.max_batch_size,
+                        show_progress_bar=False,
+                    )
+                scores = [0.0] * len(all_pairs)
+                for position, i in enumerate(order):
+                    scores[i] = float(sorted_scores[position])
+            except Exception as e:
+                logging.exception("Reranker batch failed.")
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+
+            self.stats["requests"] += len(requests)
+            self.stats["batches"] += 1
+            self.stats["pairs"] += len(all_pairs)
+            offset = 0
+            for request in requests:
+                request.future.set_result(scores[offset:offset + len(request.pairs)])
+                offset += len(request.pairs)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_rerank_service(model_name=RERANKER_MODEL_NAME):
+    """Returns the process-wide rerank service for a cross-encoder model."""
+    service = _services.get(model_name)
+    if service is None:
+        with _services_lock:
+            service = _services.setdefault(model_name, RerankService(model_name))
+    return service
@@ -0,0 +1,160 @@
+# utils/reranking.py
+
+import time
+import random
+import asyncio
+import logging
+
+from config import (
+    RERANKER_MODEL_NAME,
+    RERANK_FINAL_K,
+    RERANK_FIRST_STAGE,
+    RERANK_FIRST_STAGE_MODEL,
+    RERANK_FIRST_STAGE_KEEP,
+    RERANK_EARLY_EXIT_MARGIN,
+    RERANK_AUDIT_RATE,
+)
+from utils.reranker_service import get_rerank_service
+from utils.telemetry import record
+
+
+def _rank_and_filter(docs, scores, score_threshold, final_k):
+    ranked_results = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+
+    # Chunk previews are debug output; per-stage timings are exported by utils/telemetry.py
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("--- RETRIEVED CHUNKS FOR DEBUGGING (Reranked) ---")
+        for i, (doc, score) in enumerate(ranked_results):
+            logging.debug(f"Chunk {i+1}: Score={score:.4f} Content='{doc.page_content[:150]}...'")
+        logging.debug("-------------------------------------")
+
+    # Filter low-confidence docs
+    filtered = [(doc, score) for doc, score in ranked_results if score >= score_threshold]
+
+    for doc, score in filtered:
+        doc.metadata["rerank_score"] = float(score)
+    return [doc for doc, score in filtered[:final_k]]
+
+
+def _log_audit(query, cascade_docs, all_docs, final_k, future):
+    """Compares the cascade's picks with what the large model would pick from every candidate."""
+    try:
+        full_scores = future.result()
+    except Exception as e:
+        logging.warning(f"Rerank audit failed: {e}")
+        return
+    full_top = sorted(zip(all_docs, full_scores), key=lambda x: x[1], reverse=True)[:final_k]
+    full_ids = {id(doc) for doc, _ in full_top}
+    kept_ids = {id(doc) for doc in cascade_docs}
+    recall = len(full_ids & kept_ids) / len(full_ids) if full_ids else 1.0
+    logging.info(f"Rerank audit: cascade recall@{final_k} vs. full rerank = {recall:.2f} for query '{query[:80]}'")
+
+
+def _embedding_similarity(doc):
+    """
+    The query/chunk embedding similarity of a retrieved document, or None if it has none.
+    Hybrid retrieval keeps it in "dense_score" ("retrieval_score" is the fused RRF score
+    there) and lexical-only hits have none; dense-only retrieval stores it as "retrieval_score".
+    """
+    metadata = doc.metadata
+    if "dense_score" in metadata:
+        return metadata["dense_score"]
+    if "lexical_score" in metadata:
+        return None
+    return metadata.get("retrieval_score", 0.0)
+
+
+def _rerank_cascade(query, docs, score_threshold, final_k):
+    """
+    The tiered reranking plan, written as a generator so the sync and async drivers share it.
+
+    It yields scoring requests (model_name, pairs, wait) and is sent back the scores (or,
+    with wait=False, the pending Future). Stages:
+      1. A cheap first stage ranks every candidate: the retrieval score already on the
+         documents ("embedding") or a small cross-encoder ("cross_encoder").
+      2. If the gap at the final_k cut is at least RERANK_EARLY_EXIT_MARGIN, the first stage
+         has decided the result and the large cross-encoder is skipped. For "embedding" the
+         gap is measured in embedding similarity, not the fused hybrid score, and there is no
+         early exit when a candidate was only found lexically (it has no similarity to compare).
+         The kept documents are filtered like the large stage's, with their first-stage
+         score as "rerank_score".
+      3. Otherwise the large cross-encoder scores only the RERANK_FIRST_STAGE_KEEP survivors.
+    A RERANK_AUDIT_RATE sample of queries is also scored in full in the background to log
+    the cascade's recall against the full rerank.
+    """
+    timings = {}
+    candidates = docs
+    early_exit = False
+    exit_ranked = None
+
+    if RERANK_FIRST_STAGE and docs:
+        start = time.perf_counter()
+        if RERANK_FIRST_STAGE == "embedding":
+            first_scores = [doc.metadata.get("retrieval_score", 0.0) for doc in docs]
+        else:
+            first_scores = yield RERANK_FIRST_STAGE_MODEL, [(query, doc.page_content) for doc in docs], True
+        first_ranked = sorted(zip(docs, first_scores), key=lambda x: x[1], reverse=True)
+        candidates = [doc for doc, _ in first_ranked[:RERANK_FIRST_STAGE_KEEP]]
+
+        # The early exit compares scores on the scale its margin is set in
+        exit_ranked = first_ranked
+        if RERANK_FIRST_STAGE == "embedding":
+            similarities = [_embedding_similarity(doc) for doc in docs]
+            exit_ranked = None
+            if None not in similarities:
+                exit_ranked = sorted(zip(docs, similarities), key=lambda x: x[1], reverse=True)
+
+        margin = RERANK_EARLY_EXIT_MARGIN.get(RERANK_FIRST_STAGE)
+        if margin is not None and exit_ranked is not None and len(exit_ranked) > final_k:
+            early_exit = exit_ranked[final_k - 1][1] - exit_ranked[final_k][1] >= margin
+        timings["first_stage_ms"] = (time.perf_counter() - start) * 1000
+
+    if early_exit:
+        # Same threshold and "rerank_score" stamping as the large stage, on the first-stage scores
+        final_docs = _rank_and_filter(
+            [doc for doc, _ in exit_ranked], [score for _, score in exit_ranked], score_threshold, final_k
+        )
+    else:
+        start = time.perf_counter()
+        scores = yield RERANKER_MODEL_NAME, [(query, doc.page_content) for doc in candidates], True
+        final_docs = _rank_and_filter(candidates, scores, score_threshold, final_k)
+        timings["large_stage_ms"] = (time.perf_counter() - start) * 1000
+
+    for name, ms in timings.items():
+        record(f"rerank_{name[:-len('_ms')]}", ms / 1000)
+    logging.info(
+        f"Rerank cascade: first_stage={RERANK_FIRST_STAGE} candidates={len(docs)} "
+        f"survivors={len(candidates)} early_exit={early_exit} kept={len(final_docs)} "
+        + " ".join(f"{name}={ms:.1f}" for name, ms in timings.items())
+    )
+
+    if len(candidates) < len(docs) or early_exit:
+        if random.random() < RERANK_AUDIT_RATE:
+            future = yield RERANKER_MODEL_NAME, [(query, doc.page_content) for doc in docs], False
+            future.add_done_callback(lambda f: _log_audit(query, final_docs, docs, final_k, f))
+
+    return final_docs
+
+
+def rerank_documents_with_scores(query, docs, score_threshold=0, final_k=RERANK_FINAL_K):
+    # Every scoring request goes through the shared micro-batching service for its model
+    plan = _rerank_cascade(query, docs, score_threshold, final_k)
+    try:
+        model_name, pairs, wait = next(plan)
+        while True:
+            future = get_rerank_service(model_name).submit(pairs)
+            model_name, pairs, wait = plan.send(future.result() if wait else future)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arerank_documents_with_scores(query, docs, score_threshold=0, final_k=RERANK_FINAL_K):
+    """Async counterpart of rerank_documents_with_scores; awaits the service without blocking the loop."""
+    plan = _rerank_cascade(query, docs, score_threshold, final_k)
+    try:
+        model_name, pairs, wait = next(plan)
+        while True:
+            future = get_rerank_service(model_name).submit(pairs)
+            model_name, pairs, wait = plan.send(await asyncio.wrap_future(future) if wait else future)
+    except StopIteration as stop:
+        return stop.value
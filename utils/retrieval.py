@@ -0,0 +1,177 @@
+# utils/retrieval.py
+
+import asyncio
+import hashlib
+import logging
+
+from langchain.schema import Document as LangChainDocument
+
+from config import RETRIEVAL_K, HYBRID_SEARCH_K, RRF_K
+from utils.telemetry import span
+
+
+def _distance_to_similarity(vectorstore):
+    """
+    Maps Chroma distances to a similarity where higher is better.
+    BGE embeddings are unit-length, so squared L2 (Chroma's default) is 2 - 2*cos.
+    """
+    metadata = vectorstore._collection.metadata or {}
+    if metadata.get("hnsw:space") == "cosine":
+        return lambda distance: 1.0 - distance
+    if metadata.get("hnsw:space") == "ip":
+        return lambda distance: -distance
+    return lambda distance: 1.0 - distance / 2.0
+
+
+def _with_retrieval_scores(vectorstore, results):
+    to_similarity = _distance_to_similarity(vectorstore)
+    docs = []
+    for doc, distance in results:
+        doc.metadata["retrieval_score"] = float(to_similarity(distance))
+        docs.append(doc)
+    return docs
+
+
+def chunk_ids_of(docs):
+    """Stable IDs of retrieved chunks (their Chroma IDs; content hash for documents from elsewhere)."""
+    return [
+        doc.metadata.get("chunk_id") or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+        for doc in docs
+    ]
+
+
+def build_where(filters):
+    """
+    Translates retrieval filters into a Chroma `where` clause (None when nothing is filtered).
+    Supported keys: "sources" (file names), "document_ids" and "ingested_after" (epoch seconds).
+    """
+    filters = filters or {}
+    clauses = []
+    if filters.get("sources"):
+        clauses.append({"source": {"$in": list(filters["sources"])}})
+    if filters.get("document_ids"):
+        clauses.append({"document_id": {"$in": list(filters["document_ids"])}})
+    if filters.get("ingested_after") is not None:
+        clauses.append({"ingested_at": {"$gte": int(filters["ingested_after"])}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _to_document(chunk_id, text, metadata):
+    # The Chroma ID is the chunk's ID everywhere (lexical index, answer cache). Chunks
+    # ingested before chunk IDs existed have a random Chroma ID and no "chunk_id" metadata.
+    return LangChainDocument(page_content=text, metadata={**(metadata or {}), "chunk_id": chunk_id})
+
+
+def _dense_search(vectorstore, query, k, query_embedding, where):
+    """Nearest chunks as (document, distance) pairs, queried on the collection so the Chroma IDs come back."""
+    with span("dense_search"):
+        if query_embedding is None:
+            query_embedding = vectorstore.embeddings.embed_query(query)
+        result = vectorstore._collection.query(
+            query_embeddings=[query_embedding], n_results=k, where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+    return [
+        (_to_document(chunk_id, text, metadata), distance)
+        for chunk_id, text, metadata, distance in zip(
+            result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+        )
+    ]
+
+
+def _fetch_documents(vectorstore, chunk_ids, where=None):
+    """Loads chunks by ID from the vector store, in the given order (skipping any `where` excludes)."""
+    if not chunk_ids:
+        return []
+    result = vectorstore._collection.get(ids=list(chunk_ids), where=where, include=["documents", "metadatas"])
+    by_id = {
+        chunk_id: _to_document(chunk_id, text, metadata)
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K):
+    """
+    Fuses several best-first lists of IDs: score(id) = sum over lists of 1 / (rrf_k + rank).
+    Returns (id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _hybrid_candidates(vectorstore, lexical_index, query, k, query_embedding, filters):
+    """
+    Dense and lexical retrieval fused with reciprocal rank fusion. Both sides fetch
+    HYBRID_SEARCH_K candidates; the best k fused chunks are returned. Each document keeps
+    its dense similarity in "dense_score" and BM25 score in "lexical_score", while
+    "retrieval_score" holds the fused score scaled to [0, 1] (1 = ranked first by both).
+    """
+    search_k = max(k, HYBRID_SEARCH_K)
+    filters = filters or {}
+    where = build_where(filters)
+    dense_results = _dense_search(vectorstore, query, search_k, query_embedding, where)
+    with span("lexical_search"):
+        lexical_results = lexical_index.search(
+            query, search_k, sources=filters.get("sources"), document_ids=filters.get("document_ids")
+        )
+
+    to_similarity = _distance_to_similarity(vectorstore)
+    docs_by_id = {}
+    dense_ranking = []
+    for doc, distance in dense_results:
+        chunk_id = chunk_ids_of([doc])[0]
+        doc.metadata["dense_score"] = float(to_similarity(distance))
+        docs_by_id.setdefault(chunk_id, doc)
+        dense_ranking.append(chunk_id)
+    lexical_scores = dict(lexical_results)
+    lexical_ranking = [chunk_id for chunk_id, _ in lexical_results]
+
+    fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking])[:k]
+    missing = [chunk_id for chunk_id, _ in fused if chunk_id not in docs_by_id]
+    # The lexical index can't apply every filter (e.g. ingested_after); the fetch enforces the rest
+    for doc in _fetch_documents(vectorstore, missing, where):
+        docs_by_id[chunk_ids_of([doc])[0]] = doc
+
+    max_score = 2.0 / (RRF_K + 1)
+    docs = []
+    for chunk_id, score in fused:
+        doc = docs_by_id.get(chunk_id)
+        if doc is None:
+            continue  # indexed lexically but since deleted from the vector store
+        if chunk_id in lexical_scores:
+            doc.metadata["lexical_score"] = float(lexical_scores[chunk_id])
+        doc.metadata["retrieval_score"] = score / max_score
+        docs.append(doc)
+
+    logging.info(
+        f"Hybrid retrieval: dense={len(dense_ranking)} lexical={len(lexical_ranking)} "
+        f"lexical_only={len(missing)} fused={len(docs)}"
+    )
+    return docs
+
+
+def retrieve_candidates(vectorstore, query, k=RETRIEVAL_K, query_embedding=None, lexical_index=None, filters=None):
+    """
+    Retrieval of the top-k chunks for a query. Each returned document carries a score in
+    metadata["retrieval_score"], which the reranking cascade can use as a free first stage.
+    Pass `query_embedding` to reuse an embedding computed earlier. With a `lexical_index`,
+    dense and BM25 results are fused (see _hybrid_candidates); otherwise retrieval is dense only.
+    `filters` (see build_where) restricts the search to matching chunks, e.g. the documents
+    a chat is about, so scoped questions search and rerank a much smaller candidate set.
+    """
+    if lexical_index is not None:
+        return _hybrid_candidates(vectorstore, lexical_index, query, k, query_embedding, filters)
+    results = _dense_search(vectorstore, query, k, query_embedding, build_where(filters))
+    return _with_retrieval_scores(vectorstore, results)
+
+
+async def aretrieve_candidates(vectorstore, query, k=RETRIEVAL_K, query_embedding=None, lexical_index=None,
+                              filters=None):
+    """Async counterpart of retrieve_candidates."""
+    return await asyncio.to_thread(retrieve_candidates, vectorstore, query, k, query_embedding, lexical_index, filters)
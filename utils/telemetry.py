@@ -0,0 +1,220 @@
+# utils/telemetry.py
+
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from config import (
+    METRICS_SINK,
+    METRICS_JSONL_PATH,
+    METRICS_PROMETHEUS_PATH,
+    METRICS_FLUSH_SECONDS,
+    METRICS_BUCKETS_SECONDS,
+)
+
+# Recorders are callables (stage, seconds, labels) notified when a span ends. With none
+# registered, a span costs two perf_counter() calls.
+_recorders = []
+_recorders_lock = threading.Lock()
+
+# Labels (e.g. org) attached to every span in the current context, see bind_labels().
+_context_labels = contextvars.ContextVar("telemetry_labels", default={})
+
+
+def add_recorder(recorder):
+    with _recorders_lock:
+        _recorders.append(recorder)
+
+
+def remove_recorder(recorder):
+    with _recorders_lock:
+        if recorder in _recorders:
+            _recorders.remove(recorder)
+
+
+def record(stage, seconds, **labels):
+    """Reports a finished stage to every registered recorder."""
+    if not _recorders:
+        return
+    context_labels = _context_labels.get()
+    if context_labels:
+        labels = {**context_labels, **labels}
+    for recorder in list(_recorders):
+        try:
+            recorder(stage, seconds, labels)
+        except Exception:
+            logging.exception(f"Telemetry recorder failed for stage '{stage}'.")
+
+
+@contextmanager
+def span(stage, **labels):
+    """Times the enclosed block as one occurrence of `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _recorders:
+            record(stage, time.perf_counter() - start, **labels)
+
+
+@contextmanager
+def bind_labels(**labels):
+    """Adds labels to every span recorded in this context (threads started via copy_context inherit them)."""
+    token = _context_labels.set({**_context_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _context_labels.reset(token)
+
+
+class StageTotals:
+    """
+    Recorder that sums time and counts per stage, across threads, while it is active:
+
+        with StageTotals() as totals:
+            update_rag_pipeline(...)
+        totals.snapshot()  # {"pdfplumber": {"seconds": 1.2, "count": 10}, ...}
+
+    Spans that run in worker processes (extraction or OCR pools) are not seen here.
+    """
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, seconds, labels):
+        with self._lock:
+            totals = self._totals.setdefault(stage, {"seconds": 0.0, "count": 0})
+            totals["seconds"] += seconds
+            totals["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self._totals.items()}
+
+    def __enter__(self):
+        add_recorder(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_recorder(self)
+
+
+class StageHistograms:
+    """
+    Recorder keeping a cumulative latency histogram per (stage, labels), e.g. per stage
+    per org. Bucket upper bounds are in seconds, like Prometheus histograms.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS_SECONDS):
+        self.buckets = sorted(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, seconds, labels):
+        key = (stage, tuple(sorted((name, str(value)) for name, value in labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, seconds)] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def snapshot(self):
+        """[{"stage", "labels", "buckets": {le: cumulative count}, "sum", "count"}, ...]"""
+        with self._lock:
+            series = [(key, dict(value, counts=list(value["counts"]))) for key, value in self._series.items()]
+        result = []
+        for (stage, labels), value in sorted(series):
+            cumulative, buckets = 0, {}
+            for bound, count in zip([*self.buckets, float("inf")], value["counts"]):
+                cumulative += count
+                buckets["+Inf" if bound == float("inf") else repr(bound)] = cumulative
+            result.append({"stage": stage, "labels": dict(labels), "buckets": buckets,
+                           "sum": value["sum"], "count": value["count"]})
+        return result
+
+    def to_prometheus_text(self, metric_name="askeice_stage_duration_seconds"):
+        """Renders the histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {metric_name} Time spent in each pipeline stage.",
+            f"# TYPE {metric_name} histogram",
+        ]
+        for series in self.snapshot():
+            base_labels = [("stage", series["stage"]), *sorted(series["labels"].items())]
+            for bound, count in series["buckets"].items():
+                lines.append(f"{metric_name}_bucket{{{_format_labels([*base_labels, ('le', bound)])}}} {count}")
+            lines.append(f"{metric_name}_sum{{{_format_labels(base_labels)}}} {series['sum']:.6f}")
+            lines.append(f"{metric_name}_count{{{_format_labels(base_labels)}}} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+class JsonLinesSink:
+    """Recorder appending one JSON object per finished span to a file."""
+    def __init__(self, path):
+        self.path = path.format(pid=os.getpid())
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+    def __call__(self, stage, seconds, labels):
+        line = json.dumps({"ts": time.time(), "stage": stage, "seconds": round(seconds, 6), **labels})
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusTextSink:
+    """
+    Keeps StageHistograms and rewrites them to a Prometheus text file every
+    `flush_seconds` (and at exit), for node_exporter's textfile collector or similar.
+    """
+    def __init__(self, path, flush_seconds=METRICS_FLUSH_SECONDS, histograms=None):
+        self.path = path.format(pid=os.getpid())
+        self.flush_seconds = flush_seconds
+        self.histograms = histograms or StageHistograms()
+        self._last_flush = time.monotonic()
+        self._flush_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        atexit.register(self.flush)
+
+    def __call__(self, stage, seconds, labels):
+        self.histograms(stage, seconds, labels)
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.histograms.to_prometheus_text())
+            os.replace(tmp_path, self.path)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_metrics():
+    """Registers the sink selected by METRICS_SINK ("jsonl", "prometheus" or None) once per process."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+        if METRICS_SINK == "jsonl":
+            add_recorder(JsonLinesSink(METRICS_JSONL_PATH))
+        elif METRICS_SINK == "prometheus":
+            add_recorder(PrometheusTextSink(METRICS_PROMETHEUS_PATH))
+        elif METRICS_SINK:
+            logging.warning(f"Unknown METRICS_SINK '{METRICS_SINK}'; stage metrics are not exported.")